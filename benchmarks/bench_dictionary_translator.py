@@ -0,0 +1,52 @@
+# benchmarks/bench_dictionary_translator.py
+"""Микробенчмарк словарного переводчика.
+
+Показывает, что стоимость вызова растет линейно от числа слов и что
+таблица не пересоздается на каждый вызов (память на вызов не зависит
+от размера словаря).
+
+Запуск: python benchmarks/bench_dictionary_translator.py
+"""
+import os
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.dictionary_translator import dictionary_translator  # noqa: E402
+
+SAMPLE = "красная кошка сидит на крыше старого дома под полной луной".split()
+REPEATS = 2000
+
+
+def make_text(words: int) -> str:
+    return " ".join(SAMPLE[i % len(SAMPLE)] for i in range(words))
+
+
+def per_call_us(text: str) -> float:
+    timer = timeit.Timer(lambda: dictionary_translator.translate_words(text))
+    return min(timer.repeat(repeat=5, number=REPEATS)) / REPEATS * 1e6
+
+
+def peak_alloc_bytes(text: str) -> int:
+    dictionary_translator.translate_words(text)  # Прогрев
+    tracemalloc.start()
+    dictionary_translator.translate_words(text)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    print(f"Словарь: {len(dictionary_translator)} записей\n")
+    print(f"{'слов':>6} {'мкс/вызов':>10} {'мкс/слово':>10} {'пик памяти, Б':>14}")
+
+    for words in (1, 2, 4, 8, 16, 32, 64, 128):
+        text = make_text(words)
+        us = per_call_us(text)
+        print(f"{words:>6} {us:>10.2f} {us / words:>10.3f} {peak_alloc_bytes(text):>14}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+# benchmarks/bench_hot_queries.py
+"""Планы и время частых запросов до и после индексов миграции 0004.
+
+Создает временную SQLite-базу, поднимает схему миграциями до ревизии 0003,
+заполняет ее (по умолчанию 1 000 000 строк: пользователи, заказы, платежи),
+замеряет запросы, затем применяет 0004 и замеряет снова. Для каждого
+запроса печатается EXPLAIN QUERY PLAN и медианное время.
+
+Запуск: python benchmarks/bench_hot_queries.py [--rows 1000000]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+
+from alembic import command  # noqa: E402
+from alembic.config import Config  # noqa: E402
+from sqlalchemy import create_engine, desc, select  # noqa: E402
+
+from database import ALEMBIC_INI, Order, Payment, User  # noqa: E402
+
+REPEATS = 20
+PAYMENT_STATUSES = ("completed", "completed", "completed", "pending", "rejected")
+
+# Те же запросы, что в database.py и обработчиках
+QUERIES = {
+    "история заказов (orders.py)": lambda user_id: (
+        select(Order).where(Order.user_id == user_id).order_by(Order.created_at.desc()).limit(10)
+    ),
+    "ожидающие платежи (админка)": lambda user_id: (
+        select(Payment).where(Payment.status == "pending").order_by(Payment.created_at.desc()).limit(50)
+    ),
+    "завершенные платежи (админка)": lambda user_id: (
+        select(Payment).where(Payment.status == "completed").order_by(Payment.completed_at.desc()).limit(50)
+    ),
+    "ожидающие платежи пользователя": lambda user_id: (
+        select(Payment).where(Payment.user_id == user_id, Payment.status == "pending")
+        .order_by(Payment.created_at.desc())
+    ),
+    "последние пользователи (админка)": lambda user_id: (
+        select(User).order_by(desc(User.created_at)).limit(20)
+    ),
+}
+
+
+def migrate(url: str, revision: str):
+    engine = create_engine(url)
+    with engine.begin() as connection:
+        alembic_config = Config(ALEMBIC_INI)
+        alembic_config.attributes["connection"] = connection
+        command.upgrade(alembic_config, revision)
+    engine.dispose()
+
+
+def seed(path: str, rows: int):
+    """Пользователи 10%, заказы 50%, платежи 40% от rows"""
+    users = max(1, rows // 10)
+    orders = rows // 2
+    payments = rows - users - orders
+    start = datetime(2025, 1, 1)
+    rnd = random.Random(42)
+
+    def moment(i: int, total: int) -> str:
+        return (start + timedelta(seconds=i * 300 * 86400 // max(total, 1))).isoformat(" ")
+
+    db = sqlite3.connect(path)
+    db.executemany(
+        "INSERT INTO users (id, telegram_id, balance, balance_kopecks, is_admin, created_at, free_trials_used) "
+        "VALUES (?, ?, 0, 0, 0, ?, 0)",
+        ((i, 1_000_000 + i, moment(i, users)) for i in range(1, users + 1))
+    )
+    db.executemany(
+        "INSERT INTO orders (user_id, product_type, product_subtype, prompt, result, cost, status, created_at) "
+        "VALUES (?, 'text', 'text_generation', 'prompt', 'result', 15, 'completed', ?)",
+        ((rnd.randint(1, users), moment(i, orders)) for i in range(orders))
+    )
+
+    def payment_rows():
+        for i in range(payments):
+            status = rnd.choice(PAYMENT_STATUSES)
+            created = moment(i, payments)
+            completed = created if status == "completed" else None
+            yield rnd.randint(1, users), status, created, completed
+
+    db.executemany(
+        "INSERT INTO payments (user_id, amount, currency, status, payment_method, created_at, completed_at) "
+        "VALUES (?, 100, 'RUB', ?, 'card', ?, ?)",
+        payment_rows()
+    )
+    db.commit()
+    db.close()
+    return users
+
+
+def compile_sql(statement) -> str:
+    from sqlalchemy.dialects import sqlite
+    return str(statement.compile(dialect=sqlite.dialect(), compile_kwargs={"literal_binds": True}))
+
+
+def measure(path: str, users: int, label: str):
+    db = sqlite3.connect(path)
+    rnd = random.Random(7)
+    print(f"\n=== {label} ===")
+    for name, build in QUERIES.items():
+        sql = compile_sql(build(rnd.randint(1, users)))
+        plan = [row[3] for row in db.execute("EXPLAIN QUERY PLAN " + sql)]
+
+        timings = []
+        for _ in range(REPEATS):
+            query = compile_sql(build(rnd.randint(1, users)))
+            started = time.perf_counter()
+            db.execute(query).fetchall()
+            timings.append(time.perf_counter() - started)
+
+        print(f"{name:<36} {statistics.median(timings) * 1000:9.2f} мс")
+        for step in plan:
+            print(f"    {step}")
+    db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000, help="сколько строк создать всего")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.db")
+        url = f"sqlite:///{path}"
+
+        migrate(url, "0003")
+        started = time.perf_counter()
+        users = seed(path, args.rows)
+        print(f"Заполнено {args.rows} строк за {time.perf_counter() - started:.1f} с")
+
+        measure(path, users, "до индексов (ревизия 0003)")
+        started = time.perf_counter()
+        migrate(url, "head")
+        print(f"\nМиграция 0004 за {time.perf_counter() - started:.1f} с")
+        measure(path, users, "после индексов (ревизия 0004)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+# benchmarks/bench_sharding.py
+"""Пропускная способность обработки обновлений при разном числе шардов.
+
+Фронт раздает синтетические сообщения от множества пользователей через
+ShardRouter, как в режиме SHARD_WORKERS > 1. Обработчик в шарде тратит
+около --work мс процессорного времени (разбор, форматирование, шаблоны -
+то, что в боте упирается в GIL). Печатается число обновлений в секунду
+для 1, 2, 4... шардов (до числа ядер) и ускорение относительно одного.
+
+Запуск: python benchmarks/bench_sharding.py [--updates 4000] [--work 2] [--max-shards 8]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+
+from aiogram import Bot, Dispatcher, Router  # noqa: E402
+from aiogram.types import Message  # noqa: E402
+
+from sharding import ShardRouter  # noqa: E402
+
+USERS = 1000
+
+
+def burn(milliseconds: float):
+    """Чистый Python без ввода-вывода: держит GIL, как реальный обработчик"""
+    deadline = time.process_time() + milliseconds / 1000
+    total = 0
+    while time.process_time() < deadline:
+        total += sum(range(100))
+    return total
+
+
+async def bench_setup(index: int, shards: int):
+    work = float(os.environ["BENCH_WORK_MS"])
+    router = Router()
+
+    @router.message()
+    async def handle(message: Message):
+        burn(work)
+
+    dp = Dispatcher()
+    dp.include_router(router)
+    return Bot(token=os.environ["BOT_TOKEN"]), dp
+
+
+def make_update(update_id: int) -> dict:
+    user_id = 100_000 + update_id % USERS
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "bench"},
+            "text": "/start",
+        },
+    }
+
+
+async def measure(shards: int, updates: int) -> float:
+    router = ShardRouter(bench_setup, workers=shards, queue_size=10_000)
+    router.start()
+    await router.wait_ready()
+
+    started = time.perf_counter()
+    for update_id in range(updates):
+        await router.put(make_update(update_id))
+    # stop() ждет, пока шарды обработают свои очереди
+    await router.stop()
+    return updates / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--updates", type=int, default=4000, help="сколько обновлений отправить")
+    parser.add_argument("--work", type=float, default=2.0, help="мс процессорного времени на обновление")
+    parser.add_argument("--max-shards", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+    os.environ["BENCH_WORK_MS"] = str(args.work)
+
+    print(f"Ядер: {os.cpu_count()}, обновлений: {args.updates}, работа: {args.work} мс")
+    shard_counts = [1]
+    while shard_counts[-1] * 2 <= args.max_shards:
+        shard_counts.append(shard_counts[-1] * 2)
+
+    baseline = None
+    for shards in shard_counts:
+        rate = asyncio.run(measure(shards, args.updates))
+        baseline = baseline or rate
+        print(f"шардов: {shards:<3} {rate:9.0f} обновлений/с   ускорение x{rate / baseline:.2f}")
+
+
+if __name__ == "__main__":
+    main()
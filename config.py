@@ -17,6 +17,18 @@ PRODIA_ENABLED = False
 TENSOR_ART_ENABLED = False
 REPLICATE_API_TOKEN = os.getenv("REPLICATE_API_TOKEN", "")
 
+# ========== ЗАПУСК ==========
+BOT_MODE = os.getenv("BOT_MODE", "polling")  # polling или webhook
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "")  # Публичный https-адрес сервера
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")  # Проверяется в заголовке X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "50"))  # Обновлений, обрабатываемых одновременно
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))  # Принятых, но еще не обработанных
+WEB_SERVER_HOST = os.getenv("WEB_SERVER_HOST", "0.0.0.0")
+WEB_SERVER_PORT = int(os.getenv("PORT", "8080"))
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", "1"))  # Процессов-обработчиков; 1 - все в одном процессе
+SHARD_QUEUE_SIZE = int(os.getenv("SHARD_QUEUE_SIZE", "1000"))  # Обновлений в очереди одного процесса
+
 # ========== РЕКЛАМА ==========
 AD_REWARD_AMOUNT = 50  # Было 10
 AD_WATCH_TIME = 40     # Можно оставить или изменить
@@ -30,6 +42,9 @@ OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama2")
 OLLAMA_TIMEOUT = 300  # 5 минут для генерации
 OLLAMA_CHAT_TIMEOUT = 180  # 3 минуты для чат-запросов
 GENERATION_TIMEOUT = 240
+TEXT_STREAMING_ENABLED = os.getenv("TEXT_STREAMING_ENABLED", "True").lower() == "true"
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.5"))  # Секунды между правками сообщения
+STREAM_EDIT_MIN_CHARS = 20  # Минимум новых символов для очередной правки
 STABLE_DIFFUSION_URL = "http://localhost:7860"
 IMAGE_MODEL = "dreamshaper_8.safetensors"  # или другая модель
 IMAGE_WIDTH = 512
@@ -59,8 +74,24 @@ PRICE_CONFIG = {
 # ========== БАЗА ДАННЫХ ==========
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///database.db")
 
+# Хранилище состояний FSM: sqlite:///path.db, redis://host:port/0 или memory://
+FSM_STORAGE_URL = os.getenv("FSM_STORAGE_URL", "sqlite:///fsm.db")
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", "0.5"))  # Секунды между пакетными записями
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000"))  # Ключей в кэше процесса
+
+# Кэш пользователей и отложенная запись last_active
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "30"))  # Секунды
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+ACTIVITY_FLUSH_INTERVAL = float(os.getenv("ACTIVITY_FLUSH_INTERVAL", "5"))  # Секунды между пакетными UPDATE
+
+# Резервирование средств на время генерации
+HOLD_TTL_SECONDS = int(os.getenv("HOLD_TTL_SECONDS", "900"))  # Дольше очереди и самой долгой генерации
+HOLD_RECLAIM_INTERVAL = float(os.getenv("HOLD_RECLAIM_INTERVAL", "60"))  # Секунды между проверками просроченных
+
 # ========== АДМИНИСТРАТОРЫ ==========
 ADMIN_IDS = list(map(int, os.getenv("ADMIN_IDS", "").split(","))) if os.getenv("ADMIN_IDS") else []
+ADMIN_PAGE_SIZE = int(os.getenv("ADMIN_PAGE_SIZE", "10"))  # Записей на странице списков в админке
+STATS_CACHE_TTL = float(os.getenv("STATS_CACHE_TTL", "60"))  # Секунды жизни кэша статистики админки
 
 # ========== ДРУГИЕ НАСТРОЙКИ ==========
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
@@ -76,9 +107,81 @@ HF_API_TOKEN = os.getenv("HF_API_TOKEN", "")  # Необязательно дл
 # OpenRouter API (бесплатный)
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY", "")
 
+# Prodia (публичный API больше не работает без ключа)
+PRODIA_ENABLED = os.getenv("PRODIA_ENABLED", "False").lower() == "true"
+
 # Включаем генерацию изображений
 STABLE_DIFFUSION_ENABLED = True  # Меняем на True
 
+# Хеджирование запросов к Pollinations (секунды)
+IMAGE_HEDGE_DELAY = float(os.getenv("IMAGE_HEDGE_DELAY", "8"))  # Пока нет статистики задержек
+IMAGE_HEDGE_MIN_DELAY = float(os.getenv("IMAGE_HEDGE_MIN_DELAY", "2"))
+IMAGE_HEDGE_MAX_DELAY = float(os.getenv("IMAGE_HEDGE_MAX_DELAY", "20"))
+IMAGE_HEDGE_DEADLINE = float(os.getenv("IMAGE_HEDGE_DEADLINE", "60"))  # Потом - демо-изображение
+
+# Кэш готовых изображений (байты на диске + Telegram file_id)
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", "cache/images")
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))  # 200 МБ
+
+# Отрисовка демо-изображений (когда бэкенды недоступны)
+FALLBACK_RENDER_WORKERS = int(os.getenv("FALLBACK_RENDER_WORKERS", "2"))  # Процессов в пуле
+
+# Тарифы изображений: ключи - продукты из PRICE_CONFIG.
+# max_side - сторона, которую запрашиваем у бэкенда и до которой уменьшаем
+# ответ (меньшие не увеличиваются), max_bytes - целевой размер JPEG,
+# send_original - прислать еще и оригинал файлом
+IMAGE_TIERS = {
+    'image_sd': {'max_side': 512, 'max_bytes': 200 * 1024, 'send_original': False},
+    'image_generation': {'max_side': IMAGE_WIDTH, 'max_bytes': 600 * 1024, 'send_original': False},
+    'image_hd': {'max_side': 1024, 'max_bytes': 1024 * 1024, 'send_original': False},
+    'image_4k': {'max_side': 2048, 'max_bytes': 4 * 1024 * 1024, 'send_original': True},
+}
+IMAGE_POSTPROCESS_WORKERS = int(os.getenv("IMAGE_POSTPROCESS_WORKERS", "2"))  # Потоков для Pillow
+# Меню платных тарифов SD/HD/4K. Включение - решение по ценам, а не по
+# обработке, поэтому по умолчанию меню скрыто и кнопки тарифов, как и
+# раньше, отвечают "в разработке"; обычная генерация идет по тарифу image_generation
+IMAGE_TIERS_MENU_ENABLED = os.getenv("IMAGE_TIERS_MENU_ENABLED", "False").lower() == "true"
+
+# ========== ПЕРЕВОД ==========
+TRANSLATION_TIMEOUT = float(os.getenv("TRANSLATION_TIMEOUT", "5"))  # Секунды на один перевод
+TRANSLATION_WORKERS = int(os.getenv("TRANSLATION_WORKERS", "4"))  # Потоки для синхронного googletrans
+TRANSLATION_CACHE_SIZE = int(os.getenv("TRANSLATION_CACHE_SIZE", "2000"))
+TRANSLATION_CACHE_TTL = int(os.getenv("TRANSLATION_CACHE_TTL", str(7 * 24 * 3600)))  # Неделя
+TRANSLATION_CACHE_DB = os.getenv("TRANSLATION_CACHE_DB", "cache/translations.db")  # Пусто - только память
+
+# ========== ЗДОРОВЬЕ БЭКЕНДОВ ==========
+BREAKER_FAILURE_RATE = float(os.getenv("BREAKER_FAILURE_RATE", "0.5"))  # Доля ошибок для отключения
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "4"))  # Меньше вызовов - не судим
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", "20"))  # Последних вызовов в окне
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "60"))  # Первое отключение
+BREAKER_MAX_OPEN_SECONDS = float(os.getenv("BREAKER_MAX_OPEN_SECONDS", "1800"))  # Потолок отключения
+BREAKER_SLOW_CALL_SECONDS = float(os.getenv("BREAKER_SLOW_CALL_SECONDS", "45"))  # Медленнее - считаем ошибкой
+
+# ========== ОЧЕРЕДЬ ГЕНЕРАЦИЙ ==========
+GENERATION_MAX_CONCURRENT = int(os.getenv("GENERATION_MAX_CONCURRENT", "8"))  # Всего одновременных генераций
+GENERATION_BACKEND_LIMITS = {
+    'ollama': int(os.getenv("OLLAMA_MAX_CONCURRENT", "2")),  # Локальная модель, держим мало
+    'image': int(os.getenv("IMAGE_MAX_CONCURRENT", "6")),
+}
+
+# ========== HTTP-КЛИЕНТ ==========
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", "100"))  # Всего соединений в пуле
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", "20"))
+HTTP_DNS_CACHE_TTL = int(os.getenv("HTTP_DNS_CACHE_TTL", "300"))  # Секунды
+HTTP_KEEPALIVE_TIMEOUT = int(os.getenv("HTTP_KEEPALIVE_TIMEOUT", "30"))  # Секунды
+
+# ========== ЛИМИТЫ TELEGRAM API ==========
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))  # Сообщений и правок в секунду на бота
+TELEGRAM_PER_CHAT_RATE = float(os.getenv("TELEGRAM_PER_CHAT_RATE", "1"))  # Сообщений в секунду в один чат
+TELEGRAM_PER_CHAT_BURST = float(os.getenv("TELEGRAM_PER_CHAT_BURST", "3"))  # Сколько можно отправить в чат подряд
+TELEGRAM_MAX_RETRIES = int(os.getenv("TELEGRAM_MAX_RETRIES", "2"))  # Повторов после RetryAfter
+
+# ========== РАССЫЛКА ==========
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))  # Сообщений в секунду (лимит Telegram ~30)
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "10"))  # Одновременных запросов send_message
+BROADCAST_CHUNK_SIZE = int(os.getenv("BROADCAST_CHUNK_SIZE", "500"))  # Получателей между сохранениями прогресса
+BROADCAST_LEASE_SECONDS = int(os.getenv("BROADCAST_LEASE_SECONDS", "60"))  # Без продления рассылку подхватит другой процесс
+
 # config.py - добавьте в конец
 # ========== ПРОВЕРКИ ==========
 if not BOT_TOKEN:
@@ -2,14 +2,20 @@
 from datetime import datetime, timezone
 from sqlalchemy import DateTime
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
-from sqlalchemy.orm import declarative_base, Mapped, mapped_column, relationship
-from sqlalchemy import Integer, String, Boolean, DateTime, Text, Float, select, func, ForeignKey
-from datetime import datetime
+from sqlalchemy.orm import declarative_base, Mapped, mapped_column, relationship, joinedload
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy import Column, Index, Integer, String, Boolean, Date, DateTime, Text, Float, select, func, update, ForeignKey, inspect, tuple_
+from datetime import date, datetime
+from collections import OrderedDict
+from dataclasses import dataclass
+import asyncio
+import os
+import time
 import pytz
-from typing import Optional, List
+from typing import Callable, Dict, Optional, List
 import logging
 
-from config import DATABASE_URL
+from config import DATABASE_URL, USER_CACHE_TTL, USER_CACHE_SIZE, ACTIVITY_FLUSH_INTERVAL, ADMIN_PAGE_SIZE
 
 logger = logging.getLogger(__name__)
 
@@ -23,13 +29,19 @@ AsyncSessionLocal = async_sessionmaker(engine, class_=AsyncSession, expire_on_co
 
 class User(Base):
     __tablename__ = 'users'
-    __table_args__ = {'extend_existing': True}
+    __table_args__ = (
+        Index("ix_users_created_at", "created_at"),
+        {'extend_existing': True},
+    )
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     telegram_id: Mapped[int] = mapped_column(Integer, unique=True, nullable=False)
     username: Mapped[Optional[str]] = mapped_column(String(100), nullable=True)
     first_name: Mapped[Optional[str]] = mapped_column(String(100), nullable=True)
     last_name: Mapped[Optional[str]] = mapped_column(String(100), nullable=True)
-    balance: Mapped[float] = mapped_column(Float, default=0.0)
+    # Баланс в копейках; меняется только через ledger.debit/credit
+    balance_kopecks: Mapped[int] = mapped_column(Integer, default=0, server_default="0", nullable=False)
+    # Старая float-колонка, осталась в существующих базах (NOT NULL без значения по умолчанию)
+    legacy_balance: Mapped[Optional[float]] = mapped_column("balance", Float, default=0.0, nullable=True)
     is_admin: Mapped[bool] = mapped_column(Boolean, default=False)
     created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
     last_active = Column(DateTime(timezone=True), nullable=True)
@@ -40,11 +52,25 @@ class User(Base):
     # Отношения
     payments: Mapped[List["Payment"]] = relationship("Payment", back_populates="user")
     orders: Mapped[List["Order"]] = relationship("Order", back_populates="user")
+    
+    @hybrid_property
+    def balance(self) -> float:
+        """Баланс в рублях (только чтение)"""
+        return self.balance_kopecks / 100
+    
+    @balance.inplace.expression
+    @classmethod
+    def _balance_expression(cls):
+        return cls.balance_kopecks / 100.0
 
 
 class Order(Base):
     __tablename__ = "orders"
-    __table_args__ = {'extend_existing': True} 
+    __table_args__ = (
+        # История заказов пользователя, новые сверху
+        Index("ix_orders_user_id_created_at", "user_id", "created_at"),
+        {'extend_existing': True},
+    )
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     user_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id"))
     product_type: Mapped[str] = mapped_column(String(50), nullable=False)
@@ -61,7 +87,14 @@ class Order(Base):
 
 class Payment(Base):
     __tablename__ = "payments"
-    __table_args__ = {'extend_existing': True}
+    __table_args__ = (
+        # Списки платежей в админке по статусу
+        Index("ix_payments_status_created_at", "status", "created_at"),
+        Index("ix_payments_status_completed_at", "status", "completed_at"),
+        # Ожидающие платежи пользователя
+        Index("ix_payments_user_id_status_created_at", "user_id", "status", "created_at"),
+        {'extend_existing': True},
+    )
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     user_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id"))
     amount: Mapped[float] = mapped_column(Float, nullable=False)
@@ -77,20 +110,220 @@ class Payment(Base):
     user: Mapped["User"] = relationship("User", back_populates="payments")
 
 
-async def init_db():
-    """Инициализация базы данных"""
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
-    logger.info("База данных инициализирована")
+class BalanceTransaction(Base):
+    """Журнал движений по балансу (только добавление)"""
+    __tablename__ = "balance_transactions"
+    __table_args__ = {'extend_existing': True}
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    user_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    amount_kopecks: Mapped[int] = mapped_column(Integer, nullable=False)  # > 0 зачисление, < 0 списание
+    balance_after_kopecks: Mapped[int] = mapped_column(Integer, nullable=False)
+    reason: Mapped[str] = mapped_column(String(50), nullable=False)
+    order_id: Mapped[Optional[int]] = mapped_column(Integer, ForeignKey("orders.id"), nullable=True)
+    payment_id: Mapped[Optional[int]] = mapped_column(Integer, ForeignKey("payments.id"), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=lambda: datetime.now(pytz.UTC))
+    
+    # Отношения
+    order: Mapped[Optional["Order"]] = relationship("Order")
+    payment: Mapped[Optional["Payment"]] = relationship("Payment")
+
+
+class BalanceHold(Base):
+    """Средства, зарезервированные на время генерации"""
+    __tablename__ = "balance_holds"
+    __table_args__ = (
+        # Поиск просроченных резервов
+        Index("ix_balance_holds_status_expires_at", "status", "expires_at"),
+        {'extend_existing': True},
+    )
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    user_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    amount_kopecks: Mapped[int] = mapped_column(Integer, nullable=False)
+    reason: Mapped[str] = mapped_column(String(50), nullable=False)
+    status: Mapped[str] = mapped_column(String(20), default="held")  # held, captured, released, expired
+    order_id: Mapped[Optional[int]] = mapped_column(Integer, ForeignKey("orders.id"), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=lambda: datetime.now(pytz.UTC))
+    expires_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    settled_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+
+
+class AdDailyCounter(Base):
+    """Просмотры рекламы пользователя за сутки (UTC) - одна строка на день"""
+    __tablename__ = "ad_daily_counters"
+    __table_args__ = {'extend_existing': True}
+    user_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id"), primary_key=True)
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    views: Mapped[int] = mapped_column(Integer, default=0, server_default="0", nullable=False)
+    earned_kopecks: Mapped[int] = mapped_column(Integer, default=0, server_default="0", nullable=False)
+    bonus_claimed: Mapped[bool] = mapped_column(Boolean, default=False, server_default="0", nullable=False)
+
+
+class Broadcast(Base):
+    """Рассылка всем пользователям; прогресс сохраняется и переживает перезапуск"""
+    __tablename__ = "broadcasts"
+    __table_args__ = {'extend_existing': True}
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    text: Mapped[str] = mapped_column(Text, nullable=False)
+    status: Mapped[str] = mapped_column(String(20), default="running", index=True)  # running, completed, cancelled, failed
+    admin_chat_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    status_message_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    last_user_id: Mapped[int] = mapped_column(Integer, default=0, nullable=False)  # Курсор по users.id
+    total: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    sent: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    failed: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    owner: Mapped[Optional[str]] = mapped_column(String(100), nullable=True)  # Процесс, который ведет рассылку
+    lease_until: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)  # Пока не истекло, рассылка занята
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=lambda: datetime.now(pytz.UTC))
+    finished_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+
+
+class DailyStats(Base):
+    """Дневные итоги для админки (UTC), обновляются при записи (см. stats.py)"""
+    __tablename__ = "daily_stats"
+    __table_args__ = {'extend_existing': True}
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    new_users: Mapped[int] = mapped_column(Integer, default=0, server_default="0", nullable=False)
+    orders: Mapped[int] = mapped_column(Integer, default=0, server_default="0", nullable=False)
+    payments_count: Mapped[int] = mapped_column(Integer, default=0, server_default="0", nullable=False)
+    payments_kopecks: Mapped[int] = mapped_column(Integer, default=0, server_default="0", nullable=False)
+
+
+ALEMBIC_INI = os.path.join(os.path.dirname(os.path.abspath(__file__)), "alembic.ini")
+
+# Ревизия, соответствующая схеме баз, созданных через create_all до миграций
+LEGACY_REVISION = "0001"
+
+
+def _run_migrations(connection):
+    from alembic import command
+    from alembic.config import Config
+
+    alembic_config = Config(ALEMBIC_INI)
+    alembic_config.attributes["connection"] = connection
+
+    tables = set(inspect(connection).get_table_names())
+    if "users" in tables and "alembic_version" not in tables:
+        # Следующие миграции сами пропускают уже существующие таблицы и колонки
+        logger.info(f"Существующая база без версии схемы, отмечаем ревизию {LEGACY_REVISION}")
+        command.stamp(alembic_config, LEGACY_REVISION)
+
+    command.upgrade(alembic_config, "head")
 
 
 async def init_db():
-    """Инициализация базы данных"""
+    """Инициализация базы данных: применяет миграции из migrations/"""
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_run_migrations)
     logger.info("База данных инициализирована")
 
 
+class UserCache:
+    """Кэш пользователей по telegram_id.
+
+    Хранит отсоединенные от сессии объекты User; в новую сессию они
+    попадают через merge(load=False), без SELECT. Запись живет ttl секунд,
+    а при изменении баланса извне (админка, платежи) сбрасывается явно.
+    """
+    
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._users: "OrderedDict[int, tuple]" = OrderedDict()  # telegram_id -> (User, время)
+        # Вызывается при сбросе записи; в режиме шардов сообщает процессу,
+        # который обслуживает пользователя
+        self.on_invalidate: Optional[Callable[[int], None]] = None
+    
+    def get(self, telegram_id: int) -> Optional[User]:
+        entry = self._users.get(telegram_id)
+        if entry is None:
+            return None
+        user, cached_at = entry
+        if time.monotonic() - cached_at > self.ttl:
+            del self._users[telegram_id]
+            return None
+        self._users.move_to_end(telegram_id)
+        return user
+    
+    def put(self, user: User):
+        """Кэширует пользователя, если все поля загружены и нет несохраненных изменений"""
+        state = inspect(user)
+        unloaded_columns = state.unloaded & set(state.mapper.column_attrs.keys())
+        if unloaded_columns or state.modified or not state.has_identity:
+            self.invalidate(user.telegram_id)
+            return
+        
+        self._users[user.telegram_id] = (user, time.monotonic())
+        self._users.move_to_end(user.telegram_id)
+        while len(self._users) > self.max_size:
+            self._users.popitem(last=False)
+    
+    def invalidate(self, telegram_id: int, notify: bool = True):
+        self._users.pop(telegram_id, None)
+        if notify and self.on_invalidate is not None:
+            self.on_invalidate(telegram_id)
+
+
+class UserActivityBuffer:
+    """Отложенная запись last_active.
+
+    Отметки активности копятся в памяти (для каждого пользователя хранится
+    только последняя) и раз в flush_interval пишутся одним пакетным UPDATE.
+    """
+    
+    def __init__(self, flush_interval: float):
+        self.flush_interval = flush_interval
+        self._pending: Dict[int, datetime] = {}  # users.id -> last_active
+        self._task: Optional[asyncio.Task] = None
+    
+    def touch(self, user_id: int):
+        self._pending[user_id] = datetime.now(pytz.UTC)
+    
+    async def flush(self):
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        
+        try:
+            async with AsyncSessionLocal() as session:
+                # ORM bulk UPDATE по первичному ключу - один executemany
+                await session.execute(
+                    update(User),
+                    [{"id": user_id, "last_active": when} for user_id, when in batch.items()]
+                )
+                await session.commit()
+            logger.debug(f"Обновлен last_active для {len(batch)} пользователей")
+        except Exception as e:
+            logger.error(f"❌ Ошибка записи активности пользователей: {e}")
+            # Не теряем отметки: более свежие уже могли прийти заново
+            for user_id, when in batch.items():
+                self._pending.setdefault(user_id, when)
+    
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        """Останавливает фоновую запись и сбрасывает остаток"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+    
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+
+# Глобальные экземпляры
+user_cache = UserCache(USER_CACHE_TTL, USER_CACHE_SIZE)
+activity_buffer = UserActivityBuffer(ACTIVITY_FLUSH_INTERVAL)
+
+
 async def get_or_create_user(
     session: AsyncSession,
     telegram_id: int,
@@ -98,7 +331,17 @@ async def get_or_create_user(
     first_name: Optional[str] = None,
     last_name: Optional[str] = None
 ) -> User:
-    """Получить или создать пользователя"""
+    """Получить или создать пользователя.
+    
+    Известный пользователь берется из кэша без обращения к БД, а отметка
+    last_active уходит в отложенную пакетную запись.
+    """
+    cached = user_cache.get(telegram_id)
+    if cached is not None:
+        user = await session.merge(cached, load=False)
+        activity_buffer.touch(user.id)
+        return user
+    
     result = await session.execute(
         select(User).where(User.telegram_id == telegram_id)
     )
@@ -110,7 +353,7 @@ async def get_or_create_user(
             username=username,
             first_name=first_name,
             last_name=last_name,
-            balance=0.0,
+            balance_kopecks=0,
             free_trials_used=0,
             is_admin=False
         )
@@ -119,38 +362,78 @@ async def get_or_create_user(
         await session.refresh(user)
         logger.info(f"Создан новый пользователь: {telegram_id}")
     else:
-        user.last_active = datetime.now(pytz.UTC)
-        await session.commit()
+        activity_buffer.touch(user.id)
     
     return user
 
 
-async def get_pending_payments(session: AsyncSession, limit: int = 50):
-    """Получить список ожидающих платежей"""
-    result = await session.execute(
-        select(Payment)
-        .where(Payment.status == "pending")
-        .order_by(Payment.created_at.desc())
-        .limit(limit)
-    )
-    return result.scalars().all()
+@dataclass
+class Page:
+    """Страница списка при keyset-пагинации"""
+    items: list
+    has_prev: bool
+    has_next: bool
 
 
-async def get_completed_payments(session: AsyncSession, limit: int = 50):
-    """Получить список завершенных платежей"""
-    result = await session.execute(
+async def get_payments_page(
+    session: AsyncSession,
+    status: str,
+    after_id: Optional[int] = None,
+    before_id: Optional[int] = None,
+    limit: int = ADMIN_PAGE_SIZE
+) -> Page:
+    """Страница платежей со статусом status, новые сверху.
+
+    Пагинация по ключу (дата, id): after_id - следующая страница после
+    этого платежа, before_id - предыдущая. В отличие от OFFSET стоимость
+    не растет с номером страницы, а пользователь подгружается тем же
+    запросом (JOIN), без отдельного SELECT на каждый платеж.
+    """
+    # Завершенные сортируются по дате завершения, остальные по дате создания
+    sort_column = Payment.completed_at if status == "completed" else Payment.created_at
+    sort_key = tuple_(sort_column, Payment.id)
+    
+    query = (
         select(Payment)
-        .where(Payment.status == "completed")
-        .order_by(Payment.completed_at.desc())
-        .limit(limit)
+        .options(joinedload(Payment.user))
+        .where(Payment.status == status)
     )
-    return result.scalars().all()
+    
+    cursor_id = before_id if before_id is not None else after_id
+    if cursor_id is not None:
+        cursor = (await session.execute(
+            select(sort_column, Payment.id).where(Payment.id == cursor_id)
+        )).one_or_none()
+        if cursor is None:
+            # Платеж-курсор удален - начинаем с первой страницы
+            after_id = before_id = None
+        elif before_id is not None:
+            query = query.where(sort_key > tuple_(*cursor))
+        else:
+            query = query.where(sort_key < tuple_(*cursor))
+    
+    if before_id is not None:
+        # Идем назад: берем ближайшие более новые и разворачиваем
+        query = query.order_by(sort_column.asc(), Payment.id.asc())
+    else:
+        query = query.order_by(sort_column.desc(), Payment.id.desc())
+    
+    # Лишняя запись показывает, есть ли еще страница в ту же сторону
+    result = await session.execute(query.limit(limit + 1))
+    items = list(result.scalars().all())
+    has_more = len(items) > limit
+    items = items[:limit]
+    
+    if before_id is not None:
+        items.reverse()
+        return Page(items=items, has_prev=has_more, has_next=True)
+    return Page(items=items, has_prev=after_id is not None, has_next=has_more)
 
 
 async def get_payment_by_id(session: AsyncSession, payment_id: int):
-    """Получить платеж по ID"""
+    """Получить платеж по ID (вместе с пользователем)"""
     result = await session.execute(
-        select(Payment).where(Payment.id == payment_id)
+        select(Payment).options(joinedload(Payment.user)).where(Payment.id == payment_id)
     )
     return result.scalar_one_or_none()
 
@@ -161,7 +444,15 @@ async def update_payment_status(
     status: str,
     comment: str = None
 ) -> bool:
-    """Обновить статус платежа"""
+    """Обновить статус платежа.
+
+    Переход в completed - один условный UPDATE ... RETURNING: из нескольких
+    одновременных подтверждений (два админа, админ и вебхук) средства
+    зачислит только одно, остальные получат False.
+    """
+    if status == "completed":
+        return await _complete_payment(session, payment_id, comment)
+    
     result = await session.execute(
         select(Payment).where(Payment.id == payment_id)
     )
@@ -172,16 +463,6 @@ async def update_payment_status(
         if comment:
             payment.comment = comment
         
-        if status == "completed":
-            # Находим пользователя и пополняем баланс
-            user_result = await session.execute(
-                select(User).where(User.id == payment.user_id)
-            )
-            user = user_result.scalar_one_or_none()
-            if user:
-                user.balance += payment.amount
-                payment.completed_at = datetime.now(pytz.UTC)
-        
         await session.commit()
         logger.info(f"Статус платежа {payment_id} обновлен на '{status}'")
         return True
@@ -189,6 +470,44 @@ async def update_payment_status(
     return False
 
 
+async def _complete_payment(session: AsyncSession, payment_id: int, comment: Optional[str]) -> bool:
+    from ledger import credit, to_kopecks
+    from stats import record_completed_payment
+    
+    completed_at = datetime.now(pytz.UTC)
+    values = {"status": "completed", "completed_at": completed_at}
+    if comment:
+        values["comment"] = comment
+    
+    result = await session.execute(
+        update(Payment)
+        .where(Payment.id == payment_id, Payment.status != "completed")
+        .values(**values)
+        .returning(Payment.user_id, Payment.amount)
+    )
+    row = result.one_or_none()
+    if row is None:
+        logger.warning(f"Платеж {payment_id} не найден или уже подтвержден")
+        return False
+    
+    # Находим пользователя и пополняем баланс
+    user_result = await session.execute(
+        select(User).where(User.id == row.user_id)
+    )
+    user = user_result.scalar_one_or_none()
+    if user:
+        payment = await session.get(Payment, payment_id)
+        await credit(session, user, to_kopecks(row.amount), "payment", payment=payment)
+        user_cache.invalidate(user.telegram_id)
+    
+    # UPDATE идет мимо after_flush, поэтому дневные итоги - явно
+    await record_completed_payment(session, completed_at, row.amount)
+    
+    await session.commit()
+    logger.info(f"Статус платежа {payment_id} обновлен на 'completed'")
+    return True
+
+
 async def get_pending_payments_for_user(session: AsyncSession, user_id: int):
     """Получить ожидающие платежи пользователя"""
     result = await session.execute(
@@ -197,3 +516,86 @@ async def get_pending_payments_for_user(session: AsyncSession, user_id: int):
         .order_by(Payment.created_at.desc())
     )
     return result.scalars().all()
+
+
+# ========== СЧЕТЧИКИ РЕКЛАМЫ ==========
+
+def ad_day(now: Optional[datetime] = None) -> date:
+    """Сутки счетчика рекламы (по UTC)"""
+    return (now or datetime.now(pytz.UTC)).astimezone(pytz.UTC).date()
+
+
+def dialect_insert(model):
+    """INSERT с поддержкой ON CONFLICT на диалекте текущей базы"""
+    if engine.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif engine.dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise NotImplementedError(f"Диалект {engine.dialect.name} не поддерживается")
+    return insert(model)
+
+
+def _insert_ignore(model):
+    """INSERT ... ON CONFLICT DO NOTHING"""
+    return dialect_insert(model).on_conflict_do_nothing()
+
+
+async def get_ad_counter(session: AsyncSession, user_id: int, day: Optional[date] = None) -> Optional[AdDailyCounter]:
+    """Счетчик просмотров за день - точечный поиск по первичному ключу"""
+    return await session.get(AdDailyCounter, (user_id, day or ad_day()), populate_existing=True)
+
+
+async def increment_ad_views(
+    session: AsyncSession,
+    user_id: int,
+    reward_kopecks: int,
+    limit: int
+) -> Optional[int]:
+    """Засчитывает просмотр рекламы, если дневной лимит не исчерпан.
+
+    Возвращает номер просмотра за день или None, если лимит достигнут.
+    Условный UPDATE не даст параллельным подтверждениям превысить лимит.
+    Коммит делает вызывающий код, вместе с начислением.
+    """
+    day = ad_day()
+    await session.execute(_insert_ignore(AdDailyCounter).values(user_id=user_id, day=day))
+    result = await session.execute(
+        update(AdDailyCounter)
+        .where(
+            AdDailyCounter.user_id == user_id,
+            AdDailyCounter.day == day,
+            AdDailyCounter.views < limit
+        )
+        .values(
+            views=AdDailyCounter.views + 1,
+            earned_kopecks=AdDailyCounter.earned_kopecks + reward_kopecks
+        )
+        .returning(AdDailyCounter.views)
+        .execution_options(synchronize_session=False)
+    )
+    return result.scalar_one_or_none()
+
+
+async def claim_ad_bonus(session: AsyncSession, user_id: int, threshold: int) -> bool:
+    """Отмечает ежедневный бонус полученным; False, если рано или уже получен"""
+    result = await session.execute(
+        update(AdDailyCounter)
+        .where(
+            AdDailyCounter.user_id == user_id,
+            AdDailyCounter.day == ad_day(),
+            AdDailyCounter.views >= threshold,
+            AdDailyCounter.bonus_claimed.is_(False)
+        )
+        .values(bonus_claimed=True)
+        .returning(AdDailyCounter.user_id)
+        .execution_options(synchronize_session=False)
+    )
+    return result.scalar_one_or_none() is not None
+
+
+# Слушатель after_flush, который ведет daily_stats, регистрируется при
+# импорте stats. Импорт здесь, в конце модуля (stats сам импортирует
+# database), чтобы итоги обновлял любой процесс, работающий с базой, - а не
+# только тот, где случайно загружена админка.
+import stats  # noqa: E402,F401
@@ -0,0 +1,303 @@
+# fsm_storage.py
+import asyncio
+import json
+import logging
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+
+from config import FSM_STORAGE_URL, FSM_FLUSH_INTERVAL, FSM_CACHE_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+# ========== СЕРИАЛИЗАЦИЯ ==========
+
+def _json_default(value: Any):
+    """datetime в данных FSM (например, время начала просмотра рекламы)"""
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    if isinstance(value, date):
+        return {"__date__": value.isoformat()}
+    raise TypeError(f"Тип {type(value).__name__} нельзя сохранить в FSM")
+
+
+def _json_object_hook(obj: Dict[str, Any]):
+    if len(obj) == 1:
+        if "__datetime__" in obj:
+            return datetime.fromisoformat(obj["__datetime__"])
+        if "__date__" in obj:
+            return date.fromisoformat(obj["__date__"])
+    return obj
+
+
+def dumps(data: Dict[str, Any]) -> str:
+    return json.dumps(data, default=_json_default, ensure_ascii=False)
+
+
+def loads(text: str) -> Dict[str, Any]:
+    return json.loads(text, object_hook=_json_object_hook)
+
+
+# ========== ОБЩАЯ ЛОГИКА ==========
+
+@dataclass
+class _Record:
+    state: Optional[str] = None
+    data: Dict[str, Any] = field(default_factory=dict)
+
+
+class CachedStorage(BaseStorage, ABC):
+    """Хранилище FSM с кэшем чтения и отложенной пакетной записью.
+
+    Чтения обслуживаются из LRU-кэша процесса, изменения копятся и раз в
+    flush_interval записываются одной пачкой (несколько изменений одного
+    ключа схлопываются). Кэш корректен, пока чат обслуживает один процесс,
+    поэтому при нескольких воркерах апдейты одного пользователя должны
+    попадать в один и тот же воркер.
+    """
+
+    def __init__(self, flush_interval: float = FSM_FLUSH_INTERVAL, cache_size: int = FSM_CACHE_SIZE):
+        self.flush_interval = flush_interval
+        self.cache_size = cache_size
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+
+        self._cache: "OrderedDict[str, _Record]" = OrderedDict()
+        self._dirty: Dict[str, _Record] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+
+    # ---------- API aiogram ----------
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = await self._get_record(key)
+        record.state = state.state if isinstance(state, State) else state
+        self._mark_dirty(key, record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._get_record(key)).state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        record = await self._get_record(key)
+        record.data = data.copy()
+        self._mark_dirty(key, record)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (await self._get_record(key)).data.copy()
+
+    async def close(self) -> None:
+        if self._flush_task:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+        await self._close_backend()
+
+    # ---------- Пакетная запись ----------
+
+    async def flush(self):
+        """Записывает накопленные изменения одной пачкой"""
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            batch, self._dirty = self._dirty, {}
+            records = [(key, record.state, record.data.copy()) for key, record in batch.items()]
+            try:
+                await self._store(records)
+            except Exception as e:
+                logger.error(f"❌ Ошибка записи состояний FSM: {e}")
+                # Возвращаем в очередь, если ключ не перезаписан заново
+                for key, record in batch.items():
+                    self._dirty.setdefault(key, record)
+                raise
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                # Ошибка уже залогирована, попробуем в следующий раз
+                pass
+
+    def _mark_dirty(self, key: StorageKey, record: _Record):
+        self._dirty[self.key_builder.build(key)] = record
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    # ---------- Кэш ----------
+
+    async def _get_record(self, key: StorageKey) -> _Record:
+        str_key = self.key_builder.build(key)
+
+        record = self._cache.get(str_key)
+        if record is not None:
+            self._cache.move_to_end(str_key)
+            return record
+
+        record = self._dirty.get(str_key)
+        if record is None:
+            state, data = await self._load(str_key)
+            record = _Record(state=state, data=data)
+            # Пока грузили, запись могла появиться из другой задачи
+            record = self._cache.get(str_key) or record
+
+        self._cache[str_key] = record
+        self._cache.move_to_end(str_key)
+        if len(self._cache) > self.cache_size:
+            for old_key in list(self._cache):
+                if len(self._cache) <= self.cache_size:
+                    break
+                # Незаписанные изменения не вытесняем
+                if old_key not in self._dirty:
+                    del self._cache[old_key]
+        return record
+
+    # ---------- Бэкенд ----------
+
+    @abstractmethod
+    async def _load(self, key: str) -> Tuple[Optional[str], Dict[str, Any]]:
+        """Состояние и данные по ключу ((None, {}), если ключа нет)"""
+
+    @abstractmethod
+    async def _store(self, records: List[Tuple[str, Optional[str], Dict[str, Any]]]):
+        """Записывает пачку (ключ, состояние, данные); пустые записи удаляет"""
+
+    async def _close_backend(self):
+        pass
+
+
+# ========== SQLITE ==========
+
+class SQLiteStorage(CachedStorage):
+    """FSM в SQLite через aiosqlite (хранилище по умолчанию)"""
+
+    def __init__(self, path: str, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self._db = None
+        self._connect_lock = asyncio.Lock()
+
+    async def _connection(self):
+        if self._db is None:
+            async with self._connect_lock:
+                if self._db is None:
+                    import aiosqlite
+
+                    directory = os.path.dirname(self.path)
+                    if directory:
+                        os.makedirs(directory, exist_ok=True)
+                    db = await aiosqlite.connect(self.path)
+                    await db.execute("PRAGMA journal_mode=WAL")
+                    await db.execute(
+                        "CREATE TABLE IF NOT EXISTS fsm_states ("
+                        "key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+                    )
+                    await db.commit()
+                    self._db = db
+        return self._db
+
+    async def _load(self, key: str) -> Tuple[Optional[str], Dict[str, Any]]:
+        db = await self._connection()
+        async with db.execute("SELECT state, data FROM fsm_states WHERE key = ?", (key,)) as cursor:
+            row = await cursor.fetchone()
+        if row is None:
+            return None, {}
+        return row[0], loads(row[1])
+
+    async def _store(self, records: List[Tuple[str, Optional[str], Dict[str, Any]]]):
+        db = await self._connection()
+        now = time.time()
+
+        # Пустые записи удаляем, чтобы таблица не росла от state.clear()
+        upserts = [(key, state, dumps(data), now) for key, state, data in records if state is not None or data]
+        deletes = [(key,) for key, state, data in records if state is None and not data]
+
+        if upserts:
+            await db.executemany(
+                "INSERT INTO fsm_states (key, state, data, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data, "
+                "updated_at = excluded.updated_at",
+                upserts
+            )
+        if deletes:
+            await db.executemany("DELETE FROM fsm_states WHERE key = ?", deletes)
+        await db.commit()
+
+    async def _close_backend(self):
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+
+
+# ========== REDIS ==========
+
+class RedisCachedStorage(CachedStorage):
+    """FSM в Redis (или любом сервере с протоколом Redis).
+
+    Ключи и формат совпадают с aiogram RedisStorage (fsm:...:state и
+    fsm:...:data), запись идет одним pipeline. Нужен пакет redis; вместо
+    него можно передать готовый клиент (например, fakeredis в тестах).
+    """
+
+    def __init__(self, url: Optional[str] = None, redis=None, **kwargs):
+        super().__init__(**kwargs)
+        if redis is None:
+            try:
+                from redis.asyncio import Redis
+            except ImportError:
+                raise RuntimeError("Для FSM_STORAGE_URL=redis://... установите пакет redis: pip install redis")
+            redis = Redis.from_url(url)
+
+        self.redis = redis
+
+    async def _load(self, key: str) -> Tuple[Optional[str], Dict[str, Any]]:
+        state, data = await self.redis.mget(f"{key}:state", f"{key}:data")
+        if isinstance(state, bytes):
+            state = state.decode("utf-8")
+        return state, loads(data) if data else {}
+
+    async def _store(self, records: List[Tuple[str, Optional[str], Dict[str, Any]]]):
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for key, state, data in records:
+                if state is None:
+                    pipe.delete(f"{key}:state")
+                else:
+                    pipe.set(f"{key}:state", state)
+                if data:
+                    pipe.set(f"{key}:data", dumps(data))
+                else:
+                    pipe.delete(f"{key}:data")
+            await pipe.execute()
+
+    async def _close_backend(self):
+        await self.redis.aclose()
+
+
+def create_fsm_storage(url: str = FSM_STORAGE_URL) -> BaseStorage:
+    """Хранилище FSM по URL: sqlite:///path.db, redis://host:port/db или memory://"""
+    if url.startswith("redis://") or url.startswith("rediss://"):
+        logger.info("💾 FSM хранится в Redis")
+        return RedisCachedStorage(url)
+
+    if url.startswith("sqlite:///"):
+        path = url[len("sqlite:///"):]
+        logger.info(f"💾 FSM хранится в SQLite: {path}")
+        return SQLiteStorage(path)
+
+    if url.startswith("memory://"):
+        from aiogram.fsm.storage.memory import MemoryStorage
+        logger.warning("⚠️ FSM хранится в памяти и не переживет перезапуск")
+        return MemoryStorage()
+
+    raise ValueError(f"Неизвестный FSM_STORAGE_URL: {url}")
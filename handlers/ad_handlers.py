@@ -1,19 +1,33 @@
 # handlers/ad_handlers.py
-import asyncio
 import logging
+import time
 from datetime import datetime, timedelta
-from aiogram import Router, F
+from typing import Dict, Tuple
+from aiogram import Bot, Router, F
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.types import CallbackQuery, Message, InlineKeyboardButton
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from config import AD_REWARD_AMOUNT, AD_WATCH_TIME, MAX_ADS_PER_DAY, AD_COOLDOWN_MINUTES, ADMIN_IDS
+from config import (
+    AD_REWARD_AMOUNT, AD_WATCH_TIME, MAX_ADS_PER_DAY, AD_COOLDOWN_MINUTES, ADMIN_IDS,
+    DAILY_BONUS_AMOUNT, DAILY_BONUS_THRESHOLD
+)
+from database import get_ad_counter, increment_ad_views, claim_ad_bonus
 from keyboards import get_main_inline_menu
+from ledger import credit, to_kopecks
+from services.timer_wheel import TimerHandle, timer_wheel
 import pytz
 
 logger = logging.getLogger(__name__)
 router = Router()
 
+# Клавиатура ожидания обновляется только на кратных этому числу секундах
+AD_TIMER_STEP = 5
+
+# Активные таймеры просмотра: chat_id -> (ad_id, следующий тик)
+_ad_timers: Dict[int, Tuple[str, TimerHandle]] = {}
+
 
 class AdStates(StatesGroup):
     watching_ad = State()
@@ -68,19 +82,9 @@ async def start_watching_ad(callback: CallbackQuery, state: FSMContext, user, se
     """Начало просмотра рекламы - 15 раз в день по 50₽"""
     now = datetime.now(pytz.UTC)
     
-    # Проверяем количество просмотров сегодня
-    from database import Payment
-    from sqlalchemy import select, func, cast, Date
-    
-    # Получаем количество просмотров за сегодня
-    result = await session.execute(
-        select(func.count(Payment.id)).where(
-            Payment.user_id == user.id,
-            Payment.payment_method == "ad_reward",
-            func.date(Payment.created_at) == func.date(now)
-        )
-    )
-    today_views = result.scalar() or 0
+    # Количество просмотров сегодня - одна строка счетчика
+    counter = await get_ad_counter(session, user.id)
+    today_views = counter.views if counter else 0
     
     logger.info(f"📊 Пользователь {user.telegram_id} просмотров сегодня: {today_views}/{MAX_ADS_PER_DAY}")
     
@@ -145,7 +149,7 @@ async def start_watching_ad(callback: CallbackQuery, state: FSMContext, user, se
     )
     
     # Запускаем таймер
-    asyncio.create_task(ad_timer(callback.message, state, ad_id, AD_WATCH_TIME))
+    start_ad_timer(callback.bot, callback.message.chat.id, callback.message.message_id, state, ad_id, AD_WATCH_TIME)
     await callback.answer(f"🎬 Начало просмотра #{today_views + 1}")
 
 # handlers/ad_handlers.py - ДОБАВЬТЕ этот метод в класс AIService или создайте отдельно
@@ -153,29 +157,12 @@ async def start_watching_ad(callback: CallbackQuery, state: FSMContext, user, se
 async def check_and_award_daily_bonus(user, session, today_views):
     """Проверка и начисление ежедневного бонуса"""
     from database import Payment
-    from sqlalchemy import select, func
-    from datetime import datetime
-    import pytz
-    from config import DAILY_BONUS_AMOUNT, DAILY_BONUS_THRESHOLD
-    
-    now = datetime.now(pytz.UTC)
     
     # Проверяем, достиг ли пользователь порога для бонуса
     if today_views >= DAILY_BONUS_THRESHOLD:
-        # Проверяем, не получал ли уже бонус сегодня
-        result = await session.execute(
-            select(func.count(Payment.id)).where(
-                Payment.user_id == user.id,
-                Payment.payment_method == "daily_bonus",
-                func.date(Payment.created_at) == func.date(now)
-            )
-        )
-        already_got_bonus = result.scalar() or 0
-        
-        if already_got_bonus == 0:
-            # Начисляем бонус
+        # Отметка в счетчике одновременно проверяет, что бонус сегодня еще не получен
+        if await claim_ad_bonus(session, user.id, DAILY_BONUS_THRESHOLD):
             old_balance = user.balance
-            user.balance += DAILY_BONUS_AMOUNT
             
             # Сохраняем платеж
             bonus_payment = Payment(
@@ -184,9 +171,13 @@ async def check_and_award_daily_bonus(user, session, today_views):
                 currency="RUB",
                 status="completed",
                 payment_method="daily_bonus",
-                comment=f"Ежедневный бонус за {today_views} просмотров рекламы"
+                comment=f"Ежедневный бонус за {today_views} просмотров рекламы",
+                completed_at=datetime.now(pytz.UTC)
             )
             session.add(bonus_payment)
+            
+            # Начисляем бонус
+            await credit(session, user, to_kopecks(DAILY_BONUS_AMOUNT), "daily_bonus", payment=bonus_payment)
             await session.commit()
             
             logger.info(f"🎁 Пользователь {user.telegram_id} получил ежедневный бонус {DAILY_BONUS_AMOUNT}₽")
@@ -201,38 +192,53 @@ async def check_and_award_daily_bonus(user, session, today_views):
     
     return {"awarded": False}
 
-async def ad_timer(message, state, ad_id, wait_time):
-    """Таймер обратного отсчета"""
-    try:
-        for i in range(wait_time, 0, -1):
-            await asyncio.sleep(1)
-            
-            # Проверяем, не отменил ли пользователь
-            current_state = await state.get_state()
-            if not current_state:
-                return
-                
-            # Обновляем каждую секунду или каждые 5 секунд
-            if i % 5 == 0 or i == wait_time or i <= 10:
-                try:
-                    await message.edit_reply_markup(
-                        reply_markup=get_waiting_keyboard(i, ad_id)
-                    )
-                except:
-                    pass
-        
+def start_ad_timer(bot: Bot, chat_id: int, message_id: int, state: FSMContext, ad_id: str, seconds_left: int):
+    """Запускает обратный отсчет просмотра на общем колесе таймеров"""
+    cancel_ad_timer(chat_id)
+    _schedule_ad_tick(bot, chat_id, message_id, state, ad_id, time.monotonic() + seconds_left, seconds_left)
+
+
+def cancel_ad_timer(chat_id: int):
+    entry = _ad_timers.pop(chat_id, None)
+    if entry:
+        entry[1].cancel()
+
+
+def _schedule_ad_tick(
+    bot: Bot, chat_id: int, message_id: int, state: FSMContext, ad_id: str, ends_at: float, seconds_left: int
+):
+    # Следующая граница шага; последняя - ноль, когда появляется кнопка подтверждения.
+    # Отсчет от ends_at, чтобы задержки обновлений не копились
+    next_left = (seconds_left - 1) // AD_TIMER_STEP * AD_TIMER_STEP
+    handle = timer_wheel.schedule(
+        ends_at - next_left - time.monotonic(), _ad_tick, bot, chat_id, message_id, state, ad_id, ends_at, next_left
+    )
+    _ad_timers[chat_id] = (ad_id, handle)
+
+
+async def _ad_tick(
+    bot: Bot, chat_id: int, message_id: int, state: FSMContext, ad_id: str, ends_at: float, seconds_left: int
+):
+    """Один шаг обратного отсчета: обновляет клавиатуру и планирует следующий"""
+    data = await state.get_data()
+    if data.get("ad_id") != ad_id:
+        # Просмотр отменен, подтвержден или начат заново
+        if _ad_timers.get(chat_id, (None,))[0] == ad_id:
+            del _ad_timers[chat_id]
+        return
+
+    if seconds_left > 0:
+        reply_markup = get_waiting_keyboard(seconds_left, ad_id)
+        _schedule_ad_tick(bot, chat_id, message_id, state, ad_id, ends_at, seconds_left)
+    else:
         # Время вышло - меняем на кнопку подтверждения
-        current_state = await state.get_state()
-        if current_state:
-            try:
-                await message.edit_reply_markup(
-                    reply_markup=get_ad_keyboard(ad_id)
-                )
-            except:
-                pass
-                
-    except Exception as e:
-        logger.error(f"Ошибка в таймере: {e}")
+        reply_markup = get_ad_keyboard(ad_id)
+        _ad_timers.pop(chat_id, None)
+
+    try:
+        await bot.edit_message_reply_markup(chat_id=chat_id, message_id=message_id, reply_markup=reply_markup)
+    except TelegramBadRequest as e:
+        logger.debug(f"Не удалось обновить таймер рекламы в чате {chat_id}: {e}")
 
 
 @router.callback_query(F.data.startswith("confirm_ad_"))
@@ -269,21 +275,14 @@ async def confirm_ad_watch(callback: CallbackQuery, state: FSMContext, user, ses
             )
             return
         
-        # 4. Получаем количество просмотров сегодня
+        # 4. Засчитываем просмотр в дневном счетчике (вместе с проверкой лимита)
         from database import Payment
-        from sqlalchemy import select, func
         
-        result = await session.execute(
-            select(func.count(Payment.id)).where(
-                Payment.user_id == user.id,
-                Payment.payment_method == "ad_reward",
-                func.date(Payment.created_at) == func.date(datetime.now(pytz.UTC))
-            )
-        )
-        today_views = result.scalar() or 0
+        reward = data.get("reward_amount", AD_REWARD_AMOUNT)  # Теперь data определена
+        today_views = await increment_ad_views(session, user.id, to_kopecks(reward), MAX_ADS_PER_DAY)
         
         # 5. Проверяем лимит
-        if today_views >= MAX_ADS_PER_DAY:
+        if today_views is None:
             await callback.answer(
                 f"❌ Достигнут дневной лимит {MAX_ADS_PER_DAY} просмотров",
                 show_alert=True
@@ -292,9 +291,7 @@ async def confirm_ad_watch(callback: CallbackQuery, state: FSMContext, user, ses
             return
         
         # 6. Начисляем награду
-        reward = data.get("reward_amount", AD_REWARD_AMOUNT)  # Теперь data определена
         old_balance = user.balance
-        user.balance += reward
         user.last_ad_watch = datetime.now(pytz.UTC)
         
         # 7. Сохраняем платеж
@@ -304,15 +301,14 @@ async def confirm_ad_watch(callback: CallbackQuery, state: FSMContext, user, ses
             currency="RUB",
             status="completed",
             payment_method="ad_reward",
-            comment=f"Просмотр рекламы #{today_views + 1} за день"
+            comment=f"Просмотр рекламы #{today_views} за день",
+            completed_at=user.last_ad_watch
         )
         session.add(payment)
+        await credit(session, user, to_kopecks(reward), "ad_reward", payment=payment)
         await session.commit()
         
-        # 8. Обновляем счетчик
-        today_views += 1
-        
-        # 9. Формируем сообщение
+        # 8. Формируем сообщение
         remaining_views = MAX_ADS_PER_DAY - today_views
         remaining_earnings = remaining_views * AD_REWARD_AMOUNT
         
@@ -337,6 +333,7 @@ async def confirm_ad_watch(callback: CallbackQuery, state: FSMContext, user, ses
         )
         
         await state.clear()
+        cancel_ad_timer(callback.message.chat.id)
         await callback.answer(f"✅ +{reward}₽ на баланс!", show_alert=False)
         
     except Exception as e:
@@ -347,40 +344,18 @@ async def confirm_ad_watch(callback: CallbackQuery, state: FSMContext, user, ses
 async def claim_daily_bonus(callback: CallbackQuery, user, session):
     """Ручное получение ежедневного бонуса"""
     from database import Payment
-    from sqlalchemy import select, func
-    from datetime import datetime
-    import pytz
-    
-    now = datetime.now(pytz.UTC)
-    
-    # Проверяем просмотры за сегодня
-    result = await session.execute(
-        select(func.count(Payment.id)).where(
-            Payment.user_id == user.id,
-            Payment.payment_method == "ad_reward",
-            func.date(Payment.created_at) == func.date(now)
-        )
-    )
-    today_views = result.scalar() or 0
     
-    # Проверяем, получал ли уже бонус
-    result_bonus = await session.execute(
-        select(func.count(Payment.id)).where(
-            Payment.user_id == user.id,
-            Payment.payment_method == "daily_bonus",
-            func.date(Payment.created_at) == func.date(now)
-        )
-    )
-    already_got_bonus = result_bonus.scalar() or 0
+    # Просмотры за сегодня и отметка о бонусе - одна строка счетчика
+    counter = await get_ad_counter(session, user.id)
+    today_views = counter.views if counter else 0
     
-    if already_got_bonus > 0:
+    if counter and counter.bonus_claimed:
         await callback.answer("🎁 Вы уже получили ежедневный бонус сегодня!", show_alert=True)
         return
     
-    if today_views >= DAILY_BONUS_THRESHOLD:
-        # Начисляем бонус
+    # Повторное нажатие, пока первое еще обрабатывается, отсекает условный UPDATE
+    if today_views >= DAILY_BONUS_THRESHOLD and await claim_ad_bonus(session, user.id, DAILY_BONUS_THRESHOLD):
         old_balance = user.balance
-        user.balance += DAILY_BONUS_AMOUNT
         
         bonus_payment = Payment(
             user_id=user.id,
@@ -388,9 +363,13 @@ async def claim_daily_bonus(callback: CallbackQuery, user, session):
             currency="RUB",
             status="completed",
             payment_method="daily_bonus",
-            comment=f"Ежедневный бонус за {today_views} просмотров рекламы"
+            comment=f"Ежедневный бонус за {today_views} просмотров рекламы",
+            completed_at=datetime.now(pytz.UTC)
         )
         session.add(bonus_payment)
+        
+        # Начисляем бонус
+        await credit(session, user, to_kopecks(DAILY_BONUS_AMOUNT), "daily_bonus", payment=bonus_payment)
         await session.commit()
         
         await callback.message.edit_text(
@@ -412,6 +391,7 @@ async def claim_daily_bonus(callback: CallbackQuery, user, session):
 async def cancel_ad_watch(callback: CallbackQuery, state: FSMContext):
     """Отмена просмотра рекламы"""
     await state.clear()
+    cancel_ad_timer(callback.message.chat.id)
     
     is_admin = callback.from_user.id in ADMIN_IDS if ADMIN_IDS else False
     
@@ -427,37 +407,16 @@ async def show_ad_stats(callback: CallbackQuery, user, session):
     """Показать статистику по рекламе с информацией о бонусах"""
     from database import Payment
     from sqlalchemy import select, func
-    from datetime import datetime
-    import pytz
-    from config import DAILY_BONUS_AMOUNT, DAILY_BONUS_THRESHOLD
     
-    now = datetime.now(pytz.UTC)
+    # Статистика за сегодня - одна строка счетчика
+    counter = await get_ad_counter(session, user.id)
     
-    # Статистика за сегодня
-    result = await session.execute(
-        select(func.count(Payment.id), func.sum(Payment.amount)).where(
-            Payment.user_id == user.id,
-            Payment.payment_method == "ad_reward",
-            func.date(Payment.created_at) == func.date(now)
-        )
-    )
-    today_stats = result.first()
-    
-    today_views = today_stats[0] or 0
-    today_earnings = today_stats[1] or 0
-    
-    # Бонусы за сегодня
-    result_bonus = await session.execute(
-        select(func.count(Payment.id), func.sum(Payment.amount)).where(
-            Payment.user_id == user.id,
-            Payment.payment_method == "daily_bonus",
-            func.date(Payment.created_at) == func.date(now)
-        )
-    )
-    today_bonus_stats = result_bonus.first()
+    today_views = counter.views if counter else 0
+    today_earnings = counter.earned_kopecks / 100 if counter else 0
     
-    today_bonus_count = today_bonus_stats[0] or 0
-    today_bonus_amount = today_bonus_stats[1] or 0
+    # Бонус за сегодня
+    today_bonus_count = 1 if counter and counter.bonus_claimed else 0
+    today_bonus_amount = DAILY_BONUS_AMOUNT if today_bonus_count else 0
     
     # Статистика за все время
     result_all = await session.execute(
@@ -2,10 +2,14 @@ from aiogram import Router, F
 from aiogram.types import CallbackQuery, Message
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from database import User, Order, Payment, get_pending_payments, get_completed_payments
+from database import User, Order, Payment, user_cache
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func, desc
 from keyboards import get_admin_menu, get_admin_payments_menu, get_back_button
+from ledger import credit, to_kopecks
+from stats import stats_cache
+from services.broadcast import broadcast_service
+from .admin_payments import show_payments_page
 import logging
 import asyncio
 from datetime import datetime, timedelta
@@ -31,30 +35,12 @@ async def admin_panel(callback: CallbackQuery, user: User, session: AsyncSession
         return
     
     try:
-        # Статистика пользователей
-        users_count_result = await session.execute(
-            select(func.count(User.id))
-        )
-        users_count = users_count_result.scalar()
-        
-        # Статистика заказов
-        orders_count_result = await session.execute(
-            select(func.count(Order.id))
-        )
-        orders_count = orders_count_result.scalar()
-        
-        # Статистика платежей
-        payments_sum_result = await session.execute(
-            select(func.sum(Payment.amount)).where(Payment.status == "completed")
-        )
-        payments_sum = payments_sum_result.scalar() or 0
-        
-        # Пользователи за последние 7 дней
-        week_ago = datetime.now() - timedelta(days=7)
-        new_users_result = await session.execute(
-            select(func.count(User.id)).where(User.created_at >= week_ago)
-        )
-        new_users = new_users_result.scalar()
+        # Итоги из daily_stats (с коротким кэшем) вместо COUNT/SUM по таблицам
+        stats = await stats_cache.get(session)
+        users_count = stats.users
+        orders_count = stats.orders
+        payments_sum = stats.payments_sum
+        new_users = stats.week_users
         
         stats_text = (
             "⚙️ <b>Админ-панель</b>\n\n"
@@ -82,40 +68,17 @@ async def admin_panel(callback: CallbackQuery, user: User, session: AsyncSession
 async def admin_stats(callback: CallbackQuery, session: AsyncSession):
     """Подробная статистика"""
     try:
-        # Общая статистика
-        users_count_result = await session.execute(select(func.count(User.id)))
-        users_count = users_count_result.scalar()
-        
-        orders_count_result = await session.execute(select(func.count(Order.id)))
-        orders_count = orders_count_result.scalar()
+        stats = await stats_cache.get(session)
         
-        payments_sum_result = await session.execute(
-            select(func.sum(Payment.amount)).where(Payment.status == "completed")
-        )
-        payments_sum = payments_sum_result.scalar() or 0
-        
-        # Сегодняшняя статистика
-        today = datetime.now().date()
-        today_start = datetime.combine(today, datetime.min.time())
-        today_end = datetime.combine(today, datetime.max.time())
-        
-        today_users_result = await session.execute(
-            select(func.count(User.id)).where(User.created_at.between(today_start, today_end))
-        )
-        today_users = today_users_result.scalar()
-        
-        today_orders_result = await session.execute(
-            select(func.count(Order.id)).where(Order.created_at.between(today_start, today_end))
-        )
-        today_orders = today_orders_result.scalar()
+        # Общая статистика
+        users_count = stats.users
+        orders_count = stats.orders
+        payments_sum = stats.payments_sum
         
-        today_payments_result = await session.execute(
-            select(func.sum(Payment.amount)).where(
-                Payment.status == "completed",
-                Payment.completed_at.between(today_start, today_end)
-            )
-        )
-        today_payments = today_payments_result.scalar() or 0
+        # Сегодняшняя статистика (сутки по UTC)
+        today_users = stats.today_users
+        today_orders = stats.today_orders
+        today_payments = stats.today_payments_sum
         
         stats_text = (
             "📊 <b>Детальная статистика</b>\n\n"
@@ -203,43 +166,7 @@ async def admin_payments_menu(callback: CallbackQuery):
 async def admin_pending_payments(callback: CallbackQuery, session: AsyncSession):
     """Ожидающие платежи"""
     try:
-        payments = await get_pending_payments(session)
-        
-        if not payments:
-            await callback.message.edit_text(
-                "⏳ <b>Ожидающие платежи</b>\n\n"
-                "Ожидающих платежей нет.",
-                parse_mode="HTML",
-                reply_markup=get_back_button()
-            )
-            await callback.answer()
-            return
-        
-        payments_text = "⏳ <b>Ожидающие платежи</b>\n\n"
-        
-        for payment in payments:
-            # Получаем информацию о пользователе
-            user_result = await session.execute(
-                select(User).where(User.id == payment.user_id)
-            )
-            user = user_result.scalar_one_or_none()
-            
-            user_info = f"@{user.username}" if user and user.username else f"ID: {payment.user_id}"
-            
-            payments_text += (
-                f"💰 <b>Платеж ID:</b> {payment.id}\n"
-                f"👤 <b>Пользователь:</b> {user_info}\n"
-                f"💳 <b>Сумма:</b> {payment.amount}₽\n"
-                f"📝 <b>Комментарий:</b> {payment.comment or 'Нет'}\n"
-                f"📅 <b>Создан:</b> {payment.created_at.strftime('%d.%m.%Y %H:%M')}\n"
-                "──────────────\n"
-            )
-        
-        await callback.message.edit_text(
-            payments_text,
-            parse_mode="HTML",
-            reply_markup=get_back_button()
-        )
+        await show_payments_page(callback, session, "pending")
         await callback.answer()
         
     except Exception as e:
@@ -251,42 +178,7 @@ async def admin_pending_payments(callback: CallbackQuery, session: AsyncSession)
 async def admin_completed_payments(callback: CallbackQuery, session: AsyncSession):
     """Завершенные платежи"""
     try:
-        payments = await get_completed_payments(session)
-        
-        if not payments:
-            await callback.message.edit_text(
-                "✅ <b>Завершенные платежи</b>\n\n"
-                "Завершенных платежей пока нет.",
-                parse_mode="HTML",
-                reply_markup=get_back_button()
-            )
-            await callback.answer()
-            return
-        
-        payments_text = "✅ <b>Последние завершенные платежи</b>\n\n"
-        
-        for payment in payments[:10]:  # Показываем только последние 10
-            # Получаем информацию о пользователе
-            user_result = await session.execute(
-                select(User).where(User.id == payment.user_id)
-            )
-            user = user_result.scalar_one_or_none()
-            
-            user_info = f"@{user.username}" if user and user.username else f"ID: {payment.user_id}"
-            
-            payments_text += (
-                f"💰 <b>Платеж ID:</b> {payment.id}\n"
-                f"👤 <b>Пользователь:</b> {user_info}\n"
-                f"💳 <b>Сумма:</b> {payment.amount}₽\n"
-                f"📅 <b>Завершен:</b> {payment.completed_at.strftime('%d.%m.%Y %H:%M') if payment.completed_at else 'Не указано'}\n"
-                "──────────────\n"
-            )
-        
-        await callback.message.edit_text(
-            payments_text,
-            parse_mode="HTML",
-            reply_markup=get_back_button()
-        )
+        await show_payments_page(callback, session, "completed")
         await callback.answer()
         
     except Exception as e:
@@ -368,9 +260,7 @@ async def admin_add_balance_get_amount(message: Message, state: FSMContext, sess
         await state.clear()
         return
     
-    # Пополняем баланс
     old_balance = user.balance
-    user.balance += amount
     
     # Создаем запись о платеже
     payment = Payment(
@@ -381,7 +271,11 @@ async def admin_add_balance_get_amount(message: Message, state: FSMContext, sess
         completed_at=datetime.now()
     )
     session.add(payment)
+    
+    # Пополняем баланс
+    await credit(session, user, to_kopecks(amount), "admin_add", payment=payment)
     await session.commit()
+    user_cache.invalidate(user.telegram_id)
     
     await message.answer(
         f"✅ <b>Баланс успешно пополнен!</b>\n\n"
@@ -414,7 +308,7 @@ async def admin_broadcast_start(callback: CallbackQuery, state: FSMContext):
 
 
 @router.message(AdminBroadcastStates.waiting_for_broadcast_message)
-async def admin_broadcast_send(message: Message, state: FSMContext, session: AsyncSession):
+async def admin_broadcast_send(message: Message, state: FSMContext):
     """Отправка рассылки"""
     broadcast_text = message.text
     
@@ -422,63 +316,19 @@ async def admin_broadcast_send(message: Message, state: FSMContext, session: Asy
         await message.answer("❌ Сообщение не может быть пустым.")
         return
     
-    # Получаем всех пользователей
-    result = await session.execute(select(User))
-    users = result.scalars().all()
-    
-    if not users:
-        await message.answer("❌ Нет пользователей для рассылки.")
-        await state.clear()
-        return
-    
-    sent_count = 0
-    failed_count = 0
-    
-    # Сначала отправляем сообщение о начале рассылки
+    # Сообщение о начале; дальше рассылка обновляет его сама
     status_message = await message.answer(
-        f"📤 <b>Начинаю рассылку...</b>\n"
-        f"👥 Всего пользователей: {len(users)}\n"
-        f"⏳ Это займет примерно {len(users) * 0.05:.1f} секунд",
+        "📤 <b>Начинаю рассылку...</b>\n"
+        "Прогресс будет обновляться в этом сообщении.",
         parse_mode="HTML"
     )
     
-    for user in users:
-        try:
-            await message.bot.send_message(
-                chat_id=user.telegram_id,
-                text=f"📢 <b>Сообщение от администратора:</b>\n\n{broadcast_text}",
-                parse_mode="HTML"
-            )
-            sent_count += 1
-            
-            # Обновляем статус каждые 10 сообщений
-            if sent_count % 10 == 0:
-                try:
-                    await status_message.edit_text(
-                        f"📤 <b>Рассылка в процессе...</b>\n"
-                        f"✅ Отправлено: {sent_count}\n"
-                        f"❌ Не отправлено: {failed_count}\n"
-                        f"👥 Всего пользователей: {len(users)}",
-                        parse_mode="HTML"
-                    )
-                except:
-                    pass
-                    
-        except Exception as e:
-            logger.error(f"Не удалось отправить сообщение пользователю {user.telegram_id}: {e}")
-            failed_count += 1
-        
-        # Небольшая задержка, чтобы не превысить лимиты Telegram
-        await asyncio.sleep(0.05)
-    
-    # Отправляем финальный отчет
-    await status_message.edit_text(
-        f"✅ <b>Рассылка завершена!</b>\n\n"
-        f"📤 Успешно отправлено: {sent_count}\n"
-        f"❌ Не удалось отправить: {failed_count}\n"
-        f"👥 Всего пользователей: {len(users)}\n\n"
-        f"📊 Эффективность: {(sent_count/len(users)*100):.1f}%",
-        parse_mode="HTML"
+    # Рассылка идет в фоне и продолжится после перезапуска бота
+    await broadcast_service.start(
+        message.bot,
+        message.html_text,
+        admin_chat_id=message.chat.id,
+        status_message_id=status_message.message_id
     )
     
     await state.clear()
@@ -505,37 +355,17 @@ async def admin_settings(callback: CallbackQuery):
 async def admin_payments_stats(callback: CallbackQuery, session: AsyncSession):
     """Статистика платежей"""
     try:
-        # Общая сумма платежей
-        total_payments_result = await session.execute(
-            select(func.sum(Payment.amount)).where(Payment.status == "completed")
-        )
-        total_payments = total_payments_result.scalar() or 0
+        stats = await stats_cache.get(session)
         
-        # Количество платежей
-        payments_count_result = await session.execute(
-            select(func.count(Payment.id)).where(Payment.status == "completed")
-        )
-        payments_count = payments_count_result.scalar()
+        # Общая сумма и количество платежей
+        total_payments = stats.payments_sum
+        payments_count = stats.payments_count
         
         # Средний платеж
         avg_payment = total_payments / payments_count if payments_count > 0 else 0
         
         # Платежи по дням за последние 7 дней
-        week_ago = datetime.now() - timedelta(days=7)
-        daily_stats_result = await session.execute(
-            select(
-                func.date(Payment.completed_at).label('date'),
-                func.count(Payment.id).label('count'),
-                func.sum(Payment.amount).label('total')
-            )
-            .where(
-                Payment.status == "completed",
-                Payment.completed_at >= week_ago
-            )
-            .group_by(func.date(Payment.completed_at))
-            .order_by(func.date(Payment.completed_at).desc())
-        )
-        daily_stats = daily_stats_result.all()
+        daily_stats = stats.recent_payments
         
         stats_text = "💰 <b>Статистика платежей</b>\n\n"
         stats_text += f"📊 <b>Общая статистика:</b>\n"
@@ -545,8 +375,8 @@ async def admin_payments_stats(callback: CallbackQuery, session: AsyncSession):
         
         stats_text += f"📅 <b>За последние 7 дней:</b>\n"
         if daily_stats:
-            for stat in daily_stats:
-                stats_text += f"• {stat.date}: {stat.count} платежей на {stat.total or 0:.2f}₽\n"
+            for day, count, total_kopecks in daily_stats:
+                stats_text += f"• {day}: {count} платежей на {total_kopecks / 100:.2f}₽\n"
         else:
             stats_text += "Платежей за последние 7 дней нет.\n"
         
@@ -1,3 +1,6 @@
+from html import escape
+from typing import Optional, Tuple
+
 from aiogram import Router, F
 from aiogram.types import CallbackQuery, Message
 from aiogram.fsm.context import FSMContext
@@ -5,59 +8,108 @@ from aiogram.fsm.state import State, StatesGroup
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from database import (
-    get_pending_payments,
-    get_completed_payments,
+    Payment,
+    get_payments_page,
     get_payment_by_id,
     update_payment_status
 )
 from keyboards import (
     get_admin_payments_menu,
     get_payment_management_menu,
-    get_back_to_payments_button
+    get_back_to_payments_button,
+    get_pagination_keyboard
 )
 from states import PaymentComment
 
 router = Router()
 
+# Статус -> (префикс callback_data, заголовок, текст для пустого списка)
+PAYMENT_LISTS = {
+    "pending": ("admin_pending_payments", "⏳ <b>Ожидающие платежи</b>", "Ожидающих платежей нет."),
+    "completed": ("admin_completed_payments", "✅ <b>Завершенные платежи</b>", "Завершенных платежей пока нет."),
+}
 
-@router.callback_query(F.data == "admin_pending_payments")
-async def show_pending_payments(callback: CallbackQuery, session: AsyncSession):
-    """Показать список ожидающих платежей"""
-    payments = await get_pending_payments(session)
+
+def parse_page_callback(data: str) -> Tuple[str, Optional[int], Optional[int]]:
+    """admin_pending_payments:next:42 -> ("pending", after_id=42, before_id=None)"""
+    prefix, direction, payment_id = data.split(":")
+    status = next(status for status, (list_prefix, _, _) in PAYMENT_LISTS.items() if list_prefix == prefix)
+    if direction == "prev":
+        return status, None, int(payment_id)
+    return status, int(payment_id), None
+
+
+def format_payment(payment: Payment) -> str:
+    user = payment.user
+    if user and user.username:
+        user_info = f"@{escape(user.username)}"
+    else:
+        user_info = f"ID: {user.telegram_id if user else payment.user_id}"
     
-    if not payments:
+    if payment.status == "completed":
+        date_line = f"📅 Завершен: {payment.completed_at.strftime('%d.%m.%Y %H:%M') if payment.completed_at else 'N/A'}\n"
+    else:
+        date_line = f"📅 Создан: {payment.created_at.strftime('%d.%m.%Y %H:%M')}\n"
+    
+    text = (
+        f"💰 <b>Платеж #{payment.id}</b>\n"
+        f"👤 Пользователь: {user_info}\n"
+        f"💳 Сумма: {payment.amount}₽\n"
+        f"{date_line}"
+    )
+    if payment.comment:
+        text += f"💬 Комментарий: {escape(payment.comment)}\n"
+    return text
+
+
+async def show_payments_page(
+    callback: CallbackQuery,
+    session: AsyncSession,
+    status: str,
+    after_id: Optional[int] = None,
+    before_id: Optional[int] = None
+):
+    """Страница списка платежей: один запрос с JOIN на пользователя"""
+    prefix, title, empty_text = PAYMENT_LISTS[status]
+    page = await get_payments_page(session, status, after_id=after_id, before_id=before_id)
+    
+    if not page.items:
         await callback.message.edit_text(
-            "⏳ <b>Ожидающие платежи</b>\n\nНет ожидающих платежей.",
+            f"{title}\n\n{empty_text}",
             parse_mode="HTML",
-            reply_markup=get_back_to_payments_button()
+            reply_markup=get_admin_payments_menu()
         )
         return
     
-    text = "⏳ <b>Ожидающие платежи:</b>\n\n"
-    
-    for payment in payments[:10]:  # Ограничим 10 платежами
-        text += (
-            f"💰 <b>Платеж #{payment.id}</b>\n"
-            f"👤 Пользователь ID: {payment.user_id}\n"
-            f"💳 Сумма: {payment.amount}₽\n"
-            f"📅 Создан: {payment.created_at.strftime('%d.%m.%Y %H:%M')}\n"
-        )
-        
-        if payment.comment:
-            text += f"💬 Комментарий: {payment.comment}\n"
-        
-        text += "\n"
-    
-    if len(payments) > 10:
-        text += f"\n<i>И еще {len(payments) - 10} платежей...</i>"
+    text = f"{title}\n\n" + "\n".join(format_payment(payment) for payment in page.items)
     
     await callback.message.edit_text(
         text,
         parse_mode="HTML",
-        reply_markup=get_admin_payments_menu()
+        reply_markup=get_pagination_keyboard(
+            prefix,
+            page.has_prev,
+            page.has_next,
+            first_id=page.items[0].id,
+            last_id=page.items[-1].id
+        )
     )
 
 
+@router.callback_query(F.data == "admin_pending_payments")
+async def show_pending_payments(callback: CallbackQuery, session: AsyncSession):
+    """Показать список ожидающих платежей"""
+    await show_payments_page(callback, session, "pending")
+
+
+@router.callback_query(F.data.startswith("admin_pending_payments:") | F.data.startswith("admin_completed_payments:"))
+async def paginate_payments(callback: CallbackQuery, session: AsyncSession):
+    """Листание списков платежей"""
+    status, after_id, before_id = parse_page_callback(callback.data)
+    await show_payments_page(callback, session, status, after_id=after_id, before_id=before_id)
+    await callback.answer()
+
+
 @router.callback_query(F.data.startswith("confirm_payment_"))
 async def confirm_payment(callback: CallbackQuery, session: AsyncSession):
     """Подтвердить платеж"""
@@ -75,10 +127,10 @@ async def confirm_payment(callback: CallbackQuery, session: AsyncSession):
         payment = await get_payment_by_id(session, payment_id)
         
         if payment:
-            # Отправляем уведомление пользователю
+            # Отправляем уведомление пользователю (в Telegram, не по id в базе)
             try:
                 await callback.bot.send_message(
-                    payment.user_id,
+                    payment.user.telegram_id,
                     f"✅ Ваш платеж #{payment_id} подтвержден!\n\n"
                     f"💰 Сумма: {payment.amount}₽ зачислена на баланс."
                 )
@@ -145,38 +197,4 @@ async def process_payment_comment(message: Message, state: FSMContext, session:
 @router.callback_query(F.data == "admin_completed_payments")
 async def show_completed_payments(callback: CallbackQuery, session: AsyncSession):
     """Показать завершенные платежи"""
-    payments = await get_completed_payments(session, limit=20)
-    
-    if not payments:
-        await callback.message.edit_text(
-            "✅ <b>Завершенные платежи</b>\n\nНет завершенных платежей.",
-            parse_mode="HTML",
-            reply_markup=get_back_to_payments_button()
-        )
-        return
-    
-    text = "✅ <b>Завершенные платежи:</b>\n\n"
-    
-    total_amount = 0
-    for payment in payments:
-        completed_time = payment.completed_at.strftime('%d.%m.%Y %H:%M') if payment.completed_at else "N/A"
-        text += (
-            f"💰 <b>Платеж #{payment.id}</b>\n"
-            f"👤 Пользователь ID: {payment.user_id}\n"
-            f"💳 Сумма: {payment.amount}₽\n"
-            f"📅 Завершен: {completed_time}\n"
-        )
-        
-        if payment.comment:
-            text += f"💬 Комментарий: {payment.comment}\n"
-        
-        text += "\n"
-        total_amount += payment.amount
-    
-    text += f"\n📊 <b>Итого:</b> {len(payments)} платежей на сумму {total_amount}₽"
-    
-    await callback.message.edit_text(
-        text,
-        parse_mode="HTML",
-        reply_markup=get_back_to_payments_button()
-    )
\ No newline at end of file
+    await show_payments_page(callback, session, "completed")
@@ -13,7 +13,9 @@ from keyboards import get_cancel_inline_button, get_main_inline_menu
 
 # Импортируем TTS сервис и необходимые модели
 from services.tts_service import tts_service
+from services.scheduler import generation_scheduler
 from database import Order
+from ledger import reserve, capture, release, to_kopecks, InsufficientFunds, HOLD_HELD
 
 logger = logging.getLogger(__name__)
 router = Router()
@@ -87,8 +89,10 @@ async def process_tts_text(message: Message, state: FSMContext, user, session):
     # Рассчитываем стоимость
     cost = calculate_tts_cost(text)
     
-    # Проверяем баланс
-    if user.balance < cost:
+    # Резервируем средства до озвучки
+    try:
+        hold = await reserve(user, to_kopecks(cost), "tts")
+    except InsufficientFunds:
         await message.answer(
             f"❌ <b>Недостаточно средств!</b>\n\n"
             f"💰 Ваш баланс: {user.balance:.2f}₽\n"
@@ -99,6 +103,8 @@ async def process_tts_text(message: Message, state: FSMContext, user, session):
         )
         await state.clear()
         return
+    # На время озвучки транзакция не держится
+    await session.commit()
     
     # Уведомление о начале обработки
     processing_msg = await message.answer(f"🔊 Преобразую текст в аудио... Списание: {cost}₽")
@@ -112,9 +118,6 @@ async def process_tts_text(message: Message, state: FSMContext, user, session):
         result_text, audio_bytes = await tts_service.text_to_speech(text, language)
         
         if audio_bytes:
-            # Списание средств
-            user.balance -= cost
-            
             # Сохраняем заказ в базу данных
             order = Order(
                 user_id=user.id,
@@ -124,8 +127,14 @@ async def process_tts_text(message: Message, state: FSMContext, user, session):
                 result=f"Аудио файл ({len(audio_bytes)} байт)",  # Или можно сохранить путь к файлу
                 cost=cost
             )
-            session.add(order)
-            await session.commit()
+            
+            # Подтверждаем резерв вместе с заказом
+            try:
+                await capture(user, hold, order)
+            except InsufficientFunds:
+                await processing_msg.edit_text("❌ Недостаточно средств для списания. Пополните баланс.")
+                await state.clear()
+                return
             
             logger.info(f"💰 Списано {cost}₽ за TTS для пользователя {user.telegram_id}, баланс: {user.balance}")
             
@@ -165,6 +174,10 @@ async def process_tts_text(message: Message, state: FSMContext, user, session):
     except Exception as e:
         logger.error(f"❌ Ошибка при преобразовании текста в аудио: {e}")
         await message.answer(f"❌ Произошла ошибка: {str(e)[:200]}")
+    finally:
+        # Неподтвержденный резерв возвращаем на баланс
+        if hold.status == HOLD_HELD:
+            await release(user, hold)
     
     await state.clear()
 
@@ -195,9 +208,12 @@ async def cmd_tts(message: Message, state: FSMContext, user, session):
         # Рассчитываем стоимость
         cost = calculate_tts_cost(text)
         
-        if user.balance < cost:
+        try:
+            hold = await reserve(user, to_kopecks(cost), "tts")
+        except InsufficientFunds:
             await message.answer(f"❌ Недостаточно средств. Требуется: {cost}₽, ваш баланс: {user.balance:.2f}₽")
             return
+        await session.commit()
         
         processing_msg = await message.answer(f"🔊 Озвучка... Списание: {cost}₽")
         
@@ -206,9 +222,6 @@ async def cmd_tts(message: Message, state: FSMContext, user, session):
             result_text, audio_bytes = await tts_service.text_to_speech(text, language)
             
             if audio_bytes:
-                # Списание средств
-                user.balance -= cost
-                
                 # Сохраняем заказ
                 order = Order(
                     user_id=user.id,
@@ -218,8 +231,14 @@ async def cmd_tts(message: Message, state: FSMContext, user, session):
                     result=f"Аудио файл ({len(audio_bytes)} байт)",
                     cost=cost
                 )
-                session.add(order)
-                await session.commit()
+                
+                # Подтверждаем резерв вместе с заказом
+                try:
+                    await capture(user, hold, order)
+                except InsufficientFunds:
+                    await processing_msg.edit_text("❌ Недостаточно средств для списания. Пополните баланс.")
+                    await state.clear()
+                    return
                 
                 with tempfile.NamedTemporaryFile(suffix='.mp3', delete=False) as tmp:
                     tmp.write(audio_bytes)
@@ -245,6 +264,9 @@ async def cmd_tts(message: Message, state: FSMContext, user, session):
         except Exception as e:
             logger.error(f"❌ Ошибка TTS: {e}")
             await message.answer(f"❌ Ошибка: {str(e)[:200]}")
+        finally:
+            if hold.status == HOLD_HELD:
+                await release(user, hold)
     else:
         # Если только команда - показываем инструкцию
         await handle_tts_callback(
@@ -262,15 +284,18 @@ async def cmd_tts(message: Message, state: FSMContext, user, session):
 
 @router.callback_query(F.data == "cancel_operation")
 async def handle_cancel_callback(callback: CallbackQuery, state: FSMContext):
-    """Обработка кнопки 'Отмена' для TTS"""
+    """Обработка кнопки 'Отмена' - единственный обработчик cancel_operation"""
     try:
-        # 1. Очищаем состояние
+        # 1. Останавливаем генерации пользователя (в очереди и запущенные)
+        generation_scheduler.cancel(callback.from_user.id)
+        
+        # 2. Очищаем состояние
         current_state = await state.get_state()
         if current_state:
             await state.clear()
             logger.info(f"🗑️ Отмена TTS, состояние очищено для {callback.from_user.id}")
         
-        # 2. Редактируем текущее сообщение (ВАЖНО: edit_text)
+        # 3. Редактируем текущее сообщение (ВАЖНО: edit_text)
         await callback.message.edit_text(
             "❌ <b>Операция отменена</b>\n\n"
             "Вы вернулись в главное меню.",
@@ -278,7 +303,7 @@ async def handle_cancel_callback(callback: CallbackQuery, state: FSMContext):
             reply_markup=get_main_inline_menu(False)  # Убедитесь, что эта функция импортирована
         )
         
-        # 3. Подтверждаем callback (убираем "часики")
+        # 4. Подтверждаем callback (убираем "часики")
         await callback.answer()
         
     except Exception as e:
@@ -2,12 +2,12 @@ from aiogram import Router, F
 from aiogram.types import CallbackQuery
 from datetime import datetime, timedelta
 import random
-import asyncio
 import time
 import logging
 from config import AD_REWARD_AMOUNT, AD_WATCH_TIME
 from database import User
 from sqlalchemy.ext.asyncio import AsyncSession
+from ledger import credit, to_kopecks
 from keyboards import (
     get_payment_menu, 
     get_back_button, 
@@ -22,7 +22,7 @@ router = Router()
 logger = logging.getLogger(__name__)
 
 @router.callback_query(F.data.startswith("payment_"))
-async def handle_payment(callback: CallbackQuery, user: User):
+async def handle_payment(callback: CallbackQuery, user: User, session: AsyncSession):
     """Обработка выбора суммы для пополнения"""
     payment_type = callback.data
     
@@ -38,7 +38,7 @@ async def handle_payment(callback: CallbackQuery, user: User):
         amount = 5000
     elif payment_type == "payment_free":
         # Обработка бесплатной попытки
-        await handle_free_payment(callback, user)
+        await handle_free_payment(callback, user, session)
         return
     else:
         await callback.answer("❌ Неизвестная сумма платежа", show_alert=True)
@@ -75,7 +75,6 @@ async def handle_free_payment(callback: CallbackQuery, user: User, session: Asyn
     
     # Начисляем 10 рублей за бесплатную попытку
     reward = 10
-    user.balance += reward
     user.last_free_payment = datetime.now()
     
     # Сохраняем платеж в базе
@@ -87,6 +86,7 @@ async def handle_free_payment(callback: CallbackQuery, user: User, session: Asyn
         payment_method='free_trial'
     )
     session.add(payment)
+    await credit(session, user, to_kopecks(reward), "free_trial", payment=payment)
     await session.commit()
     
     await callback.answer(f"✅ Вам начислено {reward}₽ на баланс!", show_alert=True)
@@ -131,152 +131,6 @@ async def handle_waiting_button(callback: CallbackQuery):
     )
 
 
-async def update_ad_timer(message, total_seconds: int, ad_id: str, user_id: int):
-    """Обновляет таймер в сообщении с рекламой"""
-    try:
-        from aiogram import Bot
-        from config import BOT_TOKEN
-        bot = Bot(token=BOT_TOKEN)
-        
-        for seconds_left in range(total_seconds, 0, -1):
-            await asyncio.sleep(1)
-            
-            # Обновляем сообщение каждые 10 секунд или в последние 5 секунд
-            if seconds_left % 10 == 0 or seconds_left <= 5:
-                minutes = seconds_left // 60
-                seconds = seconds_left % 60
-                
-                # Получаем текущий текст сообщения
-                current_text = message.text
-                
-                # Обновляем только часть с таймером
-                lines = current_text.split('\n')
-                for i, line in enumerate(lines):
-                    if "⏰ <b>Время просмотра:</b>" in line:
-                        if seconds_left > 0:
-                            lines[i] = f"⏰ <b>Осталось времени:</b> {minutes}:{seconds:02d}"
-                        else:
-                            lines[i] = f"⏰ <b>Время просмотра завершено!</b>"
-                        break
-                
-                updated_text = '\n'.join(lines)
-                
-                try:
-                    if seconds_left > 0:
-                        # Обновляем сообщение с кнопкой ожидания
-                        from keyboards import get_waiting_keyboard
-                        await message.edit_text(
-                            updated_text,
-                            parse_mode="HTML",
-                            disable_web_page_preview=True,
-                            reply_markup=get_waiting_keyboard(seconds_left, ad_id)
-                        )
-                    else:
-                        # Время истекло, показываем кнопку подтверждения
-                        from keyboards import get_ad_confirmation_keyboard
-                        # Заменяем последнюю строку
-                        lines = updated_text.split('\n')
-                        if "Пожалуйста, уделите внимание" in lines[-1]:
-                            lines[-1] = "✅ <b>Время просмотра завершено! Теперь вы можете подтвердить просмотр.</b>"
-                        
-                        final_text = '\n'.join(lines)
-                        
-                        await message.edit_text(
-                            final_text,
-                            parse_mode="HTML",
-                            disable_web_page_preview=True,
-                            reply_markup=get_ad_confirmation_keyboard(ad_id)
-                        )
-                except Exception as e:
-                    logger.error(f"Ошибка при обновлении таймера: {e}")
-                    # Если не удалось обновить, прекращаем таймер
-                    break
-        
-        await bot.session.close()
-        
-    except Exception as e:
-        logger.error(f"Ошибка в таймере рекламы: {e}")
-
-
-@router.callback_query(F.data.startswith("confirm_ad_"))
-async def confirm_ad_watch(callback: CallbackQuery, session: AsyncSession, user: User):
-    """Подтверждение просмотра рекламы"""
-    try:
-        ad_id = callback.data.replace("confirm_ad_", "")
-        
-        # Проверяем, прошло ли достаточно времени
-        from aiogram.fsm.context import FSMContext
-        from aiogram.fsm.storage.base import StorageKey
-        from main import dp
-        from datetime import datetime
-        
-        state = FSMContext(
-            storage=dp.storage,
-            key=StorageKey(
-                chat_id=callback.message.chat.id,
-                user_id=callback.from_user.id,
-                bot_id=callback.bot.id
-            )
-        )
-        
-        data = await state.get_data()
-        stored_ad_id = data.get("ad_id")
-        ad_start_time_str = data.get("ad_start_time")
-        
-        # Проверяем совпадение ad_id и время просмотра
-        if stored_ad_id != ad_id:
-            await callback.answer("❌ Неверная реклама. Начните просмотр заново.", show_alert=True)
-            return
-        
-        if ad_start_time_str:
-            ad_start_time = datetime.fromisoformat(ad_start_time_str)
-            time_watched = (datetime.now() - ad_start_time).total_seconds()
-            
-            if time_watched < AD_WATCH_TIME:
-                remaining = AD_WATCH_TIME - int(time_watched)
-                await callback.answer(
-                    f"⏳ Пожалуйста, просмотрите рекламу еще {remaining} секунд.",
-                    show_alert=True
-                )
-                return
-        
-        # Начисляем награду
-        user.balance += AD_REWARD_AMOUNT
-        user.last_ad_watch = datetime.now()
-        
-        await session.commit()
-        
-        # Показываем успешное сообщение
-        success_message = (
-            f"✅ <b>Отлично!</b>\n\n"
-            f"💎 На ваш баланс начислено: <b>+{AD_REWARD_AMOUNT}₽</b>\n"
-            f"💰 Текущий баланс: <b>{user.balance}₽</b>\n\n"
-            "🎉 <i>Вы можете смотреть рекламу неограниченное количество раз!</i>\n"
-            "Просто вернитесь в меню баланса и выберите 'Бесплатные деньги за рекламу' снова."
-        )
-        
-        # Редактируем сообщение с рекламой
-        try:
-            await callback.message.edit_text(
-                success_message,
-                parse_mode="HTML",
-                reply_markup=get_back_to_balance_button()
-            )
-        except:
-            # Если не удалось редактировать, отправляем новое сообщение
-            await callback.message.answer(
-                success_message,
-                parse_mode="HTML",
-                reply_markup=get_back_to_balance_button()
-            )
-        
-        await callback.answer()
-        
-    except Exception as e:
-        logger.error(f"Ошибка при подтверждении рекламы: {e}", exc_info=True)
-        await callback.answer("❌ Ошибка при подтверждении. Попробуйте позже.", show_alert=True)
-
-
 @router.callback_query(F.data == "cancel_ad")
 async def cancel_ad_watch(callback: CallbackQuery):
     """Отмена просмотра рекламы"""
@@ -334,7 +188,7 @@ async def back_to_balance(callback: CallbackQuery):
     )
     await callback.answer()
 @router.callback_query(F.data.startswith("payment_"))
-async def handle_payment_selection(callback: CallbackQuery, user: User):
+async def handle_payment_selection(callback: CallbackQuery, user: User, session: AsyncSession):
     """Обработка выбора суммы для пополнения"""
     payment_data = callback.data
     logger.info(f"Пользователь {user.telegram_id} выбрал платеж: {payment_data}")
@@ -374,23 +228,21 @@ async def handle_payment_selection(callback: CallbackQuery, user: User):
         
         # Начисляем средства
         from database import Payment
-        from sqlalchemy.ext.asyncio import AsyncSession
         
         payment = Payment(
             user_id=user.id,
             amount=amount,
             status='completed',
-            method='free_trial'
+            payment_method='free_trial'
         )
         
-        # Обновляем баланс пользователя
-        user.balance += amount
         if hasattr(user, 'last_free_payment'):
             user.last_free_payment = datetime.now()
         
         try:
-            session = AsyncSession()  # Получаем сессию
             session.add(payment)
+            # Обновляем баланс пользователя
+            await credit(session, user, to_kopecks(amount), "free_trial", payment=payment)
             await session.commit()
             
             await callback.answer(
@@ -34,17 +34,3 @@ async def handle_back_to_main(callback: CallbackQuery, state: FSMContext):
     except Exception as e:
         logger.error(f"❌ Ошибка в back_to_main: {e}")
         await callback.answer("Произошла ошибка", show_alert=True)
-
-@router.callback_query(F.data == "cancel_operation")
-async def handle_cancel_operation(callback: CallbackQuery, state: FSMContext):
-    """Обработка кнопки 'Отмена'"""
-    current_state = await state.get_state()
-    if current_state:
-        await state.clear()
-    
-    await callback.message.edit_text(
-        "❌ Операция отменена.\n"
-        "Вы вернулись в главное меню.",
-        reply_markup=get_main_inline_menu(False)
-    )
-    await callback.answer()
\ No newline at end of file
@@ -1,12 +1,18 @@
 from aiogram import Router
 from aiogram.types import Message, BufferedInputFile
 from aiogram.fsm.context import FSMContext
+from aiogram.exceptions import TelegramBadRequest
 from states import ImageGeneration
 import logging
 from config import STABLE_DIFFUSION_ENABLED
 from database import User, Order
 from sqlalchemy.ext.asyncio import AsyncSession
+from keyboards import get_cancel_inline_button
 from services.ai_service import ai_service
+from services.scheduler import generation_scheduler, GenerationCancelled
+from services.image_cache import image_cache
+from services.image_postprocess import image_postprocessor, InvalidImage, DEFAULT_TIER
+from ledger import reserve, capture, release, to_kopecks, InsufficientFunds, HOLD_HELD
 
 router = Router()
 logger = logging.getLogger(__name__)
@@ -26,6 +32,11 @@ async def process_image_prompt(message: Message, state: FSMContext, user: User,
     # Получаем данные из состояния
     data = await state.get_data()
     cost = data.get("cost", 20)
+    tier = data.get("tier", DEFAULT_TIER)
+    tier_settings = image_postprocessor.tier_settings(tier)
+    size = tier_settings["max_side"]
+    # Кэш хранит только сжатую версию; тарифам с оригиналом нужна свежая генерация
+    use_cache = not tier_settings.get("send_original", False)
     
     prompt = message.text
     
@@ -38,10 +49,24 @@ async def process_image_prompt(message: Message, state: FSMContext, user: User,
         await message.answer("❌ Слишком короткий запрос. Минимум 3 символа.")
         return
     
-    # Проверяем баланс
-    if user.balance < cost:
+    if not STABLE_DIFFUSION_ENABLED:
+        await message.answer(
+            "❌ <b>Генерация изображений временно отключена</b>\n\n"
+            "Мы работаем над интеграцией новой модели.\n"
+            "Скоро все будет готово!",
+            parse_mode="HTML"
+        )
+        await state.clear()
+        return
+    
+    # Резервируем средства до генерации: параллельные запросы не потратят баланс дважды
+    try:
+        hold = await reserve(user, to_kopecks(cost), tier)
+    except InsufficientFunds:
         await message.answer(f"❌ Недостаточно средств. Нужно {cost}₽, у вас {user.balance}₽")
         return
+    # На время генерации транзакция не держится
+    await session.commit()
     
     # Показываем статус
     status_msg = await message.answer("⏳ <b>Генерирую изображение...</b>\n\n"
@@ -49,19 +74,6 @@ async def process_image_prompt(message: Message, state: FSMContext, user: User,
                                      parse_mode="HTML")
     
     try:
-        if not STABLE_DIFFUSION_ENABLED:
-            await status_msg.edit_text(
-                "❌ <b>Генерация изображений временно отключена</b>\n\n"
-                "Мы работаем над интеграцией новой модели.\n"
-                "Скоро все будет готово!",
-                parse_mode="HTML"
-            )
-            await state.clear()
-            return
-        
-        # Импортируем сервис только когда нужен
-        from services.ai_service import ai_service
-        
         # Генерируем изображение
         logger.info(f"Начало генерации изображения для пользователя {user.telegram_id}")
         logger.info(f"🖼️ Запрос: {prompt}")
@@ -69,17 +81,82 @@ async def process_image_prompt(message: Message, state: FSMContext, user: User,
         # Добавляем базовые улучшения к промпту
         enhanced_prompt = f"{prompt}, high quality, detailed, masterpiece"
         
-        result_text, image_bytes = await ai_service.generate_image(enhanced_prompt)
-        
-        if not image_bytes:
-            await status_msg.edit_text(f"❌ {result_text}")
-            await state.clear()
-            return
-        
-        logger.info(f"✅ Изображение сгенерировано, размер: {len(image_bytes)} байт")
-        
-        # Списание средств
-        user.balance -= cost
+        # Ищем готовый результат в кэше по переведенному промпту
+        english_prompt = await ai_service.translate_to_english(enhanced_prompt)
+        cache_key = image_cache.make_key(english_prompt, width=size, height=size, tier=tier)
+        cached_file_id = await image_cache.get_file_id(cache_key) if use_cache else None
+        image_bytes = await image_cache.get_bytes(cache_key) if use_cache and not cached_file_id else None
+        cacheable = bool(cached_file_id or image_bytes)
+        original = None
+        
+        if cacheable:
+            logger.info(f"🗂️ Изображение найдено в кэше для пользователя {user.telegram_id}")
+        else:
+            queued = False
+            
+            async def start_generation():
+                if queued:
+                    # Номер в очереди устарел; кнопка отмены работает и во время генерации
+                    try:
+                        await status_msg.edit_text(
+                            "⏳ <b>Генерирую изображение...</b>\n\n"
+                            "Это может занять 30-60 секунд.",
+                            parse_mode="HTML",
+                            reply_markup=get_cancel_inline_button()
+                        )
+                    except Exception as e:
+                        logger.debug(f"Не удалось обновить статус: {e}")
+                return await ai_service.generate_image(enhanced_prompt, size, size)
+            
+            async def show_queue_position(position: int):
+                nonlocal queued
+                queued = True
+                await status_msg.edit_text(
+                    f"⏳ <b>Вы #{position} в очереди</b>\n\n"
+                    "Генерация начнется автоматически.",
+                    parse_mode="HTML",
+                    reply_markup=get_cancel_inline_button()
+                )
+            
+            try:
+                result_text, image_bytes = await generation_scheduler.run(
+                    user.telegram_id,
+                    "image",
+                    start_generation,
+                    on_position=show_queue_position
+                )
+            except GenerationCancelled:
+                logger.info(f"Генерация изображения отменена пользователем {user.telegram_id}")
+                try:
+                    await status_msg.edit_text("❌ Генерация отменена.")
+                except:
+                    pass
+                await state.clear()
+                return
+            
+            if not image_bytes:
+                await status_msg.edit_text(f"❌ {result_text}")
+                await state.clear()
+                return
+            
+            logger.info(f"✅ Изображение сгенерировано, размер: {len(image_bytes)} байт")
+            
+            # Проверяем и сжимаем под тариф до списания средств
+            try:
+                processed = await image_postprocessor.process(image_bytes, tier)
+            except InvalidImage as e:
+                logger.warning(f"⚠️ Бэкенд вернул негодное изображение: {e}")
+                await status_msg.edit_text("❌ Не удалось получить изображение. Попробуйте еще раз.")
+                await state.clear()
+                return
+            image_bytes = processed.data
+            if processed.original:
+                original = BufferedInputFile(processed.original, filename=processed.original_filename)
+            
+            # Демо-заглушки не кэшируем, только настоящий результат
+            if use_cache and result_text.startswith("✅"):
+                await image_cache.put(cache_key, image_bytes)
+                cacheable = True
         
         # Сохраняем заказ
         order = Order(
@@ -90,21 +167,45 @@ async def process_image_prompt(message: Message, state: FSMContext, user: User,
             result="Изображение успешно сгенерировано",
             cost=cost
         )
-        session.add(order)
-        await session.commit()
         
-        logger.info(f"✅ Заказ сохранен, ID: {order.id}, баланс: {user.balance}")
+        # Подтверждаем резерв вместе с заказом
+        try:
+            await capture(user, hold, order)
+        except InsufficientFunds:
+            await status_msg.edit_text("❌ Недостаточно средств для списания. Пополните баланс.")
+            await state.clear()
+            return
         
-        # Отправляем изображение
-        photo = BufferedInputFile(image_bytes, filename="generated_image.png")
+        logger.info(f"✅ Заказ сохранен, ID: {order.id}, баланс: {user.balance}")
         
-        await message.answer_photo(
-            photo,
-            caption=f"✅ <b>Изображение готово!</b>\n\n"
-                   f"📝 <b>Запрос:</b> {prompt}\n\n"
-                   f"💳 Списано: {cost}₽ | 💰 Остаток: {user.balance:.2f}₽",
-            parse_mode="HTML"
+        # Отправляем изображение: по file_id без загрузки, если он уже есть
+        caption = (
+            f"✅ <b>Изображение готово!</b>\n\n"
+            f"📝 <b>Запрос:</b> {prompt}\n\n"
+            f"💳 Списано: {cost}₽ | 💰 Остаток: {user.balance:.2f}₽"
         )
+        sent = None
+        
+        if cached_file_id:
+            try:
+                sent = await message.answer_photo(cached_file_id, caption=caption, parse_mode="HTML")
+            except TelegramBadRequest as e:
+                logger.warning(f"⚠️ file_id из кэша не принят, загружаем файл заново: {e}")
+                await image_cache.forget_file_id(cache_key)
+                image_bytes = await image_cache.get_bytes(cache_key)
+                if not image_bytes:
+                    raise
+        
+        if sent is None:
+            photo = BufferedInputFile(image_bytes, filename="generated_image.jpg")
+            sent = await message.answer_photo(photo, caption=caption, parse_mode="HTML")
+            
+            if cacheable and sent.photo:
+                await image_cache.set_file_id(cache_key, sent.photo[-1].file_id)
+        
+        if original is not None:
+            # Фото Telegram пережимает; оригинал - файлом, без потерь
+            await message.answer_document(original, caption="📎 Оригинал в полном качестве")
         
         # Удаляем статус
         try:
@@ -130,4 +231,9 @@ async def process_image_prompt(message: Message, state: FSMContext, user: User,
                 parse_mode="HTML"
             )
         
-        await state.clear()
\ No newline at end of file
+        await state.clear()
+    
+    finally:
+        # Неподтвержденный резерв (ошибка, отмена) возвращаем на баланс
+        if hold.status == HOLD_HELD:
+            await release(user, hold)
@@ -1,14 +1,85 @@
 import asyncio
+import contextlib
 from aiogram import Router
 from aiogram.types import Message
 from aiogram.fsm.context import FSMContext
+from aiogram.exceptions import TelegramRetryAfter
 from states import TextGeneration
 import logging
+from config import TEXT_STREAMING_ENABLED, STREAM_EDIT_INTERVAL, STREAM_EDIT_MIN_CHARS
+from keyboards import get_cancel_inline_button
 from services.ai_service import ai_service
+from services.scheduler import generation_scheduler, GenerationCancelled
+from ledger import reserve, capture, release, to_kopecks, InsufficientFunds, HOLD_HELD
 
 router = Router()
 logger = logging.getLogger(__name__)
 
+# Telegram ограничивает сообщение 4096 символами, оставляем запас под заголовок
+STREAM_PREVIEW_LIMIT = 3500
+
+
+async def stream_text_to_message(
+    status_msg: Message,
+    prompt: str,
+    system_prompt: str,
+    max_tokens: int
+) -> str:
+    """Потоковая генерация с постепенным обновлением статус-сообщения.
+    
+    Правки объединяются: не чаще раза в STREAM_EDIT_INTERVAL секунд
+    и только если появилось хотя бы STREAM_EDIT_MIN_CHARS новых символов.
+    """
+    loop = asyncio.get_running_loop()
+    parts = []
+    shown_length = 0
+    next_edit_at = loop.time() + STREAM_EDIT_INTERVAL
+    
+    # aclosing: при break или отмене генератор закрывается сразу, освобождая
+    # соединение из пула и обрывая генерацию в Ollama, а не при сборке мусора
+    stream = ai_service.generate_text_stream(
+        prompt,
+        system_prompt=system_prompt,
+        max_tokens=max_tokens
+    )
+    async with contextlib.aclosing(stream):
+        async for chunk in stream:
+            if chunk.startswith("❌"):
+                if not parts:
+                    return chunk
+                # Обрыв потока после частичного ответа - отдаем то, что успели получить
+                logger.warning(f"Поток прерван: {chunk}")
+                break
+            
+            parts.append(chunk)
+            
+            now = loop.time()
+            if now < next_edit_at:
+                continue
+            
+            text = "".join(parts).strip()
+            if len(text) - shown_length < STREAM_EDIT_MIN_CHARS:
+                continue
+            
+            preview = text if len(text) <= STREAM_PREVIEW_LIMIT else "…" + text[-STREAM_PREVIEW_LIMIT:]
+            try:
+                # Без parse_mode: незавершенный текст может содержать битую разметку.
+                # Кнопка отмены остается до конца потока; итог - отдельным сообщением
+                await status_msg.edit_text(
+                    f"✍️ Генерирую текст...\n\n{preview} ▌",
+                    reply_markup=get_cancel_inline_button()
+                )
+                shown_length = len(text)
+                next_edit_at = now + STREAM_EDIT_INTERVAL
+            except TelegramRetryAfter as e:
+                next_edit_at = now + e.retry_after
+            except Exception as e:
+                logger.debug(f"Не удалось обновить статус потока: {e}")
+                next_edit_at = now + STREAM_EDIT_INTERVAL
+    
+    return "".join(parts).strip()
+
+
 @router.message(TextGeneration.waiting_for_prompt)
 async def process_text_prompt(message: Message, state: FSMContext, user, session):
     """Обработка запроса на генерацию текста - ИСПРАВЛЕННАЯ ВЕРСИЯ"""
@@ -34,6 +105,16 @@ async def process_text_prompt(message: Message, state: FSMContext, user, session
         await state.clear()
         return
     
+    # Резервируем средства до генерации: параллельные запросы не потратят баланс дважды
+    try:
+        hold = await reserve(user, to_kopecks(cost), "text_generation")
+    except InsufficientFunds:
+        await message.answer("❌ Недостаточно средств. Пополните баланс.")
+        await state.clear()
+        return
+    # На время генерации транзакция не держится
+    await session.commit()
+    
     # Статус-сообщение
     status_msg = await message.answer("⏳ <b>Генерирую текст...</b>", parse_mode="HTML")
     
@@ -44,16 +125,67 @@ async def process_text_prompt(message: Message, state: FSMContext, user, session
         # УВЕЛИЧИВАЕМ таймаут и уменьшаем токены
         system_prompt = "Ты полезный ассистент. Отвечай кратко и по делу. Твой ответ должен быть полностью на русском языке."
         
-        try:
+        queued = False
+        
+        async def start_generation():
+            if queued:
+                # Номер в очереди устарел; кнопка отмены работает и во время генерации
+                try:
+                    await status_msg.edit_text(
+                        "⏳ <b>Генерирую текст...</b>",
+                        parse_mode="HTML",
+                        reply_markup=get_cancel_inline_button()
+                    )
+                except Exception as e:
+                    logger.debug(f"Не удалось обновить статус: {e}")
+            
             # УВЕЛИЧИВАЕМ таймаут до 240 секунд, УМЕНЬШАЕМ токены до 512
-            generated_text = await asyncio.wait_for(
-                ai_service.generate_text(
+            if TEXT_STREAMING_ENABLED:
+                # Показываем текст по мере генерации
+                generation = stream_text_to_message(
+                    status_msg,
+                    prompt,
+                    system_prompt=system_prompt,
+                    max_tokens=512
+                )
+            else:
+                generation = ai_service.generate_text(
                     prompt, 
                     system_prompt=system_prompt, 
                     max_tokens=512  # УМЕНЬШЕНО с 2048
-                ),
+                )
+            
+            # Таймаут считаем от старта генерации, а не от постановки в очередь
+            return await asyncio.wait_for(
+                generation,
                 timeout=240.0  # УВЕЛИЧЕНО с 120.0
             )
+        
+        async def show_queue_position(position: int):
+            nonlocal queued
+            queued = True
+            await status_msg.edit_text(
+                f"⏳ <b>Вы #{position} в очереди</b>\n\n"
+                "Генерация начнется автоматически.",
+                parse_mode="HTML",
+                reply_markup=get_cancel_inline_button()
+            )
+        
+        try:
+            generated_text = await generation_scheduler.run(
+                user.telegram_id,
+                "ollama",
+                start_generation,
+                on_position=show_queue_position
+            )
+        except GenerationCancelled:
+            logger.info(f"Генерация текста отменена пользователем {user.telegram_id}")
+            try:
+                await status_msg.edit_text("❌ Генерация отменена.")
+            except:
+                pass
+            await state.clear()
+            return
         except asyncio.TimeoutError:
             logger.error("Таймаут генерации (240 секунд)")
             try:
@@ -86,9 +218,6 @@ async def process_text_prompt(message: Message, state: FSMContext, user, session
             await state.clear()
             return
         
-        # Списание средств
-        user.balance -= cost
-        
         # Сохраняем заказ
         from database import Order
         order = Order(
@@ -99,8 +228,14 @@ async def process_text_prompt(message: Message, state: FSMContext, user, session
             result=generated_text[:2000],  # Уменьшено с 4000
             cost=cost
         )
-        session.add(order)
-        await session.commit()
+        
+        # Подтверждаем резерв вместе с заказом
+        try:
+            await capture(user, hold, order)
+        except InsufficientFunds:
+            await status_msg.edit_text("❌ Недостаточно средств для списания. Пополните баланс.")
+            await state.clear()
+            return
         
         logger.info(f"Заказ сохранен, ID: {order.id}, баланс: {user.balance}")
         
@@ -139,6 +274,11 @@ async def process_text_prompt(message: Message, state: FSMContext, user, session
         
         # ГАРАНТИРОВАННАЯ очистка состояния
         await state.clear()
+    
+    finally:
+        # Неподтвержденный резерв (ошибка, таймаут, отмена) возвращаем на баланс
+        if hold.status == HOLD_HELD:
+            await release(user, hold)
 
 async def check_and_notify_ollama_status():
     """Проверка статуса Ollama после таймаута"""
@@ -171,6 +311,16 @@ async def process_text_prompt(message: Message, state: FSMContext, user, session
         await message.answer("❌ Слишком короткий запрос. Минимум 3 символа.")
         return
     
+    # Резервируем средства до генерации: параллельные запросы не потратят баланс дважды
+    try:
+        hold = await reserve(user, to_kopecks(cost), "text_generation")
+    except InsufficientFunds:
+        await message.answer("❌ Недостаточно средств. Пополните баланс.")
+        await state.clear()
+        return
+    # На время генерации транзакция не держится
+    await session.commit()
+    
     # Показываем статус
     status_msg = await message.answer("⏳ <b>Генерирую текст...</b>", parse_mode="HTML")
     
@@ -210,9 +360,6 @@ async def process_text_prompt(message: Message, state: FSMContext, user, session
             await state.clear()
             return
         
-        # Списание средств
-        user.balance -= cost
-        
         # Сохраняем заказ
         from database import Order
         order = Order(
@@ -223,8 +370,14 @@ async def process_text_prompt(message: Message, state: FSMContext, user, session
             result=generated_text[:4000],  # Увеличенный лимит сохранения
             cost=cost
         )
-        session.add(order)
-        await session.commit()
+        
+        # Подтверждаем резерв вместе с заказом
+        try:
+            await capture(user, hold, order)
+        except InsufficientFunds:
+            await status_msg.edit_text("❌ Недостаточно средств для списания. Пополните баланс.")
+            await state.clear()
+            return
         
         logger.info(f"Заказ сохранен, ID: {order.id}, баланс: {user.balance}")
         
@@ -261,4 +414,8 @@ async def process_text_prompt(message: Message, state: FSMContext, user, session
                 parse_mode="HTML"
             )
         
-        await state.clear()
\ No newline at end of file
+        await state.clear()
+    finally:
+        # Неподтвержденный резерв (ошибка, таймаут, отмена) возвращаем на баланс
+        if hold.status == HOLD_HELD:
+            await release(user, hold)
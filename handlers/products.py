@@ -12,7 +12,7 @@ from aiogram import Router, F
 from aiogram.types import CallbackQuery
 from aiogram.fsm.context import FSMContext
 from states import ImageGeneration
-from keyboards import get_back_button
+from keyboards import get_back_button, get_image_quality_keyboard
 
 router = Router()
 
@@ -21,7 +21,7 @@ router = Router()
 @router.callback_query(F.data == "image_generation")
 async def handle_image_generation(callback: CallbackQuery, state: FSMContext):
     """Обработчик кнопки генерации изображений"""
-    from config import PRICE_CONFIG, STABLE_DIFFUSION_ENABLED
+    from config import PRICE_CONFIG, STABLE_DIFFUSION_ENABLED, IMAGE_TIERS_MENU_ENABLED
     
     cost = PRICE_CONFIG.get('image_generation', 20)
     
@@ -63,7 +63,7 @@ async def handle_image_generation(callback: CallbackQuery, state: FSMContext):
         "• 'Футуристический город будущего ночью, неоновые огни, дождь, киберпанк стиль, Blade Runner'\n\n"
         "<i>Отправьте ваш запрос ниже...</i>",
         parse_mode="HTML",
-        reply_markup=get_back_button()
+        reply_markup=get_image_quality_keyboard() if IMAGE_TIERS_MENU_ENABLED else get_back_button()
     )
     await callback.answer()
 
@@ -119,9 +119,36 @@ async def handle_audio_transcription(callback: CallbackQuery):
 
 
 @router.callback_query(F.data.in_(["image_sd", "image_hd", "image_4k"]))
-async def handle_image_options(callback: CallbackQuery):
+async def handle_image_options(callback: CallbackQuery, state: FSMContext):
     """Обработчик выбора качества изображения"""
-    await callback.answer("⏳ Функция в разработке", show_alert=True)
+    from config import PRICE_CONFIG, IMAGE_TIERS, STABLE_DIFFUSION_ENABLED, IMAGE_TIERS_MENU_ENABLED
+    
+    if not IMAGE_TIERS_MENU_ENABLED:
+        await callback.answer("⏳ Функция в разработке", show_alert=True)
+        return
+    
+    if not STABLE_DIFFUSION_ENABLED:
+        await callback.answer("⏳ Генерация изображений временно недоступна", show_alert=True)
+        return
+    
+    tier = callback.data
+    cost = PRICE_CONFIG[tier]
+    max_side = IMAGE_TIERS[tier]['max_side']
+    
+    # Тариф определяет размер и сжатие готового изображения
+    await state.set_state(ImageGeneration.waiting_for_prompt)
+    await state.update_data(cost=cost, tier=tier)
+    
+    extra = "\n📎 Оригинал придет отдельным файлом без сжатия" if IMAGE_TIERS[tier]['send_original'] else ""
+    await callback.message.edit_text(
+        "🖼️ <b>Генерация изображений</b>\n\n"
+        f"💳 Стоимость: {cost}₽\n"
+        f"📐 Размер: до {max_side}px по длинной стороне{extra}\n\n"
+        "<i>Отправьте ваш запрос ниже...</i>",
+        parse_mode="HTML",
+        reply_markup=get_back_button()
+    )
+    await callback.answer()
 
 
 @router.callback_query(F.data.in_(["audio_short", "audio_long"]))
@@ -1,3 +1,5 @@
+from typing import Optional
+
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from config import PRICE_CONFIG, MANAGER_USERNAME
@@ -35,6 +37,18 @@ def get_back_button() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+def get_image_quality_keyboard() -> InlineKeyboardMarkup:
+    """Выбор качества изображения (обычное - сразу по промпту)"""
+    builder = InlineKeyboardBuilder()
+    builder.row(
+        InlineKeyboardButton(text=f"⚡ SD - {PRICE_CONFIG['image_sd']}₽", callback_data="image_sd"),
+        InlineKeyboardButton(text=f"✨ HD - {PRICE_CONFIG['image_hd']}₽", callback_data="image_hd"),
+        InlineKeyboardButton(text=f"💎 4K - {PRICE_CONFIG['image_4k']}₽", callback_data="image_4k")
+    )
+    builder.row(InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_main"))
+    return builder.as_markup()
+
+
 def get_back_to_payments_button() -> InlineKeyboardMarkup:
     """Кнопка возврата к списку платежей"""
     builder = InlineKeyboardBuilder()
@@ -42,6 +56,30 @@ def get_back_to_payments_button() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+def get_pagination_keyboard(
+    prefix: str,
+    has_prev: bool,
+    has_next: bool,
+    first_id: Optional[int] = None,
+    last_id: Optional[int] = None,
+    back_callback: str = "admin_payments"
+) -> InlineKeyboardMarkup:
+    """Листание списка: callback_data вида prefix:prev:<id> и prefix:next:<id>"""
+    builder = InlineKeyboardBuilder()
+    
+    navigation = []
+    if has_prev and first_id is not None:
+        navigation.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=f"{prefix}:prev:{first_id}"))
+    if has_next and last_id is not None:
+        navigation.append(InlineKeyboardButton(text="Вперед ➡️", callback_data=f"{prefix}:next:{last_id}"))
+    if navigation:
+        builder.row(*navigation)
+    
+    builder.row(InlineKeyboardButton(text="🔙 Назад к платежам", callback_data=back_callback))
+    
+    return builder.as_markup()
+
+
 def get_cancel_inline_button() -> InlineKeyboardMarkup:
     """Inline-кнопка отмены"""
     builder = InlineKeyboardBuilder()
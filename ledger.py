@@ -0,0 +1,292 @@
+# ledger.py - атомарные операции с балансом
+from datetime import datetime, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Optional, Union
+import asyncio
+import logging
+
+import pytz
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.attributes import set_committed_value
+
+from config import HOLD_TTL_SECONDS, HOLD_RECLAIM_INTERVAL
+from database import AsyncSessionLocal, User, Order, Payment, BalanceTransaction, BalanceHold, user_cache
+
+logger = logging.getLogger(__name__)
+
+KOPECKS_IN_RUBLE = 100
+
+# Статусы резерва
+HOLD_HELD = "held"
+HOLD_CAPTURED = "captured"
+HOLD_RELEASED = "released"
+HOLD_EXPIRED = "expired"
+
+
+class InsufficientFunds(Exception):
+    """На балансе не хватает средств для списания"""
+
+    def __init__(self, user_id: int, amount_kopecks: int):
+        super().__init__(f"Недостаточно средств у пользователя {user_id}: нужно {from_kopecks(amount_kopecks)}₽")
+        self.user_id = user_id
+        self.amount_kopecks = amount_kopecks
+
+
+def to_kopecks(amount: Union[int, float, Decimal, str]) -> int:
+    """Рубли в копейки без ошибок округления float"""
+    return int((Decimal(str(amount)) * KOPECKS_IN_RUBLE).quantize(Decimal("1"), rounding=ROUND_HALF_UP))
+
+
+def from_kopecks(amount_kopecks: int) -> float:
+    return amount_kopecks / KOPECKS_IN_RUBLE
+
+
+async def debit(
+    session: AsyncSession,
+    user: User,
+    amount_kopecks: int,
+    reason: str,
+    order: Optional[Order] = None
+) -> BalanceTransaction:
+    """Списывает средства одним условным UPDATE ... RETURNING.
+
+    Баланс уменьшается на стороне БД только если средств хватает, поэтому
+    параллельные списания (в том числе из разных процессов) не теряют
+    обновлений и не уводят баланс в минус. Коммит делает вызывающий код,
+    вместе с заказом.
+    """
+    if amount_kopecks <= 0:
+        raise ValueError("Сумма списания должна быть положительной")
+
+    result = await session.execute(
+        update(User)
+        .where(User.id == user.id, User.balance_kopecks >= amount_kopecks)
+        .values(balance_kopecks=User.balance_kopecks - amount_kopecks)
+        .returning(User.balance_kopecks)
+        .execution_options(synchronize_session=False)
+    )
+    new_balance = result.scalar_one_or_none()
+    if new_balance is None:
+        raise InsufficientFunds(user.id, amount_kopecks)
+
+    return _record(session, user, -amount_kopecks, new_balance, reason, order=order)
+
+
+async def credit(
+    session: AsyncSession,
+    user: User,
+    amount_kopecks: int,
+    reason: str,
+    payment: Optional[Payment] = None
+) -> BalanceTransaction:
+    """Зачисляет средства атомарным UPDATE ... RETURNING"""
+    if amount_kopecks <= 0:
+        raise ValueError("Сумма зачисления должна быть положительной")
+
+    result = await session.execute(
+        update(User)
+        .where(User.id == user.id)
+        .values(balance_kopecks=User.balance_kopecks + amount_kopecks)
+        .returning(User.balance_kopecks)
+        .execution_options(synchronize_session=False)
+    )
+    new_balance = result.scalar_one()
+
+    return _record(session, user, amount_kopecks, new_balance, reason, payment=payment)
+
+
+# ========== РЕЗЕРВИРОВАНИЕ ==========
+#
+# Долгие генерации оплачиваются в три шага: reserve() до вызова бэкенда,
+# capture() после успеха или release() при ошибке и отмене. Каждый шаг -
+# своя короткая транзакция, поэтому на время генерации соединение с БД
+# не занято, а параллельные генерации не могут потратить один баланс дважды.
+
+async def reserve(
+    user: User,
+    amount_kopecks: int,
+    reason: str,
+    ttl: int = HOLD_TTL_SECONDS
+) -> BalanceHold:
+    """Переводит средства с баланса в резерв (или InsufficientFunds)"""
+    if amount_kopecks <= 0:
+        raise ValueError("Сумма резерва должна быть положительной")
+
+    now = datetime.now(pytz.UTC)
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            update(User)
+            .where(User.id == user.id, User.balance_kopecks >= amount_kopecks)
+            .values(balance_kopecks=User.balance_kopecks - amount_kopecks)
+            .returning(User.balance_kopecks)
+            .execution_options(synchronize_session=False)
+        )
+        new_balance = result.scalar_one_or_none()
+        if new_balance is None:
+            raise InsufficientFunds(user.id, amount_kopecks)
+
+        hold = BalanceHold(
+            user_id=user.id,
+            amount_kopecks=amount_kopecks,
+            reason=reason,
+            status=HOLD_HELD,
+            created_at=now,
+            expires_at=now + timedelta(seconds=ttl)
+        )
+        session.add(hold)
+        _record(session, user, -amount_kopecks, new_balance, reason)
+        await session.commit()
+
+    logger.info(f"🔒 Резерв #{hold.id}: {from_kopecks(amount_kopecks):.2f}₽ пользователя {user.id} ({reason})")
+    return hold
+
+
+async def capture(user: User, hold: BalanceHold, order: Order) -> Order:
+    """Подтверждает резерв и сохраняет заказ.
+
+    Если резерв уже вернули (генерация пережила HOLD_TTL_SECONDS), средства
+    списываются заново обычным debit - при нехватке будет InsufficientFunds.
+    """
+    now = datetime.now(pytz.UTC)
+    async with AsyncSessionLocal() as session:
+        session.add(order)
+        await session.flush()
+
+        result = await session.execute(
+            update(BalanceHold)
+            .where(BalanceHold.id == hold.id, BalanceHold.status == HOLD_HELD)
+            .values(status=HOLD_CAPTURED, order_id=order.id, settled_at=now)
+            .returning(BalanceHold.id)
+            .execution_options(synchronize_session=False)
+        )
+        if result.scalar_one_or_none() is None:
+            logger.warning(f"⚠️ Резерв #{hold.id} уже закрыт, списываем заново")
+            await debit(session, user, hold.amount_kopecks, hold.reason, order=order)
+
+        await session.commit()
+
+    set_committed_value(hold, "status", HOLD_CAPTURED)
+    return order
+
+
+async def release(user: User, hold: BalanceHold) -> bool:
+    """Возвращает резерв на баланс; False, если резерв уже закрыт"""
+    async with AsyncSessionLocal() as session:
+        refunded = await _refund_hold(session, user, hold.id, HOLD_RELEASED, "hold_release")
+        await session.commit()
+
+    if refunded:
+        set_committed_value(hold, "status", HOLD_RELEASED)
+    return refunded
+
+
+async def _refund_hold(session: AsyncSession, user: User, hold_id: int, status: str, reason: str) -> bool:
+    # Условие на статус гарантирует, что резерв вернется ровно один раз,
+    # даже если release() и фоновый возврат сработали одновременно
+    result = await session.execute(
+        update(BalanceHold)
+        .where(BalanceHold.id == hold_id, BalanceHold.status == HOLD_HELD)
+        .values(status=status, settled_at=datetime.now(pytz.UTC))
+        .returning(BalanceHold.amount_kopecks)
+        .execution_options(synchronize_session=False)
+    )
+    amount_kopecks = result.scalar_one_or_none()
+    if amount_kopecks is None:
+        return False
+
+    await credit(session, user, amount_kopecks, reason)
+    return True
+
+
+class HoldReclaimer:
+    """Фоновый возврат просроченных резервов.
+
+    Резерв может остаться незакрытым, если процесс упал посреди генерации.
+    Раз в interval такие резервы возвращаются на баланс.
+    """
+
+    def __init__(self, interval: float = HOLD_RECLAIM_INTERVAL, batch_size: int = 100):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+
+    async def reclaim_expired(self) -> int:
+        """Возвращает просроченные резервы, результат - сколько вернули"""
+        reclaimed = 0
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                select(BalanceHold.id, User)
+                .join(User, User.id == BalanceHold.user_id)
+                .where(BalanceHold.status == HOLD_HELD, BalanceHold.expires_at < datetime.now(pytz.UTC))
+                .order_by(BalanceHold.expires_at)
+                .limit(self.batch_size)
+            )
+            expired = result.all()
+
+            for hold_id, user in expired:
+                if await _refund_hold(session, user, hold_id, HOLD_EXPIRED, "hold_expired"):
+                    reclaimed += 1
+            await session.commit()
+
+        # Кэш пользователей мог сохранить баланс без возвращенных средств
+        for _, user in expired:
+            user_cache.invalidate(user.telegram_id)
+
+        if reclaimed:
+            logger.warning(f"⏳ Возвращено просроченных резервов: {reclaimed}")
+        return reclaimed
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.reclaim_expired()
+            except Exception as e:
+                logger.error(f"❌ Ошибка возврата просроченных резервов: {e}")
+            await asyncio.sleep(self.interval)
+
+
+def _record(
+    session: AsyncSession,
+    user: User,
+    amount_kopecks: int,
+    new_balance: int,
+    reason: str,
+    order: Optional[Order] = None,
+    payment: Optional[Payment] = None
+) -> BalanceTransaction:
+    # Объект пользователя получает баланс из БД, не помечаясь измененным
+    set_committed_value(user, "balance_kopecks", new_balance)
+
+    transaction = BalanceTransaction(
+        user_id=user.id,
+        amount_kopecks=amount_kopecks,
+        balance_after_kopecks=new_balance,
+        reason=reason,
+        order=order,
+        payment=payment
+    )
+    session.add(transaction)
+
+    logger.info(
+        f"💰 {reason}: {from_kopecks(amount_kopecks):+.2f}₽ пользователю {user.id}, "
+        f"баланс {from_kopecks(new_balance):.2f}₽"
+    )
+    return transaction
+
+
+# Глобальный экземпляр
+hold_reclaimer = HoldReclaimer()
@@ -2,16 +2,14 @@ import asyncio
 import logging
 import sys
 import os
+from typing import Optional
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
-from config import BOT_TOKEN
+from config import BOT_TOKEN, BOT_MODE, SHARD_WORKERS
 
 # Импортируем обработчики
 from handlers import router
-from middlewares import register_middlewares
-
-# Импортируем keep_alive
-from keep_alive import keep_alive
+from middlewares import register_middlewares, register_request_middlewares
+from fsm_storage import create_fsm_storage
 
 # Создаем папку logs, если ее нет
 os.makedirs("logs", exist_ok=True)
@@ -28,26 +26,36 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-async def setup_bot():
-    """Настройка и запуск бота"""
-    # Проверяем наличие токена
-    if not BOT_TOKEN:
-        logger.error("❌ BOT_TOKEN не установлен. Проверьте .env файл")
-        sys.exit(1)
-    
-    logger.info("🚀 Настройка бота...")
-    
-    # Инициализируем базу данных
+async def init_database():
+    """Инициализация базы данных (миграции)"""
     try:
         from database import init_db
         await init_db()
         logger.info("✅ База данных инициализирована")
     except Exception as e:
         logger.error(f"❌ Ошибка инициализации БД: {e}")
+
+
+async def setup_bot(shard: Optional[int] = None, shards: int = 1):
+    """Настройка и запуск бота.
+    
+    shard - номер процесса-шарда (см. sharding.py): базу уже подготовил
+    фронт, а фоновые задачи запускает только шард 0.
+    """
+    # Проверяем наличие токена
+    if not BOT_TOKEN:
+        logger.error("❌ BOT_TOKEN не установлен. Проверьте .env файл")
+        sys.exit(1)
+    
+    logger.info("🚀 Настройка бота..." if shard is None else f"🚀 Настройка шарда {shard}...")
+    
+    if shard is None:
+        await init_database()
     
     # Создаем бота и диспетчер
     bot = Bot(token=BOT_TOKEN)
-    storage = MemoryStorage()
+    register_request_middlewares(bot, shards=shards)
+    storage = create_fsm_storage()
     dp = Dispatcher(storage=storage)
     
     # Регистрируем middleware
@@ -60,12 +68,86 @@ async def setup_bot():
     # Регистрируем роутер
     dp.include_router(router)
     
-    # Проверяем доступность сервисов
-    await check_services()
+    # Создаем общий пул HTTP-соединений для AI сервиса
+    from services.ai_service import ai_service
+    await ai_service.start()
+    
+    # Запускаем отложенную запись активности пользователей
+    from database import activity_buffer
+    activity_buffer.start()
+    
+    # Продолжаем рассылки с истекшей арендой: прерванные перезапуском и
+    # оставшиеся от упавших шардов (подхватит любой шард, но только один)
+    from services.broadcast import broadcast_service
+    broadcast_service.watch(bot)
+    
+    if not shard:
+        # Возвращаем на баланс резервы, брошенные незавершенными генерациями
+        from ledger import hold_reclaimer
+        hold_reclaimer.start()
+        
+        # Проверяем доступность сервисов
+        await check_services()
     
     return bot, dp
 
 
+async def shutdown_bot(bot: Bot, dp: Dispatcher):
+    """Остановка фоновых задач и закрытие соединений"""
+    # Останавливаем рассылки до закрытия сессии бота (прогресс сохранен)
+    try:
+        from services.broadcast import broadcast_service
+        await broadcast_service.stop()
+    except Exception as e:
+        logger.error(f"❌ Ошибка остановки рассылок: {e}")
+    
+    try:
+        from services.timer_wheel import timer_wheel
+        await timer_wheel.stop()
+    except Exception as e:
+        logger.error(f"❌ Ошибка остановки таймеров: {e}")
+    
+    # Корректное завершение
+    try:
+        await bot.session.close()
+        logger.info("📴 Сессия бота закрыта")
+    except:
+        pass
+    
+    # Сбрасываем несохраненные состояния FSM
+    try:
+        await dp.storage.close()
+        logger.info("💾 Хранилище FSM закрыто")
+    except Exception as e:
+        logger.error(f"❌ Ошибка закрытия хранилища FSM: {e}")
+    
+    # Записываем накопленную активность пользователей
+    try:
+        from database import activity_buffer
+        await activity_buffer.stop()
+    except Exception as e:
+        logger.error(f"❌ Ошибка записи активности: {e}")
+    
+    try:
+        from ledger import hold_reclaimer
+        await hold_reclaimer.stop()
+    except Exception as e:
+        logger.error(f"❌ Ошибка остановки возврата резервов: {e}")
+    
+    # Закрываем пул HTTP-соединений
+    try:
+        from services.ai_service import ai_service
+        await ai_service.close()
+    except Exception as e:
+        logger.error(f"❌ Ошибка закрытия HTTP пула: {e}")
+    
+    try:
+        from services.image_postprocess import image_postprocessor
+        image_postprocessor.close()
+    except Exception as e:
+        logger.error(f"❌ Ошибка остановки обработки изображений: {e}")
+
+
 async def check_services():
     """Проверка доступности всех сервисов"""
     logger.info("🔍 Проверка доступности сервисов...")
@@ -93,35 +175,56 @@ async def check_services():
 
 async def main():
     """Основная функция запуска бота"""
-    # Запускаем keep-alive сервисы
-    logger.info("🔗 Запуск keep-alive сервисов...")
-    keep_alive.start()
+    keep_alive = None
+    if BOT_MODE != "webhook":
+        # Flask и requests нужны только для keep-alive в режиме polling
+        from keep_alive import keep_alive
+        logger.info("🔗 Запуск keep-alive сервисов...")
+        keep_alive.start()
     
+    bot = dp = None
     try:
+        if SHARD_WORKERS > 1:
+            # Этот процесс только принимает обновления, обрабатывают шарды
+            from sharding import run_sharded
+            await init_database()
+            front = Dispatcher()
+            front.include_router(router)
+            logger.info(f"🤖 Бот запущен: {SHARD_WORKERS} процессов-обработчиков")
+            await run_sharded(setup_bot, shutdown_bot, front.resolve_used_update_types())
+            return
+        
         # Настраиваем бота
         bot, dp = await setup_bot()
         
         logger.info("🤖 Бот запущен и готов к работе!")
         logger.info("📱 Перейдите в Telegram и начните общение с ботом")
         
-        # Запускаем polling
-        await dp.start_polling(bot)
+        if BOT_MODE == "webhook":
+            # Webhook на aiohttp-сервере в этом же цикле событий
+            from webhook import UpdateQueue, run_webhook
+            updates = UpdateQueue(dp, bot)
+            await updates.start()
+            try:
+                await run_webhook(bot, updates, dp.resolve_used_update_types())
+            finally:
+                await updates.stop()
+        else:
+            # Запускаем polling (webhook мог остаться от прошлого запуска)
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
         
     except KeyboardInterrupt:
         logger.info("🛑 Бот остановлен пользователем")
     except Exception as e:
         logger.error(f"❌ Критическая ошибка: {e}", exc_info=True)
     finally:
-        # Корректное завершение
-        try:
-            if 'bot' in locals():
-                await bot.session.close()
-                logger.info("📴 Сессия бота закрыта")
-        except:
-            pass
+        if bot is not None:
+            await shutdown_bot(bot, dp)
         
         # Останавливаем keep-alive
-        keep_alive.stop()
+        if keep_alive:
+            keep_alive.stop()
         logger.info("🛑 Все сервисы остановлены")
 
 
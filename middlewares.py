@@ -1,37 +1,54 @@
-from aiogram import BaseMiddleware
-from aiogram.types import Message, CallbackQuery, Update
-from typing import Callable, Dict, Any, Awaitable, Union
+import asyncio
+import logging
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import Response, TelegramMethod
+from aiogram.types import Message, CallbackQuery
+from typing import Callable, Dict, Any, Awaitable, Hashable, Optional, Tuple, Union
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from database import get_or_create_user, AsyncSessionLocal
+from config import (
+    TELEGRAM_GLOBAL_RATE, TELEGRAM_PER_CHAT_RATE, TELEGRAM_PER_CHAT_BURST, TELEGRAM_MAX_RETRIES
+)
+from database import get_or_create_user, AsyncSessionLocal, user_cache, activity_buffer
+from services.rate_limiter import KeyedRateLimiter, TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Параметры обработчика, ради которых нужна база
+DATABASE_PARAMS = {"session", "user"}
 
 
 class DatabaseMiddleware(BaseMiddleware):
-    """Middleware для работы с базой данных"""
+    """Middleware для работы с базой данных.
+    
+    Регистрируется как inner-middleware, когда обработчик уже выбран:
+    сессия открывается и пользователь загружается, только если обработчик
+    принимает session или user. Навигационные кнопки в базу не ходят.
+    """
     
     async def __call__(
         self,
-        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
-        event: Update,
+        handler: Callable[[Union[Message, CallbackQuery], Dict[str, Any]], Awaitable[Any]],
+        event: Union[Message, CallbackQuery],
         data: Dict[str, Any]
     ) -> Any:
-        # Определяем тип события и получаем пользователя
-        user_data = None
-        
-        if hasattr(event, 'message') and event.message:
-            # Для CallbackQuery
-            user_data = event.message.from_user if event.message.from_user else None
-        elif hasattr(event, 'from_user'):
-            # Для Message и других событий с from_user
-            user_data = event.from_user
-        elif hasattr(event, 'callback_query') and event.callback_query:
-            # Для Update с callback_query
-            user_data = event.callback_query.from_user
+        # Пользователь, от которого пришло событие
+        user_data = getattr(event, 'from_user', None)
         
         if not user_data:
             # Если не смогли определить пользователя, пропускаем
             return await handler(event, data)
         
+        if not self._needs_database(data):
+            # Активность отмечаем без запроса, если пользователь уже в кэше
+            cached = user_cache.get(user_data.id)
+            if cached is not None:
+                activity_buffer.touch(cached.id)
+            return await handler(event, data)
+        
         async with AsyncSessionLocal() as session:
             # Получаем или создаем пользователя в БД
             user = await get_or_create_user(
@@ -52,15 +69,158 @@ class DatabaseMiddleware(BaseMiddleware):
             data["session"] = session
             data["user"] = user
             
-            # Вызываем обработчик
-            result = await handler(event, data)
-            
-            # Коммитим изменения
-            await session.commit()
-            
-            return result
+            try:
+                # Вызываем обработчик
+                result = await handler(event, data)
+                
+                # Коммитим изменения
+                await session.commit()
+            except BaseException:
+                # Объект мог остаться с несохраненными изменениями
+                user_cache.invalidate(user_data.id)
+                raise
+        
+        # После закрытия сессии объект отсоединен и годится для кэша
+        user_cache.put(user)
+        return result
+    
+    @staticmethod
+    def _needs_database(data: Dict[str, Any]) -> bool:
+        handler_object = data.get("handler")
+        if handler_object is None:
+            # Обработчик неизвестен - работаем как раньше
+            return True
+        return handler_object.varkw or bool(DATABASE_PARAMS & handler_object.params)
 
 
 def register_middlewares(dp):
     """Регистрация всех middleware"""
-    dp.update.middleware(DatabaseMiddleware())
+    database_middleware = DatabaseMiddleware()
+    dp.message.middleware(database_middleware)
+    dp.callback_query.middleware(database_middleware)
+
+
+# ========== ИСХОДЯЩИЕ ЗАПРОСЫ ==========
+
+# Методы, на которые действуют лимиты Telegram на сообщения
+LIMITED_METHOD_PREFIXES = ("send", "edit", "copy", "forward")
+# Статус "печатает..." в лимиты не входит и не должен задерживать ответ
+UNLIMITED_METHODS = {"sendChatAction"}
+
+
+class _PendingEdit:
+    """Правка сообщения, ждущая своей очереди в лимитере"""
+
+    __slots__ = ("method", "future", "waiters")
+
+    def __init__(self, method: TelegramMethod, future: asyncio.Future):
+        self.method = method
+        self.future = future
+        self.waiters = 0
+
+
+class RateLimitRequestMiddleware(BaseRequestMiddleware):
+    """Лимиты Telegram для всех исходящих запросов бота.
+
+    Подключается к сессии бота, поэтому действует на обработчики, таймеры
+    и рассылки одинаково. Сообщения и правки проходят через общее ведро
+    токенов и ведро своего чата. Пока правка сообщения ждет очереди, более
+    новая правка того же сообщения занимает ее место: уходит только
+    последнее состояние, а оба вызова получают один ответ. RetryAfter
+    останавливает общее ведро на указанное время, после чего запрос
+    повторяется.
+    """
+
+    def __init__(
+        self,
+        rate: float = TELEGRAM_GLOBAL_RATE,
+        per_chat_rate: float = TELEGRAM_PER_CHAT_RATE,
+        per_chat_burst: float = TELEGRAM_PER_CHAT_BURST,
+        max_retries: int = TELEGRAM_MAX_RETRIES
+    ):
+        self.limiter = TokenBucket(rate)
+        self.chat_limiter = KeyedRateLimiter(per_chat_rate, per_chat_burst)
+        self.max_retries = max_retries
+        self._pending_edits: Dict[Tuple[str, Hashable, int], _PendingEdit] = {}
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType,
+        bot: Bot,
+        method: TelegramMethod
+    ) -> Response:
+        api_method = method.__api_method__
+        if api_method in UNLIMITED_METHODS or not api_method.startswith(LIMITED_METHOD_PREFIXES):
+            return await make_request(bot, method)
+
+        chat_id = getattr(method, "chat_id", None)
+        message_id = getattr(method, "message_id", None)
+        if api_method.startswith("edit") and chat_id is not None and message_id is not None:
+            return await self._coalesced_edit(make_request, bot, method, (api_method, chat_id, message_id))
+
+        await self._acquire(chat_id)
+        return await self._request(make_request, bot, method)
+
+    async def _coalesced_edit(
+        self,
+        make_request: NextRequestMiddlewareType,
+        bot: Bot,
+        method: TelegramMethod,
+        key: Tuple[str, Hashable, int]
+    ) -> Response:
+        pending = self._pending_edits.get(key)
+        if pending is not None:
+            # Правка еще не ушла - подменяем ее новой и ждем общего ответа
+            pending.method = method
+            pending.waiters += 1
+            return await asyncio.shield(pending.future)
+
+        pending = self._pending_edits[key] = _PendingEdit(method, asyncio.get_running_loop().create_future())
+        try:
+            await self._acquire(key[1])
+            # Дальше правку уже не подменить: уходит то, что лежит в pending
+            del self._pending_edits[key]
+            response = await self._request(make_request, bot, pending.method)
+        except BaseException as e:
+            if self._pending_edits.get(key) is pending:
+                del self._pending_edits[key]
+            if pending.waiters:
+                if isinstance(e, asyncio.CancelledError):
+                    pending.future.cancel()
+                else:
+                    pending.future.set_exception(e)
+            raise
+
+        pending.future.set_result(response)
+        return response
+
+    async def _acquire(self, chat_id: Optional[Hashable]):
+        if chat_id is not None:
+            await self.chat_limiter.acquire(chat_id)
+        await self.limiter.acquire()
+
+    async def _request(
+        self,
+        make_request: NextRequestMiddlewareType,
+        bot: Bot,
+        method: TelegramMethod
+    ) -> Response:
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                logger.warning(f"⏳ Telegram просит подождать {e.retry_after} с ({method.__api_method__})")
+                # Ждут все отправители, а не только этот запрос
+                self.limiter.pause(e.retry_after)
+                await self.limiter.acquire()
+
+
+def register_request_middlewares(bot: Bot, shards: int = 1):
+    """Регистрация middleware исходящих запросов.
+
+    Процессы-шарды делят общий лимит бота поровну; лимит чата у каждого
+    свой, потому что чат всегда обслуживает один шард.
+    """
+    bot.session.middleware(RateLimitRequestMiddleware(rate=TELEGRAM_GLOBAL_RATE / shards))
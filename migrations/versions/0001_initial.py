@@ -0,0 +1,69 @@
+"""Начальная схема: пользователи, заказы, платежи
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "users",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("telegram_id", sa.Integer(), nullable=False, unique=True),
+        sa.Column("username", sa.String(100), nullable=True),
+        sa.Column("first_name", sa.String(100), nullable=True),
+        sa.Column("last_name", sa.String(100), nullable=True),
+        sa.Column("balance", sa.Float(), nullable=False),
+        sa.Column("is_admin", sa.Boolean(), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("last_active", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("last_ad_watch", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("last_free_payment", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("free_trials_used", sa.Integer(), nullable=False),
+    )
+
+    op.create_table(
+        "orders",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+        sa.Column("product_type", sa.String(50), nullable=False),
+        sa.Column("product_subtype", sa.String(50), nullable=False),
+        sa.Column("prompt", sa.Text(), nullable=True),
+        sa.Column("result", sa.Text(), nullable=True),
+        sa.Column("cost", sa.Float(), nullable=False),
+        sa.Column("status", sa.String(20), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+    )
+    op.create_index("ix_orders_id", "orders", ["id"])
+
+    op.create_table(
+        "payments",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+        sa.Column("amount", sa.Float(), nullable=False),
+        sa.Column("currency", sa.String(10), nullable=False),
+        sa.Column("provider_payment_id", sa.String(100), nullable=True),
+        sa.Column("status", sa.String(20), nullable=False),
+        sa.Column("payment_method", sa.String(50), nullable=True),
+        sa.Column("comment", sa.Text(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("completed_at", sa.DateTime(), nullable=True),
+    )
+    op.create_index("ix_payments_id", "payments", ["id"])
+
+
+def downgrade():
+    op.drop_index("ix_payments_id", table_name="payments")
+    op.drop_table("payments")
+    op.drop_index("ix_orders_id", table_name="orders")
+    op.drop_table("orders")
+    op.drop_table("users")
@@ -0,0 +1,65 @@
+"""Баланс в копейках, журнал движений и резервы
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Базы, созданные через create_all до миграций, уже могут содержать часть схемы
+    inspector = sa.inspect(op.get_bind())
+    tables = set(inspector.get_table_names())
+    user_columns = {column["name"] for column in inspector.get_columns("users")}
+
+    if "balance_kopecks" not in user_columns:
+        with op.batch_alter_table("users") as batch:
+            batch.add_column(sa.Column("balance_kopecks", sa.Integer(), nullable=False, server_default="0"))
+            batch.alter_column("balance", existing_type=sa.Float(), nullable=True)
+        op.execute("UPDATE users SET balance_kopecks = CAST(ROUND(COALESCE(balance, 0) * 100) AS INTEGER)")
+
+    if "balance_transactions" not in tables:
+        op.create_table(
+            "balance_transactions",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+            sa.Column("amount_kopecks", sa.Integer(), nullable=False),
+            sa.Column("balance_after_kopecks", sa.Integer(), nullable=False),
+            sa.Column("reason", sa.String(50), nullable=False),
+            sa.Column("order_id", sa.Integer(), sa.ForeignKey("orders.id"), nullable=True),
+            sa.Column("payment_id", sa.Integer(), sa.ForeignKey("payments.id"), nullable=True),
+            sa.Column("created_at", sa.DateTime(), nullable=False),
+        )
+        op.create_index("ix_balance_transactions_user_id", "balance_transactions", ["user_id"])
+
+    if "balance_holds" not in tables:
+        op.create_table(
+            "balance_holds",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+            sa.Column("amount_kopecks", sa.Integer(), nullable=False),
+            sa.Column("reason", sa.String(50), nullable=False),
+            sa.Column("status", sa.String(20), nullable=False),
+            sa.Column("order_id", sa.Integer(), sa.ForeignKey("orders.id"), nullable=True),
+            sa.Column("created_at", sa.DateTime(), nullable=False),
+            sa.Column("expires_at", sa.DateTime(), nullable=False),
+            sa.Column("settled_at", sa.DateTime(), nullable=True),
+        )
+        op.create_index("ix_balance_holds_user_id", "balance_holds", ["user_id"])
+        op.create_index("ix_balance_holds_status", "balance_holds", ["status"])
+
+
+def downgrade():
+    op.drop_table("balance_holds")
+    op.drop_table("balance_transactions")
+    op.execute("UPDATE users SET balance = balance_kopecks / 100.0")
+    with op.batch_alter_table("users") as batch:
+        batch.drop_column("balance_kopecks")
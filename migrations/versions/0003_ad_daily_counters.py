@@ -0,0 +1,75 @@
+"""Дневные счетчики просмотров рекламы
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if sa.inspect(op.get_bind()).has_table("ad_daily_counters"):
+        return
+
+    op.create_table(
+        "ad_daily_counters",
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), primary_key=True),
+        sa.Column("day", sa.Date(), primary_key=True),
+        sa.Column("views", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("earned_kopecks", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("bonus_claimed", sa.Boolean(), nullable=False, server_default="0"),
+    )
+
+    # Переносим историю просмотров из платежей
+    payments = sa.table(
+        "payments",
+        sa.column("user_id"), sa.column("payment_method"), sa.column("amount"), sa.column("created_at")
+    )
+    counters = sa.table(
+        "ad_daily_counters",
+        sa.column("user_id"), sa.column("day"), sa.column("views"),
+        sa.column("earned_kopecks"), sa.column("bonus_claimed", sa.Boolean())
+    )
+    day = _day(payments.c.created_at)
+
+    op.execute(counters.insert().from_select(
+        ["user_id", "day", "views", "earned_kopecks", "bonus_claimed"],
+        sa.select(
+            payments.c.user_id,
+            day,
+            sa.func.count(),
+            sa.cast(sa.func.round(sa.func.sum(payments.c.amount) * 100), sa.Integer),
+            sa.false()
+        )
+        .where(payments.c.payment_method == "ad_reward")
+        .group_by(payments.c.user_id, day)
+    ))
+    op.execute(
+        counters.update()
+        .where(
+            sa.exists().where(
+                payments.c.user_id == counters.c.user_id,
+                payments.c.payment_method == "daily_bonus",
+                day == counters.c.day
+            )
+        )
+        .values(bonus_claimed=sa.true())
+    )
+
+
+def _day(column):
+    """Дата без времени: date() в SQLite, CAST(... AS DATE) в остальных СУБД"""
+    if op.get_context().dialect.name == "sqlite":
+        return sa.func.date(column)
+    return sa.cast(column, sa.Date)
+
+
+def downgrade():
+    op.drop_table("ad_daily_counters")
@@ -0,0 +1,51 @@
+"""Составные индексы для частых запросов
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17
+
+- orders WHERE user_id ORDER BY created_at DESC (история заказов)
+- payments WHERE status ORDER BY created_at / completed_at (админка платежей)
+- payments WHERE user_id AND status ORDER BY created_at (ожидающие платежи пользователя)
+- users ORDER BY created_at (список пользователей)
+- balance_holds WHERE status AND expires_at < now (возврат просроченных резервов)
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ("ix_orders_user_id_created_at", "orders", ["user_id", "created_at"]),
+    ("ix_payments_status_created_at", "payments", ["status", "created_at"]),
+    ("ix_payments_status_completed_at", "payments", ["status", "completed_at"]),
+    ("ix_payments_user_id_status_created_at", "payments", ["user_id", "status", "created_at"]),
+    ("ix_users_created_at", "users", ["created_at"]),
+    ("ix_balance_holds_status_expires_at", "balance_holds", ["status", "expires_at"]),
+]
+
+
+def _existing_indexes(inspector, table):
+    return {index["name"] for index in inspector.get_indexes(table)}
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+
+    for name, table, columns in INDEXES:
+        if name not in _existing_indexes(inspector, table):
+            op.create_index(name, table, columns)
+
+    # Покрывается составным индексом (status, expires_at)
+    if "ix_balance_holds_status" in _existing_indexes(inspector, "balance_holds"):
+        op.drop_index("ix_balance_holds_status", table_name="balance_holds")
+
+
+def downgrade():
+    op.create_index("ix_balance_holds_status", "balance_holds", ["status"])
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
@@ -0,0 +1,29 @@
+"""Дата завершения для старых завершенных платежей
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17
+
+Список завершенных платежей сортируется и листается по completed_at.
+Платежи, завершенные без этой даты (награды за рекламу, бонусы), получают
+дату создания, иначе они выпадают из keyset-пагинации.
+"""
+from alembic import op
+
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(
+        "UPDATE payments SET completed_at = created_at "
+        "WHERE status = 'completed' AND completed_at IS NULL"
+    )
+
+
+def downgrade():
+    # Данные не откатываются: исходные NULL не отличить от настоящих дат
+    pass
@@ -0,0 +1,74 @@
+"""Дневные итоги для админки
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-17
+
+Дальше таблица обновляется при записи (stats.py), здесь она заполняется
+по уже накопленным пользователям, заказам и завершенным платежам.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "daily_stats",
+        sa.Column("day", sa.Date(), primary_key=True),
+        sa.Column("new_users", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("orders", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("payments_count", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("payments_kopecks", sa.Integer(), nullable=False, server_default="0"),
+    )
+
+    users = sa.table("users", sa.column("created_at"))
+    orders = sa.table("orders", sa.column("created_at"))
+    payments = sa.table("payments", sa.column("status"), sa.column("amount"), sa.column("completed_at"))
+    daily_stats = sa.table(
+        "daily_stats",
+        sa.column("day"), sa.column("new_users"), sa.column("orders"),
+        sa.column("payments_count"), sa.column("payments_kopecks")
+    )
+    # Константы - литералами: у параметров внутри UNION PostgreSQL не выводит тип
+    zero, one = sa.literal_column("0"), sa.literal_column("1")
+
+    events = sa.union_all(
+        sa.select(
+            _day(sa.func.coalesce(users.c.created_at, sa.func.current_timestamp())).label("day"),
+            one.label("new_users"), zero.label("orders"),
+            zero.label("payments_count"), zero.label("payments_kopecks")
+        ),
+        sa.select(_day(orders.c.created_at), zero, one, zero, zero),
+        sa.select(
+            _day(payments.c.completed_at), zero, zero, one,
+            sa.cast(sa.func.round(payments.c.amount * 100), sa.Integer)
+        ).where(payments.c.status == "completed", payments.c.completed_at.isnot(None))
+    ).subquery("events")
+
+    op.execute(daily_stats.insert().from_select(
+        ["day", "new_users", "orders", "payments_count", "payments_kopecks"],
+        sa.select(
+            events.c.day,
+            sa.func.sum(events.c.new_users),
+            sa.func.sum(events.c.orders),
+            sa.func.sum(events.c.payments_count),
+            sa.func.sum(events.c.payments_kopecks)
+        ).group_by(events.c.day)
+    ))
+
+
+def _day(column):
+    """Дата без времени: date() в SQLite, CAST(... AS DATE) в остальных СУБД"""
+    if op.get_context().dialect.name == "sqlite":
+        return sa.func.date(column)
+    return sa.cast(column, sa.Date)
+
+
+def downgrade():
+    op.drop_table("daily_stats")
@@ -0,0 +1,37 @@
+"""Фоновые рассылки с сохранением прогресса
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "broadcasts",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("text", sa.Text(), nullable=False),
+        sa.Column("status", sa.String(20), nullable=False),
+        sa.Column("admin_chat_id", sa.Integer(), nullable=False),
+        sa.Column("status_message_id", sa.Integer(), nullable=True),
+        sa.Column("last_user_id", sa.Integer(), nullable=False),
+        sa.Column("total", sa.Integer(), nullable=False),
+        sa.Column("sent", sa.Integer(), nullable=False),
+        sa.Column("failed", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("finished_at", sa.DateTime(), nullable=True),
+    )
+    op.create_index("ix_broadcasts_status", "broadcasts", ["status"])
+
+
+def downgrade():
+    op.drop_index("ix_broadcasts_status", table_name="broadcasts")
+    op.drop_table("broadcasts")
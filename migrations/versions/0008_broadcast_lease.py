@@ -0,0 +1,26 @@
+"""Аренда рассылок: один процесс ведет рассылку, пока продлевает ее
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("broadcasts") as batch:
+        batch.add_column(sa.Column("owner", sa.String(100), nullable=True))
+        batch.add_column(sa.Column("lease_until", sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table("broadcasts") as batch:
+        batch.drop_column("lease_until")
+        batch.drop_column("owner")
@@ -0,0 +1,319 @@
+# services/broadcast.py
+import asyncio
+import logging
+import os
+import socket
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+
+import pytz
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from sqlalchemy import func, or_, select, update
+
+from config import BROADCAST_RATE, BROADCAST_CONCURRENCY, BROADCAST_CHUNK_SIZE, BROADCAST_LEASE_SECONDS
+from database import AsyncSessionLocal, Broadcast, User
+from services.rate_limiter import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Попыток отправить одно сообщение (повторяем только после RetryAfter)
+MAX_ATTEMPTS = 3
+# Как часто обновлять сообщение с прогрессом у администратора
+REPORT_INTERVAL = 5.0
+
+BROADCAST_HEADER = "📢 <b>Сообщение от администратора:</b>\n\n"
+
+
+class BroadcastService:
+    """Фоновые рассылки.
+
+    Получатели читаются порциями по users.id (keyset, без загрузки всей
+    таблицы), отправка идет параллельно, но не быстрее BROADCAST_RATE,
+    чтобы остальным обработчикам осталась часть общего лимита бота (его
+    и лимит на чат соблюдает RateLimitRequestMiddleware в сессии бота).
+    Если RetryAfter все же дошел сюда, рассылка приостанавливается целиком.
+    После каждой порции курсор и счетчики пишутся в broadcasts, поэтому
+    после перезапуска рассылка продолжается с места остановки (повторно
+    может уйти не больше одной порции).
+
+    Рассылку ведет процесс, который держит ее аренду (owner, lease_until)
+    и продлевает ее, пока работает. Каждый процесс (и каждый шард)
+    периодически подхватывает рассылки с истекшей арендой - так продолжаются
+    рассылки упавшего процесса, и ни одна не идет в двух процессах сразу.
+    """
+
+    def __init__(
+        self,
+        rate: float = BROADCAST_RATE,
+        concurrency: int = BROADCAST_CONCURRENCY,
+        chunk_size: int = BROADCAST_CHUNK_SIZE,
+        lease_seconds: int = BROADCAST_LEASE_SECONDS
+    ):
+        self.limiter = TokenBucket(rate)
+        self.concurrency = concurrency
+        self.chunk_size = chunk_size
+        self.lease_seconds = lease_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._cancel_requested: Set[int] = set()
+        self._lease_lost: Set[int] = set()
+        self._watcher: Optional[asyncio.Task] = None
+
+    # ---------- Управление ----------
+
+    async def start(self, bot: Bot, text: str, admin_chat_id: int, status_message_id: Optional[int] = None) -> Broadcast:
+        """Создает рассылку и запускает ее в фоне"""
+        async with AsyncSessionLocal() as session:
+            total = (await session.execute(select(func.count(User.id)))).scalar() or 0
+            broadcast = Broadcast(
+                text=text,
+                status="running",
+                admin_chat_id=admin_chat_id,
+                status_message_id=status_message_id,
+                last_user_id=0,
+                total=total,
+                sent=0,
+                failed=0,
+                owner=self.owner,
+                lease_until=self._lease_deadline()
+            )
+            session.add(broadcast)
+            await session.commit()
+
+        logger.info(f"📢 Рассылка #{broadcast.id} запущена, получателей: {total}")
+        self._launch(bot, broadcast.id)
+        return broadcast
+
+    async def resume(self, bot: Bot) -> int:
+        """Подхватывает рассылки с истекшей арендой (процесс упал или остановлен)"""
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                select(Broadcast.id).where(Broadcast.status == "running", self._lease_expired())
+            )
+            broadcast_ids = result.scalars().all()
+
+        resumed = 0
+        for broadcast_id in broadcast_ids:
+            if await self._claim(broadcast_id):
+                logger.info(f"📢 Продолжаем рассылку #{broadcast_id}")
+                self._launch(bot, broadcast_id)
+                resumed += 1
+        return resumed
+
+    def watch(self, bot: Bot):
+        """Запускает периодический подхват рассылок"""
+        if self._watcher is None:
+            self._watcher = asyncio.create_task(self._watch(bot))
+
+    def cancel(self, broadcast_id: int) -> bool:
+        task = self._tasks.get(broadcast_id)
+        if task is None or task.done():
+            return False
+        self._cancel_requested.add(broadcast_id)
+        task.cancel()
+        return True
+
+    async def stop(self):
+        """Останавливает рассылки при выключении; они продолжатся после запуска"""
+        if self._watcher:
+            self._watcher.cancel()
+            await asyncio.gather(self._watcher, return_exceptions=True)
+            self._watcher = None
+
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    def _launch(self, bot: Bot, broadcast_id: int):
+        if broadcast_id in self._tasks and not self._tasks[broadcast_id].done():
+            return
+        task = asyncio.create_task(self._run(bot, broadcast_id))
+        self._tasks[broadcast_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(broadcast_id, None))
+
+    async def _watch(self, bot: Bot):
+        while True:
+            try:
+                await self.resume(bot)
+            except Exception as e:
+                logger.error(f"❌ Ошибка подхвата рассылок: {e}")
+            await asyncio.sleep(self.lease_seconds)
+
+    # ---------- Аренда ----------
+
+    def _lease_deadline(self) -> datetime:
+        return datetime.now(pytz.UTC) + timedelta(seconds=self.lease_seconds)
+
+    @staticmethod
+    def _lease_expired():
+        return or_(Broadcast.lease_until.is_(None), Broadcast.lease_until < datetime.now(pytz.UTC))
+
+    async def _claim(self, broadcast_id: int) -> bool:
+        """Забирает аренду, если она истекла; из нескольких процессов выиграет один"""
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                update(Broadcast)
+                .where(Broadcast.id == broadcast_id, Broadcast.status == "running", self._lease_expired())
+                .values(owner=self.owner, lease_until=self._lease_deadline())
+            )
+            await session.commit()
+            return result.rowcount == 1
+
+    async def _keep_lease(self, broadcast_id: int, runner: asyncio.Task):
+        """Продлевает аренду; если ее забрал другой процесс, останавливает рассылку"""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                renewed = await self._save(broadcast_id, lease_until=self._lease_deadline())
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось продлить аренду рассылки #{broadcast_id}: {e}")
+                continue
+            if not renewed:
+                logger.warning(f"⚠️ Рассылку #{broadcast_id} ведет другой процесс, останавливаемся")
+                self._lease_lost.add(broadcast_id)
+                runner.cancel()
+                return
+
+    # ---------- Выполнение ----------
+
+    async def _run(self, bot: Bot, broadcast_id: int):
+        async with AsyncSessionLocal() as session:
+            broadcast = await session.get(Broadcast, broadcast_id)
+        if broadcast is None:
+            return
+
+        text = BROADCAST_HEADER + broadcast.text
+        cursor, sent, failed = broadcast.last_user_id, broadcast.sent, broadcast.failed
+        last_report = 0.0
+        heartbeat = asyncio.create_task(self._keep_lease(broadcast_id, asyncio.current_task()))
+
+        try:
+            while True:
+                recipients = await self._next_chunk(cursor)
+                if not recipients:
+                    break
+
+                chunk_sent = await self._send_chunk(bot, text, [telegram_id for _, telegram_id in recipients])
+                cursor = recipients[-1][0]
+                sent += chunk_sent
+                failed += len(recipients) - chunk_sent
+                await self._save(broadcast_id, last_user_id=cursor, sent=sent, failed=failed)
+
+                if time.monotonic() - last_report >= REPORT_INTERVAL:
+                    last_report = time.monotonic()
+                    await self._report(bot, broadcast, sent, failed, finished=False)
+
+            await self._save(broadcast_id, status="completed", finished_at=datetime.now(pytz.UTC))
+            await self._report(bot, broadcast, sent, failed, finished=True)
+            logger.info(f"✅ Рассылка #{broadcast_id} завершена: отправлено {sent}, ошибок {failed}")
+
+        except asyncio.CancelledError:
+            if broadcast_id in self._lease_lost:
+                self._lease_lost.discard(broadcast_id)
+            elif broadcast_id in self._cancel_requested:
+                self._cancel_requested.discard(broadcast_id)
+                await self._save(broadcast_id, status="cancelled", finished_at=datetime.now(pytz.UTC))
+                logger.info(f"🛑 Рассылка #{broadcast_id} отменена")
+            else:
+                # Выключение: отпускаем аренду, чтобы рассылку сразу подхватили
+                await self._save(broadcast_id, lease_until=None)
+            raise
+        except Exception as e:
+            logger.error(f"❌ Рассылка #{broadcast_id} прервана: {e}", exc_info=True)
+            await self._save(broadcast_id, status="failed", finished_at=datetime.now(pytz.UTC))
+        finally:
+            heartbeat.cancel()
+
+    async def _next_chunk(self, cursor: int) -> List[Tuple[int, int]]:
+        """Следующая порция (users.id, telegram_id) после курсора"""
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                select(User.id, User.telegram_id)
+                .where(User.id > cursor)
+                .order_by(User.id)
+                .limit(self.chunk_size)
+            )
+            return [tuple(row) for row in result.all()]
+
+    async def _send_chunk(self, bot: Bot, text: str, chat_ids: List[int]) -> int:
+        """Отправляет порцию с ограниченной параллельностью, возвращает число успешных"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def send(chat_id: int) -> bool:
+            async with semaphore:
+                return await self._send_one(bot, chat_id, text)
+
+        results = await asyncio.gather(*(send(chat_id) for chat_id in chat_ids))
+        return sum(results)
+
+    async def _send_one(self, bot: Bot, chat_id: int, text: str) -> bool:
+        for attempt in range(MAX_ATTEMPTS):
+            await self.limiter.acquire()
+            try:
+                await bot.send_message(chat_id=chat_id, text=text, parse_mode="HTML")
+                return True
+            except TelegramRetryAfter as e:
+                # Лимит превышен: останавливаем всех отправителей, а не только этот
+                logger.warning(f"⏳ Telegram просит подождать {e.retry_after} с")
+                self.limiter.pause(e.retry_after)
+            except (TelegramForbiddenError, TelegramBadRequest) as e:
+                # Бот заблокирован или чат не найден - повторять бессмысленно
+                logger.debug(f"Не доставлено {chat_id}: {e}")
+                return False
+            except Exception as e:
+                logger.error(f"Не удалось отправить сообщение пользователю {chat_id}: {e}")
+                return False
+        return False
+
+    # ---------- Прогресс ----------
+
+    async def _save(self, broadcast_id: int, **values) -> bool:
+        """Пишет состояние, только пока аренда у этого процесса"""
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                update(Broadcast)
+                .where(Broadcast.id == broadcast_id, Broadcast.owner == self.owner, Broadcast.status == "running")
+                .values(**values)
+            )
+            await session.commit()
+            return result.rowcount == 1
+
+    async def _report(self, bot: Bot, broadcast: Broadcast, sent: int, failed: int, finished: bool):
+        if broadcast.status_message_id is None:
+            return
+
+        if finished:
+            efficiency = sent / broadcast.total * 100 if broadcast.total else 0
+            text = (
+                f"✅ <b>Рассылка завершена!</b>\n\n"
+                f"📤 Успешно отправлено: {sent}\n"
+                f"❌ Не удалось отправить: {failed}\n"
+                f"👥 Всего пользователей: {broadcast.total}\n\n"
+                f"📊 Эффективность: {efficiency:.1f}%"
+            )
+        else:
+            text = (
+                f"📤 <b>Рассылка в процессе...</b>\n"
+                f"✅ Отправлено: {sent}\n"
+                f"❌ Не отправлено: {failed}\n"
+                f"👥 Всего пользователей: {broadcast.total}"
+            )
+
+        try:
+            await bot.edit_message_text(
+                text=text,
+                chat_id=broadcast.admin_chat_id,
+                message_id=broadcast.status_message_id,
+                parse_mode="HTML"
+            )
+        except Exception as e:
+            logger.debug(f"Не удалось обновить прогресс рассылки #{broadcast.id}: {e}")
+
+
+# Глобальный экземпляр
+broadcast_service = BroadcastService()
@@ -0,0 +1,221 @@
+# services/circuit_breaker.py
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterable, List, Optional
+
+from config import (
+    BREAKER_FAILURE_RATE, BREAKER_MIN_CALLS, BREAKER_WINDOW,
+    BREAKER_OPEN_SECONDS, BREAKER_MAX_OPEN_SECONDS, BREAKER_SLOW_CALL_SECONDS
+)
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Коэффициент сглаживания EWMA задержки
+LATENCY_ALPHA = 0.3
+
+
+class CircuitOpenError(Exception):
+    """Бэкенд временно отключен предохранителем"""
+
+    def __init__(self, name: str):
+        super().__init__(f"Бэкенд {name} временно отключен")
+        self.name = name
+
+
+class CircuitBreaker:
+    """Предохранитель для одного бэкенда: closed → open → half-open.
+
+    В закрытом состоянии считает успехи в скользящем окне; при доле
+    ошибок выше порога размыкается и какое-то время не пропускает
+    запросы. Потом пропускает один пробный запрос (half-open): успех
+    замыкает цепь, провал снова размыкает ее на вдвое больший срок.
+    Слишком медленный ответ считается ошибкой.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_rate: float = BREAKER_FAILURE_RATE,
+        min_calls: int = BREAKER_MIN_CALLS,
+        window: int = BREAKER_WINDOW,
+        open_seconds: float = BREAKER_OPEN_SECONDS,
+        max_open_seconds: float = BREAKER_MAX_OPEN_SECONDS,
+        slow_call_seconds: float = BREAKER_SLOW_CALL_SECONDS
+    ):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.slow_call_seconds = slow_call_seconds
+
+        self._outcomes: Deque[bool] = deque(maxlen=window)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._current_open_seconds = open_seconds
+        self._probe_in_flight = False
+        self.latency_ewma: Optional[float] = None
+
+    # ---------- Состояние ----------
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self._current_open_seconds:
+            self._state = HALF_OPEN
+            self._probe_in_flight = False
+            logger.info(f"🟡 {self.name}: пробуем снова (half-open)")
+        return self._state
+
+    @property
+    def success_rate(self) -> float:
+        if not self._outcomes:
+            return 1.0
+        return sum(self._outcomes) / len(self._outcomes)
+
+    def health_score(self) -> float:
+        """Оценка здоровья от 0 до 1: доля успехов с поправкой на задержку"""
+        state = self.state
+        if state == OPEN:
+            return 0.0
+
+        score = self.success_rate
+        if self.latency_ewma is not None:
+            # Ответ за половину порога медленного вызова снижает оценку вдвое
+            score /= 1 + self.latency_ewma / (self.slow_call_seconds / 2)
+        if state == HALF_OPEN:
+            score *= 0.5
+        return score
+
+    def allow_request(self) -> bool:
+        state = self.state
+        if state == CLOSED:
+            return True
+        if state == HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    # ---------- Учет результатов ----------
+
+    def record_success(self, latency: float):
+        if latency > self.slow_call_seconds:
+            logger.warning(f"🐢 {self.name}: медленный ответ {latency:.1f} с")
+            self.record_failure(latency)
+            return
+
+        self._update_latency(latency)
+        self._outcomes.append(True)
+        if self._state == HALF_OPEN:
+            self._close()
+
+    def record_failure(self, latency: Optional[float] = None):
+        if latency is not None:
+            self._update_latency(latency)
+        self._outcomes.append(False)
+
+        if self._state == HALF_OPEN:
+            # Пробный запрос провалился - размыкаем на вдвое больший срок
+            self._open(min(self._current_open_seconds * 2, self.max_open_seconds))
+        elif self._state == CLOSED and len(self._outcomes) >= self.min_calls:
+            if 1 - self.success_rate >= self.failure_rate:
+                self._open(self.open_seconds)
+
+    def release_probe(self):
+        """Пробный запрос отменен, не дав результата"""
+        self._probe_in_flight = False
+
+    async def call(
+        self,
+        func: Callable[..., Awaitable[Any]],
+        *args,
+        is_success: Callable[[Any], bool] = lambda result: result is not None
+    ) -> Any:
+        """Вызывает бэкенд через предохранитель и учитывает результат"""
+        if not self.allow_request():
+            raise CircuitOpenError(self.name)
+
+        started = time.monotonic()
+        try:
+            result = await func(*args)
+        except asyncio.CancelledError:
+            self.release_probe()
+            raise
+        except Exception:
+            self.record_failure(time.monotonic() - started)
+            raise
+
+        latency = time.monotonic() - started
+        if is_success(result):
+            self.record_success(latency)
+        else:
+            self.record_failure(latency)
+        return result
+
+    # ---------- Внутренняя логика ----------
+
+    def _update_latency(self, latency: float):
+        if self.latency_ewma is None:
+            self.latency_ewma = latency
+        else:
+            self.latency_ewma = LATENCY_ALPHA * latency + (1 - LATENCY_ALPHA) * self.latency_ewma
+
+    def _open(self, seconds: float):
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self._current_open_seconds = seconds
+        self._probe_in_flight = False
+        logger.warning(
+            f"🔴 {self.name}: отключен на {seconds:.0f} с "
+            f"(успешных {self.success_rate:.0%} из {len(self._outcomes)})"
+        )
+
+    def _close(self):
+        self._state = CLOSED
+        self._current_open_seconds = self.open_seconds
+        self._probe_in_flight = False
+        self._outcomes.clear()
+        self._outcomes.append(True)
+        logger.info(f"🟢 {self.name}: снова доступен")
+
+
+class BreakerRegistry:
+    """Предохранители всех бэкендов и выбор порядка по здоровью"""
+
+    def __init__(self):
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def get(self, name: str) -> CircuitBreaker:
+        breaker = self._breakers.get(name)
+        if breaker is None:
+            breaker = self._breakers[name] = CircuitBreaker(name)
+        return breaker
+
+    def rank(self, names: Iterable[str]) -> List[str]:
+        """Бэкенды по убыванию здоровья; отключенные пропускаются.
+
+        При равной оценке сохраняется исходный порядок.
+        """
+        available = [name for name in names if self.get(name).state != OPEN]
+        return sorted(available, key=lambda name: self.get(name).health_score(), reverse=True)
+
+    def snapshot(self) -> Dict[str, dict]:
+        """Текущее состояние для логов и админки"""
+        return {
+            name: {
+                "state": breaker.state,
+                "health": round(breaker.health_score(), 2),
+                "success_rate": round(breaker.success_rate, 2),
+                "latency": round(breaker.latency_ewma, 1) if breaker.latency_ewma is not None else None,
+            }
+            for name, breaker in self._breakers.items()
+        }
+
+
+# Глобальный экземпляр
+circuit_breakers = BreakerRegistry()
@@ -0,0 +1,129 @@
+# services/dictionary_translator.py
+import json
+import logging
+import os
+import random
+import re
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DICTIONARY_PATH = os.path.join(os.path.dirname(__file__), "data", "ru_en_dictionary.json")
+
+# Сколько слов оставляем в промпте после перевода
+MAX_WORDS = 8
+
+QUALITY_TAGS = ("high quality", "detailed", "4k", "realistic", "professional photography")
+
+_TOKEN_RE = re.compile(r"[а-яa-z0-9]+(?:-[а-яa-z0-9]+)*")
+
+# Окончания для простого стемминга, от длинных к коротким
+_ENDINGS = tuple(sorted((
+    "иями", "ями", "ами", "ого", "его", "ому", "ему", "ыми", "ими", "ешь", "ишь",
+    "ой", "ей", "ий", "ый", "ая", "яя", "ое", "ее", "ые", "ие", "ую", "юю",
+    "ом", "ем", "ам", "ям", "ах", "ях", "ов", "ев", "ью", "ет", "ит", "ут", "ют", "ат", "ят", "ть",
+    "а", "я", "о", "е", "ы", "и", "у", "ю", "ь", "й",
+), key=len, reverse=True))
+_MIN_STEM = 3
+
+_TERMINAL = ""  # Ключ перевода в узле префиксного дерева
+
+
+def normalize_word(word: str) -> str:
+    return word.lower().replace("ё", "е")
+
+
+def stem(word: str) -> str:
+    """Отрезает окончание, оставляя основу не короче трех букв"""
+    for ending in _ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= _MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(normalize_word(text))
+
+
+class DictionaryTranslator:
+    """Запасной словарный переводчик RU → EN.
+
+    Словарь загружается один раз и замораживается. Слова ищутся сначала
+    в точной форме, затем по основе, поэтому "кошки" и "кошку" находят
+    "кошка". Фразы из нескольких слов ищутся префиксным деревом по основам,
+    побеждает самое длинное совпадение.
+    """
+
+    def __init__(self, entries: Dict[str, str]):
+        exact: Dict[str, str] = {}
+        trie: Dict[str, dict] = {}
+
+        for phrase, translation in entries.items():
+            words = tokenize(phrase)
+            if not words:
+                continue
+            if len(words) == 1:
+                exact[words[0]] = translation
+
+            node = trie
+            for word in words:
+                node = node.setdefault(stem(word), {})
+            # При совпадении основ остается первая запись
+            node.setdefault(_TERMINAL, translation)
+
+        self.exact: Mapping[str, str] = MappingProxyType(exact)
+        self._trie = trie
+
+    @classmethod
+    def from_file(cls, path: str) -> "DictionaryTranslator":
+        """Загружает словарь, сгруппированный по темам"""
+        with open(path, encoding="utf-8") as f:
+            groups = json.load(f)
+
+        entries: Dict[str, str] = {}
+        for group in groups.values():
+            entries.update(group)
+        return cls(entries)
+
+    def __len__(self) -> int:
+        return len(self.exact)
+
+    def lookup(self, words: List[str], stems: List[str], start: int) -> Tuple[Optional[str], int]:
+        """Самое длинное совпадение, начиная с позиции start: (перевод, сколько слов занято)"""
+        node = self._trie
+        match: Tuple[Optional[str], int] = (None, 1)
+
+        for index in range(start, len(stems)):
+            node = node.get(stems[index])
+            if node is None:
+                break
+            if _TERMINAL in node:
+                match = (node[_TERMINAL], index - start + 1)
+
+        # Для одного слова точная форма важнее совпадения по основе
+        if match[1] == 1 and words[start] in self.exact:
+            return self.exact[words[start]], 1
+        return match
+
+    def translate_words(self, text: str) -> List[str]:
+        words = tokenize(text)
+        stems = [stem(word) for word in words]
+
+        translated: List[str] = []
+        index = 0
+        while index < len(words) and len(translated) < MAX_WORDS:
+            translation, consumed = self.lookup(words, stems, index)
+            # Если слова нет в словаре, оставляем как есть
+            translated.append(translation or words[index])
+            index += consumed
+        return translated
+
+    def translate(self, text: str) -> str:
+        result = ", ".join(self.translate_words(text))
+        # Добавляем улучшающий тег
+        return f"{result}, {random.choice(QUALITY_TAGS)}"
+
+
+# Глобальный экземпляр
+dictionary_translator = DictionaryTranslator.from_file(DICTIONARY_PATH)
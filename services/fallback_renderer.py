@@ -0,0 +1,137 @@
+# services/fallback_renderer.py
+import asyncio
+import io
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from config import FALLBACK_RENDER_WORKERS
+
+logger = logging.getLogger(__name__)
+
+SIZE = (512, 512)
+
+# Шрифты по порядку: arial есть на Windows, DejaVu - почти во всех
+# Linux-образах и, в отличие от встроенного, умеет кириллицу
+FONT_CANDIDATES = ("arial.ttf", "DejaVuSans.ttf", "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf")
+
+# Цвета фонов
+BACKGROUNDS = {
+    "solid": (40, 40, 80),
+}
+
+# Раскладки: фон и для каждой строки - позиция, цвет, якорь текста
+LAYOUTS: Dict[str, Tuple[str, List[Tuple[Tuple[int, int], object, Optional[str]]]]] = {
+    # Демо-изображение, когда ни один бэкенд не ответил
+    "demo": ("solid", [
+        ((50, 200), "white", None),
+        ((50, 230), "lightblue", None),
+        ((50, 260), "yellow", None),
+        ((50, 290), "lightgreen", None),
+    ]),
+}
+
+
+# ========== ВНУТРИ ПРОЦЕССА-ОТРИСОВЩИКА ==========
+#
+# Фон и шрифты создаются один раз на процесс; каждая отрисовка - это
+# Image.copy() готового фона, несколько draw.text и сжатие JPEG.
+
+@lru_cache(maxsize=None)
+def _font(size: int = 20):
+    from PIL import ImageFont
+
+    for name in FONT_CANDIDATES:
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            continue
+    return ImageFont.load_default()
+
+
+@lru_cache(maxsize=None)
+def _background(kind: str):
+    from PIL import Image
+
+    return Image.new("RGB", SIZE, color=BACKGROUNDS[kind])
+
+
+def _warm_up():
+    """Инициализатор процесса: готовит фоны и шрифт до первого запроса"""
+    try:
+        for kind, _ in LAYOUTS.values():
+            _background(kind)
+        _font()
+    except ImportError:
+        pass
+
+
+def render(layout: str, texts: Sequence[str]) -> bytes:
+    """Рисует строки по раскладке и возвращает JPEG"""
+    from PIL import ImageDraw
+
+    kind, lines = LAYOUTS[layout]
+    image = _background(kind).copy()
+    draw = ImageDraw.Draw(image)
+    font = _font()
+    for (position, fill, anchor), text in zip(lines, texts):
+        draw.text(position, text, fill=fill, font=font, anchor=anchor)
+
+    buffer = io.BytesIO()
+    # JPEG кодируется в несколько раз быстрее PNG, а для фото в Telegram
+    # формат все равно не важен
+    image.save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+# ========== В ЦИКЛЕ СОБЫТИЙ ==========
+
+class FallbackRenderer:
+    """Отрисовка запасных изображений в пуле процессов.
+
+    Pillow отпускает GIL только внутри крупных операций над пикселями
+    (декодирование, масштабирование, сжатие). Картинка здесь маленькая, и
+    основное время уходит на отрисовку текста и Python-код между вызовами,
+    которые GIL держат, - в потоке это тормозило бы остальных пользователей.
+    Пул создается при первой заглушке: пока бэкенды работают, лишних
+    процессов нет.
+    """
+
+    def __init__(self, workers: int = FALLBACK_RENDER_WORKERS):
+        self.workers = workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # forkserver: процессы не наследуют потоки и соединения бота
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=context,
+                initializer=_warm_up
+            )
+            logger.info(f"🎨 Пул отрисовки заглушек: {self.workers} процессов")
+        return self._executor
+
+    async def render(self, layout: str, *texts: str) -> bytes:
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._get_executor(), render, layout, texts)
+        except BrokenProcessPool:
+            # Процесс пула погиб - пул больше не принимает задачи, создаем новый
+            logger.warning("⚠️ Пул отрисовки сломан, пересоздаем")
+            self.close()
+            return await loop.run_in_executor(self._get_executor(), render, layout, texts)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+# Глобальный экземпляр
+fallback_renderer = FallbackRenderer()
@@ -0,0 +1,147 @@
+# services/hedging.py
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Deque, List, Optional, Sequence, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Сколько замеров нужно, прежде чем доверять перцентилю
+MIN_SAMPLES = 5
+
+
+class LatencyTracker:
+    """Скользящее окно задержек попыток"""
+
+    def __init__(self, window: int = 100):
+        self._samples: Deque[float] = deque(maxlen=window)
+
+    def record(self, latency: float):
+        self._samples.append(latency)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(q * len(ordered)))
+        return ordered[index]
+
+
+class Hedger:
+    """Хеджирование запросов: запасная попытка стартует, если основная
+    не уложилась в p95 задержки.
+
+    Каждая попытка возвращает результат или None (невалидный ответ).
+    Побеждает первый валидный результат, остальные попытки отменяются.
+    Упавшая попытка сразу запускает следующую, не дожидаясь задержки.
+    В окно задержек попадает каждая попытка: завершившаяся - со своим
+    временем, отмененная - со временем до отмены (оценка снизу). Иначе
+    перцентиль считался бы только по победителям и занижал задержку.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        initial_delay: float,
+        min_delay: float,
+        max_delay: float,
+        percentile: float = 0.95,
+        window: int = 100
+    ):
+        self.name = name
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.percentile = percentile
+        self.latency = LatencyTracker(window)
+
+    def hedge_delay(self) -> float:
+        """Задержка перед запуском следующей попытки"""
+        if len(self.latency) < MIN_SAMPLES:
+            return self.initial_delay
+        observed = self.latency.percentile(self.percentile)
+        return max(self.min_delay, min(self.max_delay, observed))
+
+    async def race(
+        self,
+        attempts: Sequence[Callable[[], Awaitable[Optional[T]]]],
+        deadline: Optional[float] = None
+    ) -> Optional[T]:
+        """Запускает попытки со сдвигом и возвращает первый валидный результат.
+
+        deadline - общее ограничение по времени в секундах; по его истечении
+        все попытки отменяются и возвращается None.
+        """
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        delay = self.hedge_delay()
+
+        pending: List[asyncio.Task] = []
+        launched_at = {}
+        next_attempt = 0
+
+        def launch():
+            nonlocal next_attempt
+            task = asyncio.ensure_future(attempts[next_attempt]())
+            launched_at[task] = (next_attempt, loop.time())
+            pending.append(task)
+            next_attempt += 1
+
+        try:
+            launch()
+            while pending:
+                if next_attempt < len(attempts):
+                    wait_for = delay
+                else:
+                    wait_for = None
+                if deadline is not None:
+                    remaining = deadline - (loop.time() - started)
+                    if remaining <= 0:
+                        logger.warning(f"⏱️ {self.name}: общий дедлайн {deadline} с исчерпан")
+                        return None
+                    wait_for = remaining if wait_for is None else min(wait_for, remaining)
+
+                done, _ = await asyncio.wait(pending, timeout=wait_for, return_when=asyncio.FIRST_COMPLETED)
+
+                failed = False
+                winner = None
+                for task in done:
+                    pending.remove(task)
+                    index, task_started = launched_at[task]
+                    latency = loop.time() - task_started
+                    self.latency.record(latency)
+                    try:
+                        result = task.result()
+                    except Exception as e:
+                        logger.warning(f"⚠️ {self.name}: попытка #{index + 1} упала: {e}")
+                        result = None
+
+                    if result is None:
+                        failed = True
+                    elif winner is None:
+                        winner = result
+                        logger.info(
+                            f"🏁 {self.name}: победила попытка #{index + 1} за {latency:.1f} с "
+                            f"(запущено {next_attempt} из {len(attempts)})"
+                        )
+                if winner is not None:
+                    return winner
+
+                # Таймаут хеджирования или провал - запускаем следующую попытку
+                if next_attempt < len(attempts) and (failed or not done):
+                    if not done:
+                        logger.info(f"🔀 {self.name}: нет ответа за {delay:.1f} с, запускаем попытку #{next_attempt + 1}")
+                    launch()
+
+            return None
+        finally:
+            now = loop.time()
+            for task in pending:
+                task.cancel()
+                self.latency.record(now - launched_at[task][1])
+            await asyncio.gather(*pending, return_exceptions=True)
@@ -0,0 +1,184 @@
+# services/image_cache.py
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from config import IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_BYTES
+
+logger = logging.getLogger(__name__)
+
+
+class ImageCache:
+    """Кэш готовых изображений по содержимому запроса.
+
+    Байты лежат на диске (LRU с ограничением по размеру), а после первой
+    отправки запоминается Telegram file_id - повторная отправка идет без
+    загрузки файла.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+        self._entries: "OrderedDict[str, int]" = OrderedDict()  # ключ -> размер, от старых к новым
+        self._file_ids: Dict[str, str] = {}
+        self._total_bytes = 0
+        self._loaded = False
+        self._lock = asyncio.Lock()
+
+    @staticmethod
+    def make_key(prompt: str, **params) -> str:
+        """Ключ по переведенному промпту и параметрам генерации"""
+        payload = json.dumps(
+            {"prompt": " ".join(prompt.lower().split()), **params},
+            sort_keys=True,
+            ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    # ---------- Публичный API ----------
+
+    async def get_file_id(self, key: str) -> Optional[str]:
+        await self._ensure_loaded()
+        file_id = self._file_ids.get(key)
+        if file_id:
+            self._touch(key)
+        return file_id
+
+    async def get_bytes(self, key: str) -> Optional[bytes]:
+        await self._ensure_loaded()
+        if key not in self._entries:
+            return None
+
+        try:
+            data = await asyncio.to_thread(self._read, self._image_path(key))
+        except OSError as e:
+            logger.warning(f"⚠️ Не удалось прочитать кэш изображения: {e}")
+            await self._evict(key)
+            return None
+
+        self._touch(key)
+        return data
+
+    async def put(self, key: str, data: bytes):
+        """Сохраняет изображение и вытесняет старые записи сверх лимита"""
+        await self._ensure_loaded()
+        if len(data) > self.max_bytes:
+            return
+
+        async with self._lock:
+            try:
+                await asyncio.to_thread(self._write, self._image_path(key), data)
+            except OSError as e:
+                logger.warning(f"⚠️ Не удалось сохранить изображение в кэш: {e}")
+                return
+
+            self._total_bytes -= self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            self._total_bytes += len(data)
+
+            while self._total_bytes > self.max_bytes and self._entries:
+                oldest = next(iter(self._entries))
+                await self._evict(oldest)
+
+    async def set_file_id(self, key: str, file_id: str):
+        """Запоминает file_id после первой отправки в Telegram"""
+        await self._ensure_loaded()
+        if key not in self._entries:
+            return
+
+        self._file_ids[key] = file_id
+        try:
+            await asyncio.to_thread(self._write, self._file_id_path(key), file_id.encode("utf-8"))
+        except OSError as e:
+            logger.warning(f"⚠️ Не удалось сохранить file_id: {e}")
+
+    async def forget_file_id(self, key: str):
+        """Сбрасывает file_id, который Telegram перестал принимать"""
+        self._file_ids.pop(key, None)
+        await asyncio.to_thread(self._remove, self._file_id_path(key))
+
+    # ---------- Внутренняя логика ----------
+
+    def _image_path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.img")
+
+    def _file_id_path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.fid")
+
+    def _touch(self, key: str):
+        if key in self._entries:
+            self._entries.move_to_end(key)
+
+    async def _evict(self, key: str):
+        self._total_bytes -= self._entries.pop(key, 0)
+        self._file_ids.pop(key, None)
+        await asyncio.to_thread(self._remove, self._image_path(key))
+        await asyncio.to_thread(self._remove, self._file_id_path(key))
+
+    async def _ensure_loaded(self):
+        if self._loaded:
+            return
+        async with self._lock:
+            if self._loaded:
+                return
+            entries, file_ids = await asyncio.to_thread(self._scan)
+            for key, size in entries:
+                self._entries[key] = size
+                self._total_bytes += size
+            self._file_ids.update(file_ids)
+            self._loaded = True
+            logger.info(f"🗂️ Кэш изображений: {len(self._entries)} файлов, {self._total_bytes // 1024} КБ")
+
+    def _scan(self):
+        """Восстанавливает индекс с диска, порядок LRU - по времени изменения"""
+        os.makedirs(self.directory, exist_ok=True)
+
+        images = []
+        file_ids = {}
+        for entry in os.scandir(self.directory):
+            key, ext = os.path.splitext(entry.name)
+            if ext == ".img":
+                stat = entry.stat()
+                images.append((stat.st_mtime, key, stat.st_size))
+            elif ext == ".fid":
+                try:
+                    file_ids[key] = self._read(entry.path).decode("utf-8").strip()
+                except OSError:
+                    continue
+
+        images.sort()
+        keys = {key for _, key, _ in images}
+        return (
+            [(key, size) for _, key, size in images],
+            {key: file_id for key, file_id in file_ids.items() if key in keys and file_id}
+        )
+
+    @staticmethod
+    def _read(path: str) -> bytes:
+        with open(path, "rb") as f:
+            data = f.read()
+        os.utime(path)  # Обновляем mtime, чтобы LRU пережил перезапуск
+        return data
+
+    @staticmethod
+    def _write(path: str, data: bytes):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+# Глобальный экземпляр
+image_cache = ImageCache(IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_BYTES)
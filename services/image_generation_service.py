@@ -4,6 +4,7 @@ import base64
 import logging
 from typing import Optional, Tuple
 import random
+from services.circuit_breaker import circuit_breakers
 
 logger = logging.getLogger(__name__)
 
@@ -12,21 +13,29 @@ class ImageGenerationService:
     """Сервис для генерации изображений через разные API"""
     
     def __init__(self):
-        self.services = [
-            self._try_huggingface,
-            self._try_openrouter,
-            self._try_prodia,  # Еще один бесплатный сервис
-        ]
+        # Порядок при равном здоровье бэкендов; ключи - имена предохранителей,
+        # отдельные от AIService: модели и эндпоинты здесь другие
+        self.services = {
+            "imggen.huggingface": self._try_huggingface,
+            "imggen.openrouter": self._try_openrouter,
+            "imggen.prodia": self._try_prodia,  # Еще один бесплатный сервис
+        }
+        # Без общего таймаута зависший сервис держал запрос 5 минут
+        self.timeout = aiohttp.ClientTimeout(total=60, connect=10)
     
     async def generate(self, prompt: str) -> Tuple[str, Optional[bytes]]:
-        """Пробуем разные сервисы по очереди"""
-        for service in self.services:
+        """Пробуем сервисы по убыванию здоровья, отключенные пропускаем"""
+        for name in circuit_breakers.rank(self.services):
             try:
-                result_text, image_bytes = await service(prompt)
+                result_text, image_bytes = await circuit_breakers.get(name).call(
+                    self.services[name],
+                    prompt,
+                    is_success=lambda result: result[1] is not None
+                )
                 if image_bytes:
                     return result_text, image_bytes
             except Exception as e:
-                logger.warning(f"Сервис {service.__name__} недоступен: {e}")
+                logger.warning(f"Сервис {name} недоступен: {e}")
                 continue
         
         return "❌ Все сервисы генерации изображений временно недоступны", None
@@ -41,7 +50,7 @@ class ImageGenerationService:
         
         url = f"https://api-inference.huggingface.co/models/{model}"
         
-        async with aiohttp.ClientSession() as session:
+        async with aiohttp.ClientSession(timeout=self.timeout) as session:
             payload = {"inputs": prompt}
             async with session.post(url, json=payload) as response:
                 if response.status == 200:
@@ -58,7 +67,7 @@ class ImageGenerationService:
             "prompt": prompt,
         }
         
-        async with aiohttp.ClientSession() as session:
+        async with aiohttp.ClientSession(timeout=self.timeout) as session:
             async with session.post(url, json=payload) as response:
                 if response.status == 200:
                     data = await response.json()
@@ -71,7 +80,7 @@ class ImageGenerationService:
     async def _try_prodia(self, prompt: str) -> Tuple[str, Optional[bytes]]:
         """Пробуем Prodia (еще один бесплатный сервис)"""
         # Получаем список моделей
-        async with aiohttp.ClientSession() as session:
+        async with aiohttp.ClientSession(timeout=self.timeout) as session:
             async with session.get("https://api.prodia.com/v1/sd/models") as response:
                 if response.status == 200:
                     models = await response.json()
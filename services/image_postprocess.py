@@ -0,0 +1,145 @@
+# services/image_postprocess.py
+import asyncio
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
+
+from config import IMAGE_TIERS, IMAGE_POSTPROCESS_WORKERS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIER = "image_generation"
+
+# Границы подбора качества JPEG
+MIN_QUALITY = 40
+MAX_QUALITY = 92
+
+# Больше этого Pillow считает файл "бомбой" распаковки
+MAX_PIXELS = 50_000_000
+
+
+class InvalidImage(ValueError):
+    """Бэкенд вернул не изображение или поврежденный файл"""
+
+
+@dataclass
+class ProcessedImage:
+    data: bytes
+    width: int
+    height: int
+    quality: int
+    # Исходный файл, если его нужно прислать документом
+    original: Optional[bytes] = None
+    original_format: str = ""
+
+    @property
+    def original_filename(self) -> str:
+        return f"generated_image_original.{self.original_format.lower() or 'bin'}"
+
+
+def _encode(image, quality: int) -> bytes:
+    buffer = io.BytesIO()
+    # Без exif и icc_profile: метаданные бэкенда пользователю не нужны
+    image.save(buffer, format="JPEG", quality=quality, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+
+def process_image(data: bytes, max_side: int, max_bytes: int, keep_original: bool = False) -> ProcessedImage:
+    """Проверяет, уменьшает и сжимает изображение под Telegram.
+
+    Качество подбирается двоичным поиском: наибольшее, при котором файл
+    укладывается в max_bytes (но не ниже MIN_QUALITY).
+    """
+    from PIL import Image, ImageOps
+
+    try:
+        with Image.open(io.BytesIO(data)) as probe:
+            if probe.width * probe.height > MAX_PIXELS:
+                raise InvalidImage(f"Слишком большое изображение: {probe.width}x{probe.height}")
+            # verify() ищет повреждения без полного декодирования
+            probe.verify()
+        image = Image.open(io.BytesIO(data))
+        image.load()
+    except InvalidImage:
+        raise
+    except Exception as e:
+        raise InvalidImage(f"Не удалось прочитать изображение: {e}") from e
+
+    original_format = image.format or ""
+    image = ImageOps.exif_transpose(image)
+
+    if image.mode != "RGB":
+        # Прозрачность на белый фон: в JPEG альфа-канала нет
+        rgba = image.convert("RGBA")
+        image = Image.new("RGB", rgba.size, (255, 255, 255))
+        image.paste(rgba, mask=rgba.getchannel("A"))
+
+    if max(image.size) > max_side:
+        # thumbnail сохраняет пропорции и никогда не увеличивает
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+    low, high = MIN_QUALITY, MAX_QUALITY
+    best_quality, best = MIN_QUALITY, None
+    while low <= high:
+        quality = (low + high) // 2
+        encoded = _encode(image, quality)
+        if len(encoded) <= max_bytes:
+            best_quality, best = quality, encoded
+            low = quality + 1
+        else:
+            high = quality - 1
+    if best is None:
+        best = _encode(image, MIN_QUALITY)
+
+    return ProcessedImage(
+        data=best,
+        width=image.width,
+        height=image.height,
+        quality=best_quality,
+        original=data if keep_original else None,
+        original_format=original_format
+    )
+
+
+class ImagePostprocessor:
+    """Обработка изображений перед отправкой, вне цикла событий.
+
+    Pillow отпускает GIL внутри крупных операций над пикселями
+    (декодирование, масштабирование, сжатие), а у больших изображений почти
+    все время уходит именно на них. Поэтому хватает пула потоков, и
+    многомегабайтные файлы не нужно пересылать в другой процесс.
+    """
+
+    def __init__(self, workers: int = IMAGE_POSTPROCESS_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="image")
+
+    @staticmethod
+    def tier_settings(tier: Optional[str]) -> dict:
+        return IMAGE_TIERS.get(tier or DEFAULT_TIER, IMAGE_TIERS[DEFAULT_TIER])
+
+    async def process(self, data: bytes, tier: Optional[str] = None) -> ProcessedImage:
+        """Готовит изображение для тарифа tier (ключ PRICE_CONFIG) или InvalidImage"""
+        settings = self.tier_settings(tier)
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(
+            self._executor,
+            process_image,
+            data,
+            settings["max_side"],
+            settings["max_bytes"],
+            settings.get("send_original", False)
+        )
+        logger.info(
+            f"🗜️ Изображение {len(data) // 1024} КБ → {len(result.data) // 1024} КБ "
+            f"({result.width}x{result.height}, качество {result.quality})"
+        )
+        return result
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+# Глобальный экземпляр
+image_postprocessor = ImagePostprocessor()
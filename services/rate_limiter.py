@@ -0,0 +1,89 @@
+# services/rate_limiter.py
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+
+class TokenBucket:
+    """Ведро токенов: в среднем rate операций в секунду, всплеск до capacity.
+
+    acquire() ждет, пока появится токен. pause() останавливает выдачу
+    токенов на заданное время - так соблюдается RetryAfter от Telegram:
+    после 429 все отправители ждут, а не долбят API повторами.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        if rate <= 0:
+            raise ValueError("rate должен быть положительным")
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        if now <= self._updated:
+            # Во время паузы токены не копятся
+            return
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        """Берет токен без ожидания; False, если его нет"""
+        now = time.monotonic()
+        if now < self._paused_until:
+            return False
+        self._refill(now)
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            return True
+        return False
+
+    def delay(self, tokens: float = 1.0) -> float:
+        """Сколько ждать до появления токенов (0 - можно сразу)"""
+        now = time.monotonic()
+        self._refill(now)
+        wait = max(0.0, self._paused_until - now)
+        missing = tokens - self._tokens
+        if missing > 0:
+            wait = max(wait, missing / self.rate)
+        return wait
+
+    async def acquire(self, tokens: float = 1.0):
+        # Очередь под замком сохраняет порядок ожидающих
+        async with self._lock:
+            while not self.try_acquire(tokens):
+                await asyncio.sleep(self.delay(tokens))
+
+    def pause(self, seconds: float):
+        """Не выдавать токены seconds секунд (продлевает текущую паузу)"""
+        now = time.monotonic()
+        self._paused_until = max(self._paused_until, now + seconds)
+        # После паузы начинаем с пустого ведра, без залпа накопленных токенов
+        self._tokens = 0.0
+        self._updated = max(self._updated, self._paused_until)
+
+
+class KeyedRateLimiter:
+    """Отдельное ведро на каждый ключ (например, чат), с вытеснением старых"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None, max_keys: int = 10000):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[Hashable, TokenBucket]" = OrderedDict()
+
+    def bucket(self, key: Hashable) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.capacity)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    async def acquire(self, key: Hashable, tokens: float = 1.0):
+        await self.bucket(key).acquire(tokens)
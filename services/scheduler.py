@@ -0,0 +1,241 @@
+# services/scheduler.py
+import asyncio
+import logging
+from collections import deque
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, TypeVar
+
+from config import GENERATION_MAX_CONCURRENT, GENERATION_BACKEND_LIMITS
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Как часто пересчитывать позицию в очереди для уведомлений (секунды)
+POSITION_POLL_INTERVAL = 2.0
+
+# Задается очередью обновлений (webhook и шарды) на время обработки одного
+# обновления: вызов отпускает слот обработчика. Генерация ждет очереди и
+# выполняется минутами, а число генераций ограничивает сам планировщик -
+# держать ради нее слот значит остановить ответы остальным.
+update_detach: ContextVar[Optional[Callable[[], None]]] = ContextVar("update_detach", default=None)
+
+
+class GenerationCancelled(Exception):
+    """Генерация отменена пользователем"""
+
+
+@dataclass
+class _Job:
+    user_id: int
+    backend: str
+    ready: asyncio.Future
+    task: Optional[asyncio.Future] = None
+    cancelled: bool = False
+
+
+class GenerationScheduler:
+    """Ограничивает число одновременных генераций и ведет честную очередь.
+
+    Действуют глобальный лимит и лимиты по бэкендам. Пользователи
+    обслуживаются по кругу (round-robin): у каждого своя очередь, и за один
+    оборот из нее берется одна задача, поэтому десяток запросов от одного
+    пользователя не задерживает остальных.
+    """
+
+    def __init__(self, max_concurrent: int, backend_limits: Dict[str, int]):
+        self.max_concurrent = max_concurrent
+        self.backend_limits = dict(backend_limits)
+
+        self._queues: Dict[int, Deque[_Job]] = {}
+        self._rotation: Deque[int] = deque()  # Пользователи с ожидающими задачами
+        self._running: Dict[int, List[_Job]] = {}
+        self._active_total = 0
+        self._active_by_backend: Dict[str, int] = {}
+
+    # ---------- Публичный API ----------
+
+    async def run(
+        self,
+        user_id: int,
+        backend: str,
+        factory: Callable[[], Awaitable[T]],
+        on_position: Optional[Callable[[int], Awaitable[Any]]] = None
+    ) -> T:
+        """Ставит генерацию в очередь и выполняет ее, когда освободится слот.
+
+        factory вызывается только при запуске, поэтому отмененная в очереди
+        задача не создает корутину. on_position получает номер в очереди
+        каждый раз, когда он меняется, пока задача ожидает.
+        """
+        detach = update_detach.get()
+        if detach is not None:
+            detach()
+
+        loop = asyncio.get_running_loop()
+        job = _Job(user_id=user_id, backend=backend, ready=loop.create_future())
+
+        self._queues.setdefault(user_id, deque()).append(job)
+        if user_id not in self._rotation:
+            self._rotation.append(user_id)
+        self._dispatch()
+
+        try:
+            await self._wait_turn(job, on_position)
+        except BaseException:
+            if job.ready.done() and not job.ready.cancelled() and job.ready.exception() is None:
+                # Слот уже выдан, но ожидающего отменили - возвращаем его
+                self._release(job)
+                self._dispatch()
+            else:
+                self._remove_pending(job)
+            raise
+
+        try:
+            job.task = asyncio.ensure_future(factory())
+            try:
+                return await job.task
+            except asyncio.CancelledError:
+                if job.cancelled:
+                    raise GenerationCancelled() from None
+                raise
+        finally:
+            self._release(job)
+            self._dispatch()
+
+    def cancel(self, user_id: int) -> int:
+        """Отменяет все ожидающие и выполняющиеся генерации пользователя"""
+        cancelled = 0
+
+        for job in list(self._queues.get(user_id, ())):
+            self._remove_pending(job)
+            if not job.ready.done():
+                job.ready.set_exception(GenerationCancelled())
+            cancelled += 1
+
+        for job in self._running.get(user_id, []):
+            job.cancelled = True
+            if job.task and not job.task.done():
+                job.task.cancel()
+                cancelled += 1
+
+        if cancelled:
+            logger.info(f"🛑 Отменено генераций пользователя {user_id}: {cancelled}")
+        return cancelled
+
+    def position(self, user_id: int) -> Optional[int]:
+        """Номер ближайшей задачи пользователя в очереди (None, если не ждет)"""
+        queue = self._queues.get(user_id)
+        if not queue:
+            return None
+        return self._position_of(queue[0])
+
+    @property
+    def queued(self) -> int:
+        """Сколько задач ожидает в очереди"""
+        return sum(len(queue) for queue in self._queues.values())
+
+    # ---------- Внутренняя логика ----------
+
+    async def _wait_turn(self, job: _Job, on_position):
+        """Ждет запуска задачи, сообщая об изменениях позиции"""
+        last_position = None
+
+        while not job.ready.done():
+            if on_position:
+                position = self._position_of(job)
+                if position != last_position:
+                    last_position = position
+                    try:
+                        await on_position(position)
+                    except Exception as e:
+                        logger.debug(f"Не удалось сообщить позицию в очереди: {e}")
+
+            try:
+                await asyncio.wait_for(asyncio.shield(job.ready), timeout=POSITION_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                continue
+
+        # Пробрасывает GenerationCancelled, если задачу отменили в очереди
+        job.ready.result()
+
+    def _position_of(self, job: _Job) -> int:
+        """Позиция задачи с учетом кругового обхода пользователей.
+
+        Перед k-й задачей пользователя пройдет по k задач каждого пользователя,
+        стоящего в обходе после него, и по k + 1 от стоящих перед ним.
+        """
+        queue = self._queues.get(job.user_id)
+        if not queue or job not in queue:
+            return 0
+
+        index = queue.index(job)
+        ahead = index
+        before_owner = True
+        for user_id in self._rotation:
+            if user_id == job.user_id:
+                before_owner = False
+                continue
+            limit = index + 1 if before_owner else index
+            ahead += min(len(self._queues[user_id]), limit)
+        return ahead + 1
+
+    def _has_capacity(self, backend: str) -> bool:
+        if self._active_total >= self.max_concurrent:
+            return False
+        limit = self.backend_limits.get(backend)
+        return limit is None or self._active_by_backend.get(backend, 0) < limit
+
+    def _dispatch(self):
+        """Запускает ожидающие задачи, пока есть свободные слоты"""
+        while self._rotation and self._active_total < self.max_concurrent:
+            for index, user_id in enumerate(self._rotation):
+                job = self._queues[user_id][0]
+                if self._has_capacity(job.backend):
+                    break
+            else:
+                # Все первые задачи упираются в лимиты своих бэкендов
+                return
+
+            # Обслуженный пользователь уходит в конец обхода
+            del self._rotation[index]
+            queue = self._queues[user_id]
+            queue.popleft()
+            if queue:
+                self._rotation.append(user_id)
+            else:
+                del self._queues[user_id]
+
+            self._active_total += 1
+            self._active_by_backend[job.backend] = self._active_by_backend.get(job.backend, 0) + 1
+            self._running.setdefault(user_id, []).append(job)
+            job.ready.set_result(None)
+
+    def _release(self, job: _Job):
+        self._active_total -= 1
+        self._active_by_backend[job.backend] -= 1
+
+        running = self._running.get(job.user_id, [])
+        if job in running:
+            running.remove(job)
+        if not running:
+            self._running.pop(job.user_id, None)
+
+    def _remove_pending(self, job: _Job):
+        queue = self._queues.get(job.user_id)
+        if not queue or job not in queue:
+            return
+
+        queue.remove(job)
+        if not queue:
+            del self._queues[job.user_id]
+            if job.user_id in self._rotation:
+                self._rotation.remove(job.user_id)
+
+        # Освободившееся место в обходе может открыть путь другим задачам
+        self._dispatch()
+
+
+# Глобальный экземпляр
+generation_scheduler = GenerationScheduler(GENERATION_MAX_CONCURRENT, GENERATION_BACKEND_LIMITS)
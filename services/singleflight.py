@@ -0,0 +1,65 @@
+# services/singleflight.py
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def normalize_prompt(text: str) -> str:
+    """Нормализует промпт для ключа: регистр и лишние пробелы не важны"""
+    return " ".join(text.lower().split())
+
+
+class _Call:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Future):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Объединяет одинаковые одновременные запросы в один вызов бэкенда.
+
+    Первый вызов с данным ключом запускает работу, остальные ждут тот же
+    результат. Если все ожидающие отменены, работа тоже отменяется.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, _Call] = {}
+
+    async def do(self, key: Hashable, factory: Callable[[], Awaitable[T]]) -> T:
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(factory()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda task, key=key: self._forget(key, task))
+        else:
+            logger.info(f"🔁 {self.name}: присоединяемся к уже идущему запросу")
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            if call.waiters == 1 and not call.task.done():
+                # Результат больше никому не нужен
+                call.task.cancel()
+            raise
+        finally:
+            call.waiters -= 1
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    def _forget(self, key: Hashable, task: asyncio.Future):
+        call = self._calls.get(key)
+        if call is not None and call.task is task:
+            del self._calls[key]
+        # Помечаем исключение как полученное, даже если ждать было некому
+        if not task.cancelled():
+            task.exception()
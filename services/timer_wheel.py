@@ -0,0 +1,156 @@
+# services/timer_wheel.py
+import asyncio
+import logging
+import math
+import time
+from typing import Any, Awaitable, Callable, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+class TimerHandle:
+    """Запланированный вызов; cancel() снимает его без поиска по колесу"""
+
+    __slots__ = ("tick", "callback", "args", "cancelled")
+
+    def __init__(self, tick: int, callback: Callable[..., Awaitable[Any]], args: tuple):
+        self.tick = tick
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerWheel:
+    """Иерархическое колесо таймеров.
+
+    Вместо задачи с asyncio.sleep на каждый таймер - одна фоновая задача,
+    которая раз в tick секунд проворачивает колесо. Уровень 0 хранит
+    ближайшие slots тиков, каждый следующий уровень - в slots раз более
+    грубые интервалы; когда младший уровень делает оборот, слот старшего
+    раскладывается вниз. Постановка и отмена - O(1), а все таймеры,
+    сработавшие в одном тике, выполняются одной пачкой с ограниченной
+    параллельностью.
+    """
+
+    def __init__(self, tick: float = 1.0, slots: int = 64, levels: int = 3, concurrency: int = 100):
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self.concurrency = concurrency
+
+        self._wheels: List[List[List[TimerHandle]]] = [[[] for _ in range(slots)] for _ in range(levels)]
+        self._origin = time.monotonic()
+        self._current = 0  # последний обработанный тик
+        self._count = 0
+
+        self._task: Optional[asyncio.Task] = None
+        self._batches: Set[asyncio.Task] = set()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def __len__(self) -> int:
+        return self._count
+
+    # ---------- Планирование ----------
+
+    def schedule(self, delay: float, callback: Callable[..., Awaitable[Any]], *args) -> TimerHandle:
+        """Вызывает корутину callback(*args) через delay секунд (с точностью до тика)"""
+        deadline = time.monotonic() + max(0.0, delay) - self._origin
+        handle = TimerHandle(max(self._current + 1, math.ceil(deadline / self.tick)), callback, args)
+        self._place(handle)
+        self._count += 1
+        self._ensure_running()
+        return handle
+
+    def _place(self, handle: TimerHandle):
+        delta = handle.tick - self._current
+        span = 1
+        for level in range(self.levels):
+            if delta < span * self.slots or level == self.levels - 1:
+                # Дальше последнего уровня таймер ждет в нем и раскладывается повторно
+                slot = min(handle.tick, self._current + span * self.slots - 1) // span % self.slots
+                self._wheels[level][slot].append(handle)
+                return
+            span *= self.slots
+
+    def _advance(self) -> List[TimerHandle]:
+        """Проворачивает колесо на один тик и возвращает сработавшие таймеры"""
+        self._current += 1
+
+        # Сначала старшие уровни: их таймеры могут попасть в слот, который
+        # раскладывается следующим
+        cascade = []
+        span = self.slots
+        for level in range(1, self.levels):
+            if self._current % span:
+                break
+            cascade.append((level, self._current // span % self.slots))
+            span *= self.slots
+        for level, slot in reversed(cascade):
+            handles, self._wheels[level][slot] = self._wheels[level][slot], []
+            for handle in handles:
+                if handle.cancelled:
+                    self._count -= 1
+                else:
+                    self._place(handle)
+
+        slot = self._current % self.slots
+        handles, self._wheels[0][slot] = self._wheels[0][slot], []
+        due = []
+        for handle in handles:
+            if handle.tick > self._current:
+                self._place(handle)
+                continue
+            self._count -= 1
+            if not handle.cancelled:
+                due.append(handle)
+        return due
+
+    # ---------- Фоновая задача ----------
+
+    def _ensure_running(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        while True:
+            next_at = self._origin + (self._current + 1) * self.tick
+            await asyncio.sleep(max(0.0, next_at - time.monotonic()))
+
+            # После задержки цикла событий догоняем пропущенные тики
+            now_tick = int((time.monotonic() - self._origin) / self.tick)
+            due = []
+            while self._current < now_tick:
+                due.extend(self._advance())
+
+            if due:
+                batch = asyncio.create_task(self._fire(due))
+                self._batches.add(batch)
+                batch.add_done_callback(self._batches.discard)
+
+    async def _fire(self, due: List[TimerHandle]):
+        async def call(handle: TimerHandle):
+            async with self._semaphore:
+                try:
+                    await handle.callback(*handle.args)
+                except Exception as e:
+                    logger.error(f"❌ Ошибка в таймере {getattr(handle.callback, '__name__', handle.callback)}: {e}")
+
+        await asyncio.gather(*(call(handle) for handle in due))
+
+    async def stop(self):
+        tasks = list(self._batches)
+        if self._task:
+            tasks.append(self._task)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+        self._batches.clear()
+
+
+# Глобальный экземпляр
+timer_wheel = TimerWheel()
@@ -0,0 +1,129 @@
+# services/translation_cache.py
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+from config import TRANSLATION_CACHE_SIZE, TRANSLATION_CACHE_TTL, TRANSLATION_CACHE_DB
+from services.singleflight import normalize_prompt
+
+logger = logging.getLogger(__name__)
+
+
+class TranslationCache:
+    """LRU-кэш переводов с TTL и необязательным хранением в SQLite.
+
+    Ключ - нормализованный русский текст. Память проверяется первой; при
+    промахе смотрим в SQLite (если задан путь), чтобы частые промпты
+    переживали перезапуск бота.
+    """
+
+    def __init__(self, max_size: int, ttl: int, db_path: str = ""):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.db_path = db_path
+
+        self._memory: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()  # ключ -> (перевод, время)
+        self._db: Optional[sqlite3.Connection] = None
+        # Один поток на все обращения к SQLite - соединение не делим между потоками
+        self._db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="translation-db") if db_path else None
+
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, text: str) -> Optional[str]:
+        key = normalize_prompt(text)
+        now = time.time()
+
+        entry = self._memory.get(key)
+        if entry:
+            value, created_at = entry
+            if now - created_at < self.ttl:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._memory[key]
+
+        if self._db_executor:
+            try:
+                row = await self._run_db(self._db_get, key)
+            except Exception as e:
+                logger.warning(f"⚠️ Ошибка чтения кэша переводов: {e}")
+                row = None
+            if row and now - row[1] < self.ttl:
+                self._remember(key, row[0], row[1])
+                self.hits += 1
+                return row[0]
+
+        self.misses += 1
+        return None
+
+    async def set(self, text: str, translation: str):
+        key = normalize_prompt(text)
+        created_at = time.time()
+        self._remember(key, translation, created_at)
+
+        if self._db_executor:
+            try:
+                await self._run_db(self._db_set, key, translation, created_at)
+            except Exception as e:
+                logger.warning(f"⚠️ Ошибка записи кэша переводов: {e}")
+
+    def close(self):
+        if self._db_executor:
+            self._db_executor.submit(self._db_close)
+            self._db_executor.shutdown(wait=True)
+            self._db_executor = None
+
+    # ---------- Внутренняя логика ----------
+
+    def _remember(self, key: str, value: str, created_at: float):
+        self._memory[key] = (value, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+
+    async def _run_db(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._db_executor, func, *args)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(self.db_path)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS translations ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            # Устаревшие записи чистим при открытии
+            self._db.execute("DELETE FROM translations WHERE created_at < ?", (time.time() - self.ttl,))
+            self._db.commit()
+        return self._db
+
+    def _db_get(self, key: str):
+        return self._connect().execute(
+            "SELECT value, created_at FROM translations WHERE key = ?", (key,)
+        ).fetchone()
+
+    def _db_set(self, key: str, value: str, created_at: float):
+        db = self._connect()
+        db.execute(
+            "INSERT OR REPLACE INTO translations (key, value, created_at) VALUES (?, ?, ?)",
+            (key, value, created_at)
+        )
+        db.commit()
+
+    def _db_close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+# Глобальный экземпляр
+translation_cache = TranslationCache(TRANSLATION_CACHE_SIZE, TRANSLATION_CACHE_TTL, TRANSLATION_CACHE_DB)
@@ -0,0 +1,240 @@
+# sharding.py - обработка обновлений в нескольких процессах
+#
+# Фронт-процесс получает обновления (polling или webhook) и передает каждое
+# процессу-шарду номер user_id % SHARD_WORKERS. Один пользователь всегда
+# попадает в один шард, поэтому его обновления идут по порядку, а кэши
+# процесса (пользователи, FSM, таймеры рекламы) остаются согласованными.
+# Шарды работают с общей базой и общим хранилищем FSM. Фоновые задачи
+# (возврат резервов, продолжение рассылок) выполняет только шард 0.
+import asyncio
+import logging
+import multiprocessing
+import queue
+import signal
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiogram import Bot, Dispatcher
+
+from config import BOT_TOKEN, BOT_MODE, DATABASE_URL, SHARD_WORKERS, SHARD_QUEUE_SIZE
+from webhook import UpdateQueue, run_webhook, update_key
+
+logger = logging.getLogger(__name__)
+
+# Сообщения фронта и шардов друг другу
+MSG_UPDATE = "update"
+MSG_INVALIDATE = "invalidate"
+MSG_STOP = "stop"
+
+POLLING_TIMEOUT = 30
+WATCH_INTERVAL = 5.0
+
+SetupFactory = Callable[[int, int], Awaitable[Tuple[Bot, Dispatcher]]]
+TeardownFactory = Callable[[Bot, Dispatcher], Awaitable[None]]
+
+
+def shard_for(key: int, shards: int) -> int:
+    return key % shards
+
+
+# ========== ПРОЦЕСС-ШАРД ==========
+
+def _worker_main(
+    index: int,
+    queues: List[multiprocessing.Queue],
+    ready,
+    setup: SetupFactory,
+    teardown: Optional[TeardownFactory]
+):
+    # Ctrl+C получает вся группа процессов; шард останавливает фронт
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_serve(index, queues, ready, setup, teardown))
+
+
+async def _serve(
+    index: int,
+    queues: List[multiprocessing.Queue],
+    ready,
+    setup: SetupFactory,
+    teardown: Optional[TeardownFactory]
+):
+    from database import user_cache
+
+    shards = len(queues)
+    inbox = queues[index]
+    bot, dp = await setup(index, shards)
+
+    def forward_invalidation(telegram_id: int):
+        # Пользователя кэширует шард, который его обслуживает
+        owner = shard_for(telegram_id, shards)
+        if owner != index:
+            try:
+                queues[owner].put_nowait((MSG_INVALIDATE, telegram_id))
+            except queue.Full:
+                # Запись в кэше шарда истечет сама через USER_CACHE_TTL
+                logger.debug(f"Очередь шарда {owner} заполнена, сброс кэша {telegram_id} пропущен")
+
+    user_cache.on_invalidate = forward_invalidation
+
+    updates = UpdateQueue(dp, bot)
+    await updates.start()
+    ready.set()
+    logger.info(f"✅ Шард {index} готов")
+
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            # Ждем в потоке первое сообщение, остальные забираем без ожидания
+            messages = [await loop.run_in_executor(None, inbox.get)]
+            try:
+                while len(messages) < 100:
+                    messages.append(inbox.get_nowait())
+            except queue.Empty:
+                pass
+
+            for kind, payload in messages:
+                if kind == MSG_UPDATE:
+                    await updates.put(payload)
+                elif kind == MSG_INVALIDATE:
+                    user_cache.invalidate(payload, notify=False)
+                elif kind == MSG_STOP:
+                    return
+    finally:
+        await updates.stop()
+        if teardown is not None:
+            await teardown(bot, dp)
+        logger.info(f"🛑 Шард {index} остановлен")
+
+
+# ========== ФРОНТ ==========
+
+class ShardRouter:
+    """Запускает процессы-шарды и раздает им обновления.
+
+    У каждого шарда своя очередь multiprocessing; если она заполнена,
+    put() ждет, и прием новых обновлений замедляется. Упавший шард
+    перезапускается с той же очередью.
+    """
+
+    def __init__(
+        self,
+        setup: SetupFactory,
+        teardown: Optional[TeardownFactory] = None,
+        workers: int = SHARD_WORKERS,
+        queue_size: int = SHARD_QUEUE_SIZE
+    ):
+        self.setup = setup
+        self.teardown = teardown
+        self.workers = workers
+        # spawn: шарды не наследуют цикл событий и соединения фронта
+        self._context = multiprocessing.get_context("spawn")
+        self._queues = [self._context.Queue(queue_size) for _ in range(workers)]
+        self._ready = [self._context.Event() for _ in range(workers)]
+        self._processes: List[Optional[multiprocessing.Process]] = [None] * workers
+        self._watcher: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        try:
+            return sum(q.qsize() for q in self._queues)
+        except NotImplementedError:
+            # macOS не умеет qsize()
+            return 0
+
+    def start(self):
+        for index in range(self.workers):
+            self._spawn(index)
+        self._watcher = asyncio.create_task(self._watch())
+        logger.info(f"🚀 Запущено шардов: {self.workers}")
+
+    def _spawn(self, index: int):
+        self._ready[index].clear()
+        process = self._context.Process(
+            target=_worker_main,
+            args=(index, self._queues, self._ready[index], self.setup, self.teardown),
+            name=f"shard-{index}"
+        )
+        process.start()
+        self._processes[index] = process
+
+    async def wait_ready(self, timeout: float = 60.0):
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(*(
+            loop.run_in_executor(None, event.wait, timeout) for event in self._ready
+        ))
+        if not all(results):
+            raise RuntimeError("Не все шарды запустились")
+
+    async def put(self, data: Dict[str, Any]):
+        """Передает обновление (JSON от Telegram) шарду его пользователя"""
+        target = self._queues[shard_for(update_key(data), self.workers)]
+        message = (MSG_UPDATE, data)
+        try:
+            target.put_nowait(message)
+        except queue.Full:
+            await asyncio.get_running_loop().run_in_executor(None, target.put, message)
+
+    async def stop(self, timeout: float = 30.0):
+        """Шарды дорабатывают свои очереди и завершаются"""
+        if self._watcher:
+            self._watcher.cancel()
+            await asyncio.gather(self._watcher, return_exceptions=True)
+            self._watcher = None
+
+        loop = asyncio.get_running_loop()
+        for target in self._queues:
+            await loop.run_in_executor(None, target.put, (MSG_STOP, None))
+        for process in self._processes:
+            if process is None:
+                continue
+            await loop.run_in_executor(None, process.join, timeout)
+            if process.is_alive():
+                logger.warning(f"⚠️ {process.name} не остановился за {timeout} с, завершаем")
+                process.terminate()
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(WATCH_INTERVAL)
+            for index, process in enumerate(self._processes):
+                if process is not None and not process.is_alive():
+                    logger.error(f"❌ {process.name} завершился с кодом {process.exitcode}, перезапускаем")
+                    self._spawn(index)
+
+
+async def poll_updates(bot: Bot, sink, allowed_updates: Optional[List[str]] = None):
+    """Long polling во фронте: обновления уходят в sink.put() в виде JSON"""
+    offset = None
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=POLLING_TIMEOUT, allowed_updates=allowed_updates)
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения обновлений: {e}")
+            await asyncio.sleep(5)
+            continue
+
+        for update in updates:
+            offset = update.update_id + 1
+            await sink.put(update.model_dump(mode="json", by_alias=True, exclude_none=True))
+
+
+async def run_sharded(
+    setup: SetupFactory,
+    teardown: Optional[TeardownFactory] = None,
+    allowed_updates: Optional[List[str]] = None,
+    workers: int = SHARD_WORKERS
+):
+    """Фронт: запускает шарды и принимает обновления до отмены"""
+    if DATABASE_URL.startswith("sqlite"):
+        logger.warning("⚠️ Несколько процессов пишут в SQLite - под нагрузкой лучше PostgreSQL")
+
+    router = ShardRouter(setup, teardown, workers=workers)
+    router.start()
+    bot = Bot(token=BOT_TOKEN)
+    try:
+        await router.wait_ready()
+        if BOT_MODE == "webhook":
+            await run_webhook(bot, router, allowed_updates)
+        else:
+            await bot.delete_webhook()
+            await poll_updates(bot, router, allowed_updates)
+    finally:
+        await router.stop()
+        await bot.session.close()
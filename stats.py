@@ -0,0 +1,184 @@
+# stats.py - статистика для админки
+#
+# Дневные итоги (таблица daily_stats) обновляются в той же транзакции, что
+# и исходные записи: после flush новые пользователи, заказы и платежи,
+# перешедшие в статус completed, прибавляются к строке своего дня одним
+# upsert. Панель админки читает несколько строк daily_stats вместо
+# COUNT/SUM по всем таблицам, а результат еще и кэшируется на STATS_CACHE_TTL.
+import asyncio
+import logging
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import pytz
+from sqlalchemy import event, func, inspect, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from config import STATS_CACHE_TTL
+from database import DailyStats, Order, Payment, User, dialect_insert
+
+logger = logging.getLogger(__name__)
+
+
+def utc_day(moment: Optional[datetime]) -> date:
+    """День по UTC; наивные даты в базе уже хранятся в UTC"""
+    if moment is None:
+        return datetime.now(pytz.UTC).date()
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(pytz.UTC)
+    return moment.date()
+
+
+# ========== ИНКРЕМЕНТАЛЬНОЕ ОБНОВЛЕНИЕ ==========
+
+def _payment_completed(payment: Payment, is_new: bool) -> bool:
+    if payment.status != "completed":
+        return False
+    if is_new:
+        return True
+    # Считаем только переход в completed, а не любое изменение завершенного платежа
+    history = inspect(payment).attrs.status.history
+    return bool(history.added) and "completed" not in history.deleted
+
+
+@event.listens_for(Session, "after_flush")
+def _bump_daily_stats(session: Session, flush_context):
+    """Прибавляет записанное во flush к дневным итогам"""
+    deltas: Dict[date, Counter] = defaultdict(Counter)
+
+    for obj, is_new in [(obj, True) for obj in session.new] + [(obj, False) for obj in session.dirty]:
+        if is_new and isinstance(obj, User):
+            deltas[utc_day(obj.created_at)]["new_users"] += 1
+        elif is_new and isinstance(obj, Order):
+            deltas[utc_day(obj.created_at)]["orders"] += 1
+        elif isinstance(obj, Payment) and _payment_completed(obj, is_new):
+            # completed_at может быть еще не задан (autoflush посреди подтверждения):
+            # переход в completed случился в этот flush, то есть сейчас
+            completed_at = obj.completed_at or (obj.created_at if is_new else None)
+            counts = deltas[utc_day(completed_at)]
+            counts["payments_count"] += 1
+            counts["payments_kopecks"] += round((obj.amount or 0) * 100)
+
+    if not deltas:
+        return
+
+    connection = session.connection()
+    for day, counts in deltas.items():
+        connection.execute(_upsert(day, counts))
+
+
+def _upsert(day: date, counts: Counter):
+    statement = dialect_insert(DailyStats).values(day=day, **counts)
+    return statement.on_conflict_do_update(
+        index_elements=[DailyStats.day],
+        set_={name: getattr(DailyStats, name) + statement.excluded[name] for name in counts}
+    )
+
+
+async def record_completed_payment(session: AsyncSession, completed_at: datetime, amount: float):
+    """Учитывает платеж, завершенный UPDATE-запросом в обход ORM (after_flush его не видит)"""
+    counts = Counter(payments_count=1, payments_kopecks=round((amount or 0) * 100))
+    await session.execute(_upsert(utc_day(completed_at), counts))
+
+
+# ========== ЧТЕНИЕ С КЭШЕМ ==========
+
+@dataclass
+class StatsSnapshot:
+    users: int = 0
+    orders: int = 0
+    payments_count: int = 0
+    payments_kopecks: int = 0
+    today_users: int = 0
+    today_orders: int = 0
+    today_payments_kopecks: int = 0
+    week_users: int = 0
+    # (день, платежей, копеек) за последние 7 дней, новые сверху
+    recent_payments: List[Tuple[date, int, int]] = field(default_factory=list)
+
+    @property
+    def payments_sum(self) -> float:
+        return self.payments_kopecks / 100
+
+    @property
+    def today_payments_sum(self) -> float:
+        return self.today_payments_kopecks / 100
+
+
+class StatsCache:
+    """Сводка для админки с коротким TTL.
+
+    Промах кэша - два запроса к daily_stats: сумма по всем дням и
+    диапазон последних 7 дней по первичному ключу.
+    """
+
+    def __init__(self, ttl: float = STATS_CACHE_TTL):
+        self.ttl = ttl
+        self._snapshot: Optional[StatsSnapshot] = None
+        self._loaded_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def get(self, session: AsyncSession) -> StatsSnapshot:
+        if self._fresh():
+            return self._snapshot
+        async with self._lock:
+            # Пока ждали, сводку мог загрузить другой запрос
+            if not self._fresh():
+                self._snapshot = await self._load(session)
+                self._loaded_at = time.monotonic()
+        return self._snapshot
+
+    def invalidate(self):
+        self._snapshot = None
+
+    def _fresh(self) -> bool:
+        return self._snapshot is not None and time.monotonic() - self._loaded_at < self.ttl
+
+    async def _load(self, session: AsyncSession) -> StatsSnapshot:
+        totals = (await session.execute(
+            select(
+                func.coalesce(func.sum(DailyStats.new_users), 0),
+                func.coalesce(func.sum(DailyStats.orders), 0),
+                func.coalesce(func.sum(DailyStats.payments_count), 0),
+                func.coalesce(func.sum(DailyStats.payments_kopecks), 0)
+            )
+        )).one()
+
+        today = utc_day(None)
+        recent = (await session.execute(
+            select(
+                DailyStats.day,
+                DailyStats.new_users,
+                DailyStats.orders,
+                DailyStats.payments_count,
+                DailyStats.payments_kopecks
+            )
+            .where(DailyStats.day > today - timedelta(days=7))
+            .order_by(DailyStats.day.desc())
+        )).all()
+
+        snapshot = StatsSnapshot(
+            users=totals[0],
+            orders=totals[1],
+            payments_count=totals[2],
+            payments_kopecks=totals[3],
+            week_users=sum(row.new_users for row in recent),
+            recent_payments=[
+                (row.day, row.payments_count, row.payments_kopecks)
+                for row in recent if row.payments_count
+            ]
+        )
+        for row in recent:
+            if row.day == today:
+                snapshot.today_users = row.new_users
+                snapshot.today_orders = row.orders
+                snapshot.today_payments_kopecks = row.payments_kopecks
+        return snapshot
+
+
+# Глобальный экземпляр
+stats_cache = StatsCache()
@@ -0,0 +1,249 @@
+# tests/test_fsm_storage.py
+"""Хранилища FSM: отложенная запись, запись при закрытии и чтение после перезапуска.
+
+Redis проверяется на заглушке в памяти (или fakeredis, если установлен);
+с переменной FSM_TEST_REDIS_URL - еще и на настоящем сервере.
+"""
+import asyncio
+import os
+import sqlite3
+from datetime import datetime
+
+import pytest
+from aiogram.fsm.storage.base import StorageKey
+
+from fsm_storage import CachedStorage, RedisCachedStorage, SQLiteStorage
+
+KEY = StorageKey(bot_id=1, chat_id=100, user_id=100)
+OTHER_KEY = StorageKey(bot_id=1, chat_id=200, user_id=200)
+STARTED_AT = datetime(2026, 10, 17, 12, 30)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+# ========== ЗАГЛУШКА REDIS ==========
+
+class FakeRedisServer:
+    """Данные "сервера": общие для всех клиентов, как у настоящего Redis"""
+
+    def __init__(self):
+        self.values = {}
+
+
+class FakePipeline:
+    def __init__(self, server: FakeRedisServer):
+        self.server = server
+        self.commands = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.commands = []
+
+    def set(self, key, value):
+        self.commands.append(("set", key, value))
+
+    def delete(self, key):
+        self.commands.append(("delete", key, None))
+
+    async def execute(self):
+        for command, key, value in self.commands:
+            if command == "set":
+                self.server.values[key] = value.encode("utf-8") if isinstance(value, str) else value
+            else:
+                self.server.values.pop(key, None)
+        self.commands = []
+
+
+class FakeRedis:
+    def __init__(self, server: FakeRedisServer):
+        self.server = server
+        self.closed = False
+
+    async def mget(self, *keys):
+        return [self.server.values.get(key) for key in keys]
+
+    def pipeline(self, transaction: bool = True):
+        return FakePipeline(self.server)
+
+    async def aclose(self):
+        self.closed = True
+
+
+def redis_factory():
+    """Возвращает функцию, создающую клиента к одному и тому же "серверу" """
+    try:
+        import fakeredis
+        from fakeredis import aioredis
+    except ImportError:
+        server = FakeRedisServer()
+        return lambda: FakeRedis(server)
+    fake_server = fakeredis.FakeServer()
+    return lambda: aioredis.FakeRedis(server=fake_server)
+
+
+# ========== ОБЩИЕ ПРОВЕРКИ ==========
+
+async def fill(storage: CachedStorage):
+    await storage.set_state(KEY, "ImageGeneration:waiting_for_prompt")
+    await storage.set_data(KEY, {"cost": 40, "tier": "image_4k", "started_at": STARTED_AT})
+    await storage.set_state(OTHER_KEY, "TextGeneration:waiting_for_prompt")
+
+
+async def check_reloaded(storage: CachedStorage):
+    assert await storage.get_state(KEY) == "ImageGeneration:waiting_for_prompt"
+    assert await storage.get_data(KEY) == {"cost": 40, "tier": "image_4k", "started_at": STARTED_AT}
+    assert await storage.get_state(OTHER_KEY) == "TextGeneration:waiting_for_prompt"
+    assert await storage.get_data(OTHER_KEY) == {}
+
+
+# ========== SQLITE ==========
+
+def sqlite_rows(path: str):
+    with sqlite3.connect(path) as db:
+        return dict(db.execute("SELECT key, state FROM fsm_states").fetchall())
+
+
+def test_sqlite_writes_on_close_and_reloads_after_restart(tmp_path):
+    path = str(tmp_path / "fsm.db")
+
+    async def scenario():
+        storage = SQLiteStorage(path, flush_interval=3600)
+        await fill(storage)
+        await storage.close()
+
+        restarted = SQLiteStorage(path, flush_interval=3600)
+        await check_reloaded(restarted)
+        await restarted.close()
+
+    run(scenario())
+    assert len(sqlite_rows(path)) == 2
+
+
+def test_sqlite_writes_behind_in_one_batch(tmp_path):
+    path = str(tmp_path / "fsm.db")
+
+    async def scenario():
+        storage = SQLiteStorage(path, flush_interval=3600)
+        batches = []
+        store = storage._store
+
+        async def recording_store(records):
+            batches.append(records)
+            await store(records)
+
+        storage._store = recording_store
+
+        for cost in (10, 20, 30):
+            await storage.set_data(KEY, {"cost": cost})
+        await storage.set_state(KEY, "TextGeneration:waiting_for_prompt")
+        # До сброса в базу ничего не ушло, а чтение идет из кэша
+        assert batches == []
+        assert await storage.get_data(KEY) == {"cost": 30}
+
+        await storage.flush()
+        await storage.close()
+        return batches
+
+    batches = run(scenario())
+    # Четыре изменения одного ключа - одна запись в одной пачке
+    assert len(batches) == 1
+    assert [(state, data) for _, state, data in batches[0]] == [("TextGeneration:waiting_for_prompt", {"cost": 30})]
+
+
+def test_sqlite_flushes_periodically(tmp_path):
+    path = str(tmp_path / "fsm.db")
+
+    async def scenario():
+        storage = SQLiteStorage(path, flush_interval=0.05)
+        await storage.set_state(KEY, "TextGeneration:waiting_for_prompt")
+        await asyncio.sleep(0.3)
+        rows = sqlite_rows(path)
+        await storage.close()
+        return rows
+
+    assert list(run(scenario()).values()) == ["TextGeneration:waiting_for_prompt"]
+
+
+def test_sqlite_clear_deletes_row(tmp_path):
+    path = str(tmp_path / "fsm.db")
+
+    async def scenario():
+        storage = SQLiteStorage(path, flush_interval=3600)
+        await fill(storage)
+        await storage.flush()
+        await storage.set_state(KEY, None)
+        await storage.set_data(KEY, {})
+        await storage.close()
+
+        restarted = SQLiteStorage(path, flush_interval=3600)
+        state, data = await restarted.get_state(KEY), await restarted.get_data(KEY)
+        await restarted.close()
+        return state, data
+
+    assert run(scenario()) == (None, {})
+    assert len(sqlite_rows(path)) == 1
+
+
+# ========== REDIS ==========
+
+def test_redis_writes_on_close_and_reloads_after_restart():
+    connect = redis_factory()
+
+    async def scenario():
+        storage = RedisCachedStorage(redis=connect(), flush_interval=3600)
+        await fill(storage)
+        # Отложенная запись: до закрытия на "сервере" пусто
+        assert await connect().mget(storage.key_builder.build(KEY) + ":state") == [None]
+        await storage.close()
+
+        restarted = RedisCachedStorage(redis=connect(), flush_interval=3600)
+        await check_reloaded(restarted)
+        await restarted.close()
+
+    run(scenario())
+
+
+def test_redis_clear_deletes_keys():
+    connect = redis_factory()
+
+    async def scenario():
+        storage = RedisCachedStorage(redis=connect(), flush_interval=3600)
+        await fill(storage)
+        await storage.flush()
+        await storage.set_state(KEY, None)
+        await storage.set_data(KEY, {})
+        await storage.close()
+
+        key = storage.key_builder.build(KEY)
+        return await connect().mget(f"{key}:state", f"{key}:data")
+
+    assert run(scenario()) == [None, None]
+
+
+@pytest.mark.skipif(not os.getenv("FSM_TEST_REDIS_URL"), reason="FSM_TEST_REDIS_URL не задан")
+def test_redis_server_reloads_after_restart():
+    pytest.importorskip("redis")
+    url = os.environ["FSM_TEST_REDIS_URL"]
+
+    async def scenario():
+        storage = RedisCachedStorage(url, flush_interval=3600)
+        await fill(storage)
+        await storage.close()
+
+        restarted = RedisCachedStorage(url, flush_interval=3600)
+        await check_reloaded(restarted)
+        await restarted.set_state(KEY, None)
+        await restarted.set_data(KEY, {})
+        await restarted.set_state(OTHER_KEY, None)
+        await restarted.close()
+
+    run(scenario())
+
+
+def test_cached_storage_requires_backend():
+    with pytest.raises(TypeError):
+        CachedStorage()
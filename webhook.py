@@ -0,0 +1,215 @@
+# webhook.py - прием обновлений через webhook
+#
+# aiohttp-сервер работает в том же цикле событий, что и диспетчер: без
+# отдельных потоков Flask и самопинга. Telegram получает ответ сразу после
+# того, как обновление встало в очередь, а одновременно обрабатывается
+# не больше WEBHOOK_WORKERS обновлений. Обновления одного
+# пользователя обрабатываются по порядку. Когда очередь заполнена, запрос
+# Telegram ждет свободного места, и он сам снижает темп доставки.
+import asyncio
+import hmac
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Set
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from config import (
+    WEBHOOK_BASE_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE,
+    WEB_SERVER_HOST, WEB_SERVER_PORT
+)
+from services.scheduler import update_detach
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def update_key(data: Dict[str, Any]) -> int:
+    """Пользователь, от которого пришло обновление (для чатов без него - чат).
+
+    У обновлений без отправителя и чата (опросы и т.п.) упорядочивать нечего,
+    для них ключ - update_id, и они расходятся по разным цепочкам и шардам.
+    """
+    for value in data.values():
+        if isinstance(value, dict):
+            user = value.get("from") or value.get("user")
+            if user:
+                return user["id"]
+            chat = value.get("chat")
+            if chat:
+                return chat["id"]
+    return data.get("update_id", 0)
+
+
+class UpdateQueue:
+    """Очередь обновлений с ограниченным числом одновременных обработчиков.
+
+    Обновления одного пользователя выстраиваются в цепочку и обрабатываются
+    по порядку, цепочки разных пользователей идут параллельно, но не больше
+    workers обработчиков сразу. Обработчик, ушедший в очередь генераций,
+    отпускает слот и цепочку (см. update_detach), как в polling-режиме.
+    Нажатия кнопок идут в той же цепочке: отмена генерации все равно не ждет,
+    потому что ожидающий в планировщике обработчик цепочку уже отпустил.
+    Принятых, но не начатых обновлений не больше maxsize - дальше put() ждет.
+    """
+
+    def __init__(
+        self,
+        dp: Dispatcher,
+        bot: Bot,
+        workers: int = WEBHOOK_WORKERS,
+        maxsize: int = WEBHOOK_QUEUE_SIZE
+    ):
+        self.dp = dp
+        self.bot = bot
+        self._slots = asyncio.Semaphore(workers)
+        self._capacity = asyncio.Semaphore(maxsize)
+        self._chains: Dict[int, Deque[Update]] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._pending = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._started = False
+
+    def __len__(self) -> int:
+        return self._pending
+
+    async def put(self, data: Dict[str, Any]):
+        """Ставит в очередь обновление в виде JSON от Telegram"""
+        update = Update.model_validate(data, context={"bot": self.bot})
+        await self._capacity.acquire()
+        self._pending += 1
+        self._idle.clear()
+
+        key = update_key(data)
+        chain = self._chains.get(key)
+        if chain is not None:
+            chain.append(update)
+        else:
+            self._chains[key] = deque([update])
+            self._spawn(self._run_chain(key))
+
+    async def start(self):
+        if not self._started:
+            await self.dp.emit_startup(bot=self.bot, dispatcher=self.dp)
+            self._started = True
+
+    async def stop(self, timeout: float = 10.0):
+        """Дорабатывает принятые обновления (не дольше timeout) и останавливает обработчиков"""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"⚠️ Не обработано обновлений при остановке: {len(self)}")
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self._started:
+            self._started = False
+            await self.dp.emit_shutdown(bot=self.bot, dispatcher=self.dp)
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_chain(self, key: int):
+        chain = self._chains[key]
+        try:
+            while chain:
+                await self._handle(chain[0])
+                chain.popleft()
+        finally:
+            del self._chains[key]
+
+    async def _handle(self, update: Update):
+        """Возвращается, когда обработчик закончил или отпустил слот"""
+        await self._slots.acquire()
+        self._capacity.release()
+        released = asyncio.Event()
+
+        def detach():
+            if not released.is_set():
+                released.set()
+                self._slots.release()
+
+        self._spawn(self._feed(update, detach))
+        await released.wait()
+
+    async def _feed(self, update: Update, detach: Callable[[], None]):
+        # Генерация вызовет detach() до ожидания в планировщике
+        update_detach.set(detach)
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception as e:
+            logger.error(f"❌ Ошибка обработки обновления {update.update_id}: {e}", exc_info=True)
+        finally:
+            detach()
+            self._pending -= 1
+            if not self._pending:
+                self._idle.set()
+
+
+def create_app(updates) -> web.Application:
+    """Приложение с webhook и служебными маршрутами из keep_alive.
+
+    updates - UpdateQueue или любой приемник с put(data) и len().
+    """
+    started_at = time.time()
+
+    async def handle_update(request: web.Request) -> web.Response:
+        if WEBHOOK_SECRET and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), WEBHOOK_SECRET):
+            return web.Response(status=401)
+        await updates.put(await request.json())
+        return web.Response()
+
+    async def health(request: web.Request) -> web.Response:
+        return web.json_response({
+            "status": "healthy",
+            "service": "telegram-ai-bot",
+            "timestamp": time.time(),
+            "uptime": round(time.time() - started_at),
+            "queued_updates": len(updates),
+            "environment": os.environ.get('REPL_ID', 'production')
+        })
+
+    async def ping(request: web.Request) -> web.Response:
+        return web.Response(text="pong")
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handle_update)
+    app.router.add_get("/health", health)
+    app.router.add_get("/ping", ping)
+    return app
+
+
+async def run_webhook(bot: Bot, updates, allowed_updates: Optional[List[str]] = None):
+    """Поднимает сервер, регистрирует webhook и работает до отмены"""
+    if not WEBHOOK_BASE_URL:
+        raise RuntimeError("WEBHOOK_BASE_URL не задан - webhook-режим невозможен")
+
+    runner = web.AppRunner(create_app(updates), handle_signals=False)
+    await runner.setup()
+    await web.TCPSite(runner, WEB_SERVER_HOST, WEB_SERVER_PORT).start()
+    logger.info(f"🚀 Веб-сервер запущен на {WEB_SERVER_HOST}:{WEB_SERVER_PORT}")
+
+    try:
+        await bot.set_webhook(
+            url=WEBHOOK_BASE_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET or None,
+            allowed_updates=allowed_updates,
+            max_connections=min(100, WEBHOOK_WORKERS)
+        )
+        logger.info(f"🔗 Webhook установлен: {WEBHOOK_BASE_URL.rstrip('/')}{WEBHOOK_PATH}")
+
+        # Работаем до отмены задачи (Ctrl+C или остановка процесса)
+        await asyncio.Event().wait()
+    finally:
+        # Webhook не удаляем: после перезапуска Telegram доставит накопленное
+        await runner.cleanup()
+        logger.info("🛑 Веб-сервер остановлен")